@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Микробенчмарк разбора шапки дела в индексаторе:
+  legacy — parse_header_legacy (поиск ярлыков по первым HEADER_SLICE символам);
+  fast   — parse_header_fields (один шаблон под формат STEP_TWO, откат на legacy).
+
+Корпус — начала TXT из SRC_DIR индексатора (и «X.txt», и «X.indexed.txt»)
+или синтетические шапки в формате steptwo_handler.build_header.
+Заодно проверяем, что на файлах с быстрой шапкой оба пути дают одно и то же.
+
+    python bench_header.py --files 2000 --repeat 5
+    python bench_header.py --synthetic 10000
+"""
+
+import sys
+import time
+import random
+import pathlib
+import argparse
+from typing import List
+
+import stepthree_index as idx
+
+COURTS = ("Арбитражный суд города Москвы", "Арбитражный суд Московской области",
+          "Арбитражный суд города Санкт-Петербурга и Ленинградской области", "N/A")
+ORGS = ("ООО «Ромашка»", "АО \"Лютик\"", "ПАО Сбербанк", "ООО Лизинг-Трейд",
+        "ИП Иванов Иван Иванович", "АО «ВТБ Лизинг»")
+
+
+def synthetic_header(rng: random.Random) -> str:
+    """Как steptwo_handler.build_header (модуль не импортируем — он запускает STEP_TWO)."""
+    case_id = f"А{rng.randint(10, 99)}-{rng.randint(1, 999999)}/{rng.randint(2015, 2025)}"
+    lines = [
+        f"Номер дела: {case_id}",
+        f"Суд: {rng.choice(COURTS)}",
+        f"Истец: {rng.choice(ORGS)}",
+        f"Ответчик: {'; '.join(rng.sample(ORGS, rng.randint(1, 3)))}",
+    ]
+    border = "=" * 80
+    title = " ШАПКА ДЕЛА "
+    pad = (len(border) - len(title)) // 2
+    title_line = f"{'=' * pad}{title}{'=' * (len(border) - len(title) - pad)}"
+    body = "Текст судебного акта. " * 300
+    return f"{title_line}\n" + "\n".join(lines) + f"\n{border}\n\n{body}"
+
+
+def load_corpus(n_files: int) -> List[str]:
+    out = []
+    for path in sorted(pathlib.Path(idx.SRC_DIR).glob("*.txt"))[:n_files]:
+        try:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                out.append(f.read(idx.HEADER_SLICE))
+        except OSError:
+            continue
+    return out
+
+
+def bench(fn, corpus: List[str], repeat: int) -> float:
+    """Лучшее из repeat время одного прохода по корпусу, сек."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Бенчмарк разбора шапки дела")
+    ap.add_argument("--files", type=int, default=2000, help="сколько TXT взять из SRC_DIR")
+    ap.add_argument("--synthetic", type=int, default=0, help="вместо файлов — N синтетических шапок")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    if args.synthetic:
+        rng = random.Random(42)
+        corpus = [synthetic_header(rng) for _ in range(args.synthetic)]
+    else:
+        corpus = load_corpus(args.files)
+    if not corpus:
+        print(f"💥 Корпус пуст: нет TXT в {idx.SRC_DIR} (или запустите с --synthetic N)")
+        sys.exit(1)
+
+    fast_hits = mismatches = 0
+    for text in corpus:
+        fast = idx.parse_header_fast(text)
+        if fast is None:
+            continue
+        fast_hits += 1
+        if fast != idx.parse_header_legacy(text):
+            mismatches += 1
+
+    t_legacy = bench(idx.parse_header_legacy, corpus, args.repeat)
+    t_fast = bench(idx.parse_header_fields, corpus, args.repeat)
+    n = len(corpus)
+
+    print(f"📄 Шапок: {n}, в формате STEP_TWO: {fast_hits} ({fast_hits / n:.0%})")
+    print(f"   legacy: {t_legacy / n * 1e6:8.1f} мкс/шапка")
+    print(f"   fast:   {t_fast / n * 1e6:8.1f} мкс/шапка  (×{t_legacy / max(t_fast, 1e-9):.1f})")
+    if mismatches:
+        print(f"⚠ Расхождений fast/legacy: {mismatches}")
+        sys.exit(2)
+    print("✔ Результаты fast и legacy совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Офлайн-бенчмарк recall двухступенчатого поиска (small → rescore по full)
+на нашей коллекции. Эмбеддинги НЕ запрашиваются: запросами служат
+векторы случайной выборки уже проиндексированных чанков.
+
+Эталон — точный (exact=True) поиск по полному вектору "full".
+Для каждого размера первой ступени считаем recall@K и задержку, плюс
+recall одного "small" без пересчёта — чтобы видеть, что даёт 2-я ступень.
+
+    python bench_recall.py --samples 200 --k 10 --candidates 50,100,200,400
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+# === Параметры подключения (как в recreate.py) ===
+QDRANT_HOST = "IP"
+QDRANT_PORT = "PORT"
+QDRANT_KEY  = (
+    "API KEY"
+)
+USE_HTTPS   = False
+
+COLL = "kad_cases"   # размер вектора small берём из схемы коллекции
+
+
+def sample_points(qc: QdrantClient, n: int):
+    """Первые n точек scroll — id у нас uuid4, так что выборка и так случайная."""
+    pts, next_off = [], None
+    while len(pts) < n:
+        batch, next_off = qc.scroll(
+            collection_name=COLL,
+            limit=min(256, n - len(pts)),
+            with_payload=False,
+            with_vectors=["full"],
+            offset=next_off,
+        )
+        pts.extend(batch)
+        if next_off is None:
+            break
+    return pts
+
+
+def exact_top(qc: QdrantClient, pid, vec, k: int):
+    hits = qc.search(
+        collection_name=COLL,
+        query_vector=models.NamedVector(name="full", vector=vec),
+        limit=k + 1,
+        search_params=models.SearchParams(exact=True),
+    )
+    return [h.id for h in hits if h.id != pid][:k]
+
+
+def two_tier_top(qc: QdrantClient, pid, vec, k: int, candidates: int, small_dim: int,
+                 rescore: bool = True):
+    hits = qc.search(
+        collection_name=COLL,
+        query_vector=models.NamedVector(name="small", vector=vec[:small_dim]),
+        limit=candidates + 1,
+        with_vectors=["full"] if rescore else False,
+    )
+    hits = [h for h in hits if h.id != pid]
+    if rescore and hits:
+        q = np.asarray(vec, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        full = np.asarray([h.vector["full"] for h in hits], dtype=np.float32)
+        order = np.argsort(-(full @ q))
+        hits = [hits[i] for i in order]
+    return [h.id for h in hits[:k]]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall двухступенчатого поиска small→full")
+    ap.add_argument("--samples", type=int, default=200, help="сколько запросов")
+    ap.add_argument("--k", type=int, default=10, help="recall@K")
+    ap.add_argument("--candidates", default="50,100,200,400",
+                    help="размеры первой ступени через запятую")
+    args = ap.parse_args()
+    cand_list = [int(x) for x in args.candidates.split(",") if x.strip()]
+
+    qc = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_KEY,
+                      https=USE_HTTPS, timeout=120.0)
+
+    info = qc.get_collection(COLL)
+    vectors = info.config.params.vectors
+    if not isinstance(vectors, dict) or "small" not in vectors:
+        print(f"💥 В {COLL} нет именованного вектора small — пересоздайте с SMALL_DIM")
+        sys.exit(1)
+    small_dim = vectors["small"].size
+
+    pts = sample_points(qc, args.samples)
+    print(f"ℹ {COLL}: точек {info.points_count}, запросов {len(pts)}, K={args.k}, small={small_dim}")
+
+    truth = {}
+    t_exact = []
+    for p in pts:
+        t0 = time.perf_counter()
+        truth[p.id] = set(exact_top(qc, p.id, p.vector["full"], args.k))
+        t_exact.append(time.perf_counter() - t0)
+
+    rows = [("exact full", 1.0, t_exact)]
+    for c in cand_list:
+        for rescore in (False, True):
+            rec, lat = [], []
+            for p in pts:
+                t0 = time.perf_counter()
+                got = two_tier_top(qc, p.id, p.vector["full"], args.k, c, small_dim,
+                                   rescore=rescore)
+                lat.append(time.perf_counter() - t0)
+                gt = truth[p.id]
+                rec.append(len(gt.intersection(got)) / len(gt) if gt else 1.0)
+            name = f"small@{c}" + (" → full" if rescore else "")
+            rows.append((name, float(np.mean(rec)), lat))
+
+    print(f"\n{'режим':<22}{'recall@' + str(args.k):>12}{'avg, мс':>10}{'p95, мс':>10}")
+    for name, rec, lat in rows:
+        ms = np.asarray(lat) * 1000
+        print(f"{name:<22}{rec:>12.3f}{ms.mean():>10.1f}{np.percentile(ms, 95):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Единый канонический вид номера дела для всех стадий: парсера (STEP_ONE),
+сборщика (STEP_TWO), индексатора (STEP_THREE), сервера чата и служебных
+скриптов. Раньше каждая стадия нормализовала по-своему (кириллица/латиница,
+«/» или «_»), и фильтр case_id на сервере промахивался.
+
+Канон — как на kad.arbitr.ru:
+    «a40 – 12345_2024», «A40-12345-2024», «А40-12345/2024» → «А40-12345/2024»
+    «SIP-715-2022», «сип-715/2022»                        → «СИП-715/2022»
+    «СИП-715»                                              → «СИП-715»
+Буквы кириллические, между кодом суда и номером «-», перед годом «/».
+
+Без внешних зависимостей — импортируется отовсюду, включая ver.s/.server.
+"""
+
+import re
+from typing import List, Optional
+
+# Один общий шаблон: код суда (А40 / СИП, кириллица или латиница, любой
+# регистр), номер, необязательный год через любой из разделителей.
+# Год обязателен для «А…» и необязателен для СИП.
+_DASH = r"\s*[-‐–—−]\s*"
+_YEAR_SEP = r"\s*[-‐–—−/_\\]\s*"
+CASE_RE = re.compile(
+    rf"(?<![0-9A-Za-zА-Яа-яЁё])"   # «_» перед номером допустим: «решение_А40-1/2024»
+    rf"(?:([АAаa]\d{{1,3}}){_DASH}(\d{{1,7}}){_YEAR_SEP}(\d{{4}})"
+    rf"|(СИП|SIP){_DASH}(\d{{1,7}})(?:{_YEAR_SEP}(\d{{4}}))?)"
+    rf"(?!\d)",
+    re.IGNORECASE,
+)
+
+# латиница и строчные → кириллические заглавные (только буквы префикса)
+_PREFIX_TABLE = str.maketrans({
+    "A": "А", "a": "А", "а": "А",
+    "S": "С", "s": "С", "с": "С",
+    "I": "И", "i": "И", "и": "И",
+    "P": "П", "p": "П", "п": "П",
+})
+
+
+def _from_match(m: "re.Match") -> str:
+    court, num, year, sip, sip_num, sip_year = m.groups()
+    if court:
+        return f"{court.translate(_PREFIX_TABLE)}-{num}/{year}"
+    canon = f"{sip.translate(_PREFIX_TABLE)}-{sip_num}"
+    return f"{canon}/{sip_year}" if sip_year else canon
+
+
+def canonical_case(s: Optional[str]) -> Optional[str]:
+    """Первый номер дела в строке в каноническом виде; None — номера нет."""
+    if not s:
+        return None
+    m = CASE_RE.search(s)
+    return _from_match(m) if m else None
+
+
+def find_cases(text: str) -> List[str]:
+    """Все номера дел в тексте, канонические, без повторов, в порядке появления."""
+    return list(dict.fromkeys(_from_match(m) for m in CASE_RE.finditer(text or "")))
+
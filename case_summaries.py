@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+Готовые карточки дел (Номер дела / Истец / Ответчик / Суд / Стадия /
+синопсис): пишет STEP_FOUR (stepfour_summaries.py) после индексации,
+читает чат-сервер — на «кратко по делу X» отвечает без поиска и LLM.
+
+Карточка помнит версию дела из case_versions, по которой она собрана:
+сервер отдаёт её, только пока версия совпадает, STEP_FOUR пересобирает
+дела, чья версия ушла вперёд.
+
+Хранилище — SQLite-файл рядом с case_versions.sqlite (STATE_DIR индексатора).
+Без внешних зависимостей — импортируется отовсюду, включая ver.s/.server.
+"""
+
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+
+SUMMARIES_DB = r"C:\Users\User\Desktop\text_txt\_index_state\case_summaries.sqlite"
+
+
+class CaseSummaries:
+    def __init__(self, path: str = SUMMARIES_DB):
+        self.path = path
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS summaries "
+                       "(case_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+                       "card TEXT NOT NULL, model TEXT, ts REAL)")
+
+    def _db(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, case_id: str) -> Optional[Tuple[str, int]]:
+        """(карточка, версия дела, по которой она собрана) или None."""
+        with self._db() as db:
+            row = db.execute("SELECT card, version FROM summaries WHERE case_id = ?",
+                             (case_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, case_id: str, version: int, card: str, model: str) -> None:
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)",
+                       (case_id, version, card, model, time.time()))
+
+    def versions(self) -> Dict[str, int]:
+        """{номер дела: версия карточки}."""
+        with self._db() as db:
+            return dict(db.execute("SELECT case_id, version FROM summaries").fetchall())
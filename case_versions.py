@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Счётчики версий дел — по ним чат-сервер сбрасывает кэш ответов.
+
+Индексатор после записи точек дела увеличивает версию этого дела и общий
+счётчик «*» (ответы без номера дела ищут по всему индексу). Операции,
+меняющие индекс целиком (migrate.py swap, migrate_case_ids.py --apply),
+увеличивают эпоху «#» — она входит в версию любого ответа.
+
+Хранилище — маленький SQLite-файл рядом с метриками индексатора (STATE_DIR):
+его открывают и индексатор, и все процессы сервера. Счётчики только
+растут, поэтому версия = счётчик дела (или «*») + эпоха.
+
+Без внешних зависимостей — импортируется отовсюду, включая ver.s/.server.
+"""
+
+import sqlite3
+from typing import Dict, Iterable, Optional
+
+VERSIONS_DB = r"C:\Users\User\Desktop\text_txt\_index_state\case_versions.sqlite"
+ANY_CASE = "*"     # любая запись в индекс
+EPOCH    = "#"     # индекс заменён целиком
+
+
+class CaseVersions:
+    def __init__(self, path: str = VERSIONS_DB):
+        self.path = path
+        with self._db() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS versions "
+                       "(case_id TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def _db(self) -> sqlite3.Connection:
+        # соединение на вызов: пишет индексатор, читают процессы сервера
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _bump(self, db: sqlite3.Connection, keys: Iterable[str]):
+        db.executemany("INSERT INTO versions VALUES (?, 1) "
+                       "ON CONFLICT(case_id) DO UPDATE SET version = version + 1",
+                       [(k,) for k in keys])
+
+    def bump(self, case_ids: Iterable[str]) -> None:
+        """Точки этих дел изменились."""
+        with self._db() as db:
+            self._bump(db, list(dict.fromkeys(case_ids)) + [ANY_CASE])
+
+    def bump_all(self) -> None:
+        """Индекс заменён целиком: устаревает всё."""
+        with self._db() as db:
+            self._bump(db, [EPOCH])
+
+    def get(self, case_id: Optional[str]) -> int:
+        """Версия данных для ответа по делу (None — по всему индексу)."""
+        keys = (case_id or ANY_CASE, EPOCH)
+        with self._db() as db:
+            rows = db.execute("SELECT version FROM versions WHERE case_id IN (?, ?)", keys).fetchall()
+        return sum(v for (v,) in rows)
+
+    def case(self, case_id: str) -> int:
+        """Счётчик самого дела, без эпохи (карточки дел не зависят от swap)."""
+        with self._db() as db:
+            row = db.execute("SELECT version FROM versions WHERE case_id = ?", (case_id,)).fetchone()
+        return row[0] if row else 0
+
+    def cases(self) -> Dict[str, int]:
+        """{номер дела: счётчик} без служебных «*» и «#»."""
+        with self._db() as db:
+            rows = db.execute("SELECT case_id, version FROM versions "
+                              "WHERE case_id NOT IN (?, ?)", (ANY_CASE, EPOCH)).fetchall()
+        return dict(rows)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Сборка мусора в kad_cases (и его шардах):
+  - дубликаты: точки одного case_id с одинаковым текстом (payload "text").
+    Случайные uuid4 + перезапись файлов дела + падения индексатора дают
+    повторную заливку тех же чанков;
+  - сироты: точки, чей исходный "file" больше не существует в SRC_DIR
+    (ни как «X.txt», ни как проиндексированный «X.indexed.txt»).
+
+Коллекция обходится параллельно: список дел берём фасетом по case_id,
+каждое дело скроллим в отдельном потоке.
+
+По умолчанию — только отчёт (dry-run). Удаление: python gc_points.py --apply
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from qdrant_client import QdrantClient, models
+
+from case_versions import CaseVersions
+
+# === Параметры подключения (как в recreate.py) ===
+QDRANT_HOST = "IP"
+QDRANT_PORT = "PORT"
+QDRANT_KEY  = (
+    "API KEY"
+)
+USE_HTTPS   = False
+
+COLL        = "kad_cases"
+SHARD_SEP   = "__"                                   # как в stepthree_index
+SRC_DIR     = r"C:\Users\User\Desktop\text_txt"      # откуда индексировались TXT
+PROCESSED_TAG = ".indexed"                           # как в stepthree_index
+
+WORKERS      = 8      # параллельных скроллов
+SCROLL_LIMIT = 512
+DELETE_BATCH = 512
+
+
+def indexed_name(filename: str) -> str:
+    """«X.txt» → «X.indexed.txt» (как mark_processed в индексаторе)."""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}{PROCESSED_TAG}{ext}" if ext else filename + PROCESSED_TAG
+
+
+def file_exists(filename: str, cache: Dict[str, bool]) -> bool:
+    if not filename:
+        return False
+    if filename not in cache:
+        cache[filename] = (os.path.exists(os.path.join(SRC_DIR, filename))
+                           or os.path.exists(os.path.join(SRC_DIR, indexed_name(filename))))
+    return cache[filename]
+
+
+def target_collections(qc: QdrantClient) -> List[str]:
+    """Живой индекс (после migrate.py — коллекция за alias-ом kad_cases) и шарды."""
+    names = [c.name for c in qc.get_collections().collections]
+    aliases = {a.alias_name: a.collection_name for a in qc.get_aliases().aliases}
+    live = aliases.get(COLL) or (COLL if COLL in names else None)
+    shards = sorted(n for n in names if n.startswith(COLL + SHARD_SEP))
+    return ([live] if live else []) + shards
+
+
+def vector_bytes(qc: QdrantClient, collection: str) -> int:
+    """Сколько байт float32 занимают векторы одной точки."""
+    vectors = qc.get_collection(collection).config.params.vectors
+    if isinstance(vectors, dict):
+        return sum(v.size * 4 for v in vectors.values())
+    return vectors.size * 4
+
+
+def case_ids(qc: QdrantClient, collection: str) -> List[str]:
+    """Все значения case_id (фасет по keyword-индексу)."""
+    resp = qc.facet(collection_name=collection, key="case_id", limit=1_000_000, exact=True)
+    return [h.value for h in resp.hits]
+
+
+def scroll_case(qc: QdrantClient, collection: str, case_id) -> List[Tuple[str, dict]]:
+    """Все точки дела: [(id, payload)] без векторов."""
+    filt = models.Filter(must=[models.FieldCondition(key="case_id",
+                                                     match=models.MatchValue(value=case_id))])
+    out, next_off = [], None
+    while True:
+        pts, next_off = qc.scroll(
+            collection_name=collection,
+            scroll_filter=filt,
+            limit=SCROLL_LIMIT,
+            with_payload=["text", "file"],
+            with_vectors=False,
+            offset=next_off,
+        )
+        out.extend((p.id, p.payload or {}) for p in pts)
+        if not pts or next_off is None:
+            break
+    return out
+
+
+def scan_collection(qc: QdrantClient, collection: str, file_cache: Dict[str, bool],
+                    check_orphans: bool = True):
+    """
+    Возвращает (dups, orphans, payload_bytes, scanned, cases):
+    id дубликатов (первая по id точка с тем же текстом остаётся) и сирот,
+    cases — дела, у которых есть что удалять.
+    """
+    dups: List[str] = []
+    orphans: List[str] = []
+    cases: List[str] = []
+    freed = scanned = 0
+
+    def one(cid):
+        pts = scroll_case(qc, collection, cid)
+        seen = set()
+        d, o, size = [], [], 0
+        # сортируем по id, чтобы выбор «оставшейся» копии был детерминированным
+        for pid, payload in sorted(pts, key=lambda x: str(x[0])):
+            text = payload.get("text") or ""
+            if check_orphans and not file_exists(payload.get("file"), file_cache):
+                o.append(pid)
+                size += len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+                continue
+            h = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            if h in seen:
+                d.append(pid)
+                size += len(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+            else:
+                seen.add(h)
+        return cid, len(pts), d, o, size
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        for cid, n, d, o, size in pool.map(one, case_ids(qc, collection)):
+            scanned += n
+            dups.extend(d)
+            orphans.extend(o)
+            freed += size
+            if d or o:
+                cases.append(cid)
+    return dups, orphans, freed, scanned, cases
+
+
+def delete_points(qc: QdrantClient, collection: str, ids: List[str]):
+    for i in range(0, len(ids), DELETE_BATCH):
+        qc.delete(
+            collection_name=collection,
+            points_selector=models.PointIdsList(points=ids[i:i + DELETE_BATCH]),
+            wait=True,
+        )
+
+
+def human(n: float) -> str:
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} ТБ"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=f"Удаление дубликатов и сирот в {COLL}")
+    ap.add_argument("--apply", action="store_true", help="реально удалить (по умолчанию — отчёт)")
+    ap.add_argument("--no-orphans", action="store_true", help="не трогать точки без исходного файла")
+    args = ap.parse_args()
+
+    qc = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_KEY,
+                      https=USE_HTTPS, timeout=120.0)
+    if not os.path.isdir(SRC_DIR) and not args.no_orphans:
+        print(f"💥 SRC_DIR не найден: {SRC_DIR} — сиротами оказались бы все точки. "
+              f"Проверьте путь или запустите с --no-orphans")
+        sys.exit(1)
+
+    file_cache: Dict[str, bool] = {}
+    total_pts = total_bytes = 0
+    for coll in target_collections(qc):
+        t0 = time.perf_counter()
+        dups, orphans, payload_bytes, scanned, cases = scan_collection(
+            qc, coll, file_cache, check_orphans=not args.no_orphans)
+        victims = dups + orphans
+        freed = payload_bytes + len(victims) * vector_bytes(qc, coll)
+        total_pts += len(victims)
+        total_bytes += freed
+
+        print(f"📦 {coll}: просмотрено {scanned} точек за {time.perf_counter() - t0:.1f} сек")
+        print(f"   дубликатов: {len(dups)}, сирот: {len(orphans)}, освободится ≈ {human(freed)}")
+
+        if args.apply and victims:
+            t0 = time.perf_counter()
+            try:
+                delete_points(qc, coll, victims)
+            finally:
+                # ответы чат-сервера по этим делам собраны и из удалённых чанков
+                CaseVersions().bump(cases)
+            print(f"   🗑 удалено {len(victims)} точек за {time.perf_counter() - t0:.1f} сек")
+
+    mode = "удалено" if args.apply else "к удалению (dry-run)"
+    print(f"🎉 Итого {mode}: {total_pts} точек, ≈ {human(total_bytes)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,6 @@ import threading
 import time
 import logging
 import os
-import re
 import shutil
 import json
 from contextlib import suppress
@@ -14,6 +13,7 @@ from path import Path
 from stepone_parser import STEP_ONE, MANIFEST_EXT, _safe_case_for_prefix  # + импортируем manifest helpers
 from steptwo_handler import STEP_TWO
 from stepthree_index import STEP_THREE
+from stepfour_summaries import STEP_FOUR
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -29,8 +29,6 @@ INDEX_MAX_BACKOFF = 900   # максимум бэкоффа, сек (15 мину
 FILE_STABLE_SEC   = 2     # файл считаем «готовым», если не менялся >= N сек
 
 
-CASE_RE = re.compile(r"[AА]\d{1,3}[-–—]\d{1,7}[_/]\d{4}", re.IGNORECASE)
-
 def relocate_pack(pdf_dir: Path, limbo_dir: Path, parse_thread: threading.Thread):
     pdf_dir = str(pdf_dir)
     limbo_dir = str(limbo_dir)
@@ -183,7 +181,15 @@ thread_4 = threading.Thread(
     daemon=True   # поставь False, если хочешь дождаться индексатора перед выходом процесса
 )
 
+# Карточки дел для чат-сервера — после индексации, по версиям дел
+thread_5 = threading.Thread(
+    target=STEP_FOUR,
+    name="Summaries",
+    daemon=True
+)
+
 thread_1.start()
 thread_2.start()
 thread_3.start()
-thread_4.start()
\ No newline at end of file
+thread_4.start()
+thread_5.start()
\ No newline at end of file
@@ -0,0 +1,577 @@
+# -*- coding: utf-8 -*-
+
+"""
+Локальный векторный движок на NumPy — офлайн-замена Qdrant.
+
+Реализует то подмножество QdrantClient, которым пользуются индексатор,
+сервер и служебные скрипты: create/get/delete коллекции, upsert, search,
+scroll, count, delete, facet, set_payload, batch_update_points,
+payload-индексы. Фильтры (MatchValue/MatchAny/MatchText, Range, HasId,
+must/should/must_not) и результаты — те же qdrant_client.models, так что
+код вызывающих не меняется. Alias-ов нет (blue/green migrate.py — только Qdrant):
+
+    qdrant = LocalQdrant(r"D:\\kad_local")      # вместо QdrantClient(...)
+
+Хранение (папка на коллекцию):
+    meta.json              — схема векторов, ёмкость, индексируемые поля
+    vectors.<имя>.f32      — матрица capacity×dim float32 (np.memmap), векторы нормированы
+    log.jsonl              — журнал payload-ов: {"row", "id", "payload"} / {"row", "deleted"}
+
+Поиск — полный перебор: скалярные произведения блоками по BLOCK_ROWS строк
+с удержанием top-k. Для keyword-полей держим инвертированный индекс
+значение → строки, по нему фильтры case_id/court/… не сканируют payload-ы.
+Журнал дочитывается с хвоста, поэтому сервер видит точки, которые
+в той же папке пишет индексатор из другого процесса.
+
+Подходит для небольших инсталляций, CI и нагрузочных тестов; для
+production-объёмов — Qdrant.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import threading
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from qdrant_client import models
+
+UNNAMED = ""            # ключ безымянного вектора
+INITIAL_CAPACITY = 1024
+BLOCK_ROWS = 65_536     # строк матрицы за один matmul
+SPARSE_FILTER = 0.25    # если под фильтр попадает меньше этой доли строк — считаем только их
+
+
+def _norm_rows(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    if m.ndim == 1:
+        m = m[None, :]
+    return m / (np.linalg.norm(m, axis=1, keepdims=True) + 1e-12)
+
+
+def _split_query(query_vector) -> Tuple[str, List[float]]:
+    """list / np.ndarray / NamedVector / (имя, вектор) → (имя, вектор)."""
+    if hasattr(query_vector, "name") and hasattr(query_vector, "vector"):   # models.NamedVector
+        return query_vector.name, query_vector.vector
+    if isinstance(query_vector, tuple):
+        return query_vector[0], query_vector[1]
+    return UNNAMED, query_vector
+
+
+def _as_list(v) -> list:
+    if v is None:
+        return []
+    return v if isinstance(v, list) else [v]
+
+
+def _in_range(v, rng: models.Range) -> bool:
+    """Как Range в Qdrant: только числа, все заданные границы."""
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return False
+    return ((rng.lt is None or v < rng.lt) and (rng.lte is None or v <= rng.lte)
+            and (rng.gt is None or v > rng.gt) and (rng.gte is None or v >= rng.gte))
+
+
+class _Collection:
+    """Одна коллекция: memmap-матрицы, payload-ы в памяти и журнал на диске."""
+
+    def __init__(self, root: str, vectors: Optional[Dict[str, int]] = None):
+        self.root = root
+        self.lock = threading.RLock()
+        meta_path = os.path.join(root, "meta.json")
+        if vectors is not None:                      # создание
+            os.makedirs(root, exist_ok=True)
+            self.meta = {"vectors": vectors, "capacity": 0, "indexed": {}}
+            self._grow(INITIAL_CAPACITY)
+            open(self._log_path, "a", encoding="utf-8").close()
+        else:                                        # открытие существующей
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        self.ids: List = []
+        self.payloads: List[Optional[dict]] = []
+        self.row_of: Dict = {}
+        self.alive = np.zeros(self.meta["capacity"], dtype=bool)
+        self.kw_index: Dict[str, Dict] = {f: {} for f, kind in self.meta["indexed"].items()
+                                          if kind == "keyword"}
+        self._log_offset = 0
+        self._meta_mtime = 0.0
+        self._open_mats()
+        self.refresh()
+
+    # --- файлы --------------------------------------------------------------
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.root, "log.jsonl")
+
+    def _mat_path(self, name: str) -> str:
+        return os.path.join(self.root, f"vectors.{name or 'default'}.f32")
+
+    def _save_meta(self):
+        tmp = os.path.join(self.root, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.root, "meta.json"))
+        self._meta_mtime = os.path.getmtime(os.path.join(self.root, "meta.json"))
+
+    def _open_mats(self, cap: Optional[int] = None):
+        cap = cap or self.meta["capacity"]
+        self.mats = {
+            name: np.memmap(self._mat_path(name), dtype=np.float32, mode="r+", shape=(cap, dim))
+            for name, dim in self.meta["vectors"].items()
+        }
+        if len(self.alive) < cap:
+            self.alive = np.concatenate([self.alive, np.zeros(cap - len(self.alive), dtype=bool)])
+
+    def _grow(self, capacity: int):
+        """Увеличиваем файлы матриц (дописываются нулями) и переоткрываем memmap."""
+        for name, dim in self.meta["vectors"].items():
+            with open(self._mat_path(name), "ab") as f:
+                f.truncate(capacity * dim * 4)
+        self.meta["capacity"] = capacity
+        self._save_meta()
+        if hasattr(self, "ids"):
+            self._open_mats()
+
+    def refresh(self):
+        """Подхватываем то, что дописал другой процесс (рост матриц и хвост журнала)."""
+        with self.lock:
+            meta_path = os.path.join(self.root, "meta.json")
+            mtime = os.path.getmtime(meta_path)
+            if mtime != self._meta_mtime:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                self._meta_mtime = mtime
+                if meta["capacity"] != self.meta["capacity"]:
+                    self._open_mats(meta["capacity"])
+                # self.meta ещё старая: индексы, появившиеся в этом обновлении, строим здесь
+                for field, kind in meta["indexed"].items():
+                    if field not in self.meta["indexed"]:
+                        self._add_index(field, kind)
+                self.meta = meta
+            if os.path.getsize(self._log_path) == self._log_offset:
+                return
+            with open(self._log_path, "rb") as f:
+                f.seek(self._log_offset)
+                for raw in f:
+                    if not raw.endswith(b"\n"):
+                        break               # строку ещё дописывают
+                    self._apply(json.loads(raw))
+                    self._log_offset += len(raw)
+
+    def _append_log(self, entries: Iterable[dict]):
+        with open(self._log_path, "ab") as f:
+            data = b"".join(json.dumps(e, ensure_ascii=False).encode("utf-8") + b"\n"
+                            for e in entries)
+            f.write(data)
+            self._log_offset += len(data)
+
+    # --- payload и индексы --------------------------------------------------
+
+    def _apply(self, e: dict):
+        row = e["row"]
+        while len(self.ids) <= row:
+            self.ids.append(None)
+            self.payloads.append(None)
+        old = self.payloads[row]
+        if old is not None:
+            self._unindex(row, old)
+        if e.get("deleted"):
+            self.row_of.pop(self.ids[row], None)
+            self.ids[row], self.payloads[row] = None, None
+            self.alive[row] = False
+            return
+        self.ids[row] = e["id"]
+        self.payloads[row] = e["payload"] or {}
+        self.row_of[e["id"]] = row
+        self.alive[row] = True
+        self._index(row, self.payloads[row])
+
+    def _index(self, row: int, payload: dict):
+        for field, idx in self.kw_index.items():
+            for v in _as_list(payload.get(field)):
+                idx.setdefault(v, set()).add(row)
+
+    def _unindex(self, row: int, payload: dict):
+        for field, idx in self.kw_index.items():
+            for v in _as_list(payload.get(field)):
+                idx.get(v, set()).discard(row)
+
+    def _add_index(self, field: str, kind: str):
+        self.meta["indexed"][field] = kind
+        if kind == "keyword" and field not in self.kw_index:
+            self.kw_index[field] = {}
+            for row, p in enumerate(self.payloads):
+                if p is not None:
+                    for v in _as_list(p.get(field)):
+                        self.kw_index[field].setdefault(v, set()).add(row)
+
+    # --- фильтры ------------------------------------------------------------
+
+    def _rows_mask(self, rows: Iterable[int]) -> np.ndarray:
+        m = np.zeros(len(self.ids), dtype=bool)
+        rows = [r for r in rows if r < len(m)]
+        if rows:
+            m[rows] = True
+        return m
+
+    def _scan(self, pred) -> np.ndarray:
+        return np.fromiter((p is not None and pred(p) for p in self.payloads),
+                           dtype=bool, count=len(self.payloads))
+
+    def _cond(self, cond) -> np.ndarray:
+        if isinstance(cond, models.Filter):
+            return self.mask(cond)
+        if isinstance(cond, models.HasIdCondition):
+            return self._rows_mask(self.row_of[i] for i in cond.has_id if i in self.row_of)
+        if not isinstance(cond, models.FieldCondition):
+            raise NotImplementedError(f"LocalQdrant: условие {type(cond).__name__} не поддерживается")
+
+        key, match = cond.key, cond.match
+        if cond.range is not None:
+            return self._scan(lambda p: any(_in_range(v, cond.range) for v in _as_list(p.get(key))))
+        if match is None:
+            raise NotImplementedError(f"LocalQdrant: условие по {key!r} без match/range не поддерживается")
+        if isinstance(match, (models.MatchValue, models.MatchAny)):
+            wanted = [match.value] if isinstance(match, models.MatchValue) else list(match.any)
+            if key in self.kw_index:
+                rows: Set[int] = set()
+                for v in wanted:
+                    rows |= self.kw_index[key].get(v, set())
+                return self._rows_mask(rows)
+            wanted_set = set(wanted)
+            return self._scan(lambda p: bool(wanted_set.intersection(_as_list(p.get(key)))))
+        if isinstance(match, models.MatchText):
+            tokens = match.text.lower().split()
+
+            def has_text(p):
+                val = " ".join(str(x) for x in _as_list(p.get(key))).lower()
+                return all(t in val for t in tokens)
+            return self._scan(has_text)
+        raise NotImplementedError(f"LocalQdrant: match {type(match).__name__} не поддерживается")
+
+    def mask(self, flt: Optional[models.Filter]) -> np.ndarray:
+        n = len(self.ids)
+        m = self.alive[:n].copy()
+        if flt is None:
+            return m
+        for c in flt.must or []:
+            m &= self._cond(c)
+        if flt.should:
+            any_m = np.zeros(n, dtype=bool)
+            for c in flt.should:
+                any_m |= self._cond(c)
+            m &= any_m
+        for c in flt.must_not or []:
+            m &= ~self._cond(c)
+        return m
+
+    # --- запись -------------------------------------------------------------
+
+    def upsert(self, points):
+        with self.lock:
+            self.refresh()
+            entries = []
+            new_rows: Dict = {}          # id → строка для новых точек этой пачки
+            for p in points:
+                row = self.row_of.get(p.id, new_rows.get(p.id))
+                if row is None:
+                    row = new_rows[p.id] = len(self.ids) + len(new_rows)
+                    while row >= self.meta["capacity"]:
+                        self._grow(self.meta["capacity"] * 2)
+                vec = p.vector if isinstance(p.vector, dict) else {UNNAMED: p.vector}
+                for name, mat in self.mats.items():
+                    if name in vec:
+                        mat[row] = _norm_rows(vec[name])[0]
+                entries.append({"row": row, "id": p.id, "payload": p.payload or {}})
+            for mat in self.mats.values():
+                mat.flush()
+            # журнал пишем после векторов: читатель не увидит строку без вектора
+            self._append_log(entries)
+            for e in entries:
+                self._apply(e)
+
+    def delete_rows(self, rows: List[int]):
+        with self.lock:
+            entries = [{"row": r, "deleted": True} for r in rows]
+            self._append_log(entries)
+            for e in entries:
+                self._apply(e)
+
+    # --- поиск --------------------------------------------------------------
+
+    def topk(self, name: str, queries: np.ndarray, k: int, mask: np.ndarray):
+        """Для каждого запроса — [(строка, score)] по убыванию score."""
+        mat = self.mats[name]
+        n = len(mask)
+        q = _norm_rows(queries)                      # m×d
+        best_s = np.full((len(q), 0), -np.inf, dtype=np.float32)
+        best_r = np.zeros((len(q), 0), dtype=np.int64)
+
+        def merge(scores: np.ndarray, rows: np.ndarray):
+            nonlocal best_s, best_r
+            s = np.concatenate([best_s, scores], axis=1)
+            r = np.concatenate([best_r, np.broadcast_to(rows, scores.shape)], axis=1)
+            if s.shape[1] > k:
+                idx = np.argpartition(-s, k - 1, axis=1)[:, :k]
+                s = np.take_along_axis(s, idx, axis=1)
+                r = np.take_along_axis(r, idx, axis=1)
+            best_s, best_r = s, r
+
+        selected = np.flatnonzero(mask)
+        if len(selected) < n * SPARSE_FILTER:
+            # фильтр узкий (например, одно дело) — считаем только его строки
+            for a in range(0, len(selected), BLOCK_ROWS):
+                rows = selected[a:a + BLOCK_ROWS]
+                merge(q @ mat[rows].T, rows)
+        else:
+            for a in range(0, n, BLOCK_ROWS):
+                b = min(a + BLOCK_ROWS, n)
+                scores = q @ mat[a:b].T
+                scores[:, ~mask[a:b]] = -np.inf
+                merge(scores, np.arange(a, b))
+
+        out = []
+        for s, r in zip(best_s, best_r):
+            order = np.argsort(-s)
+            out.append([(int(r[i]), float(s[i])) for i in order if np.isfinite(s[i])])
+        return out
+
+    def record_parts(self, row: int, with_payload, with_vectors):
+        payload = None
+        if with_payload:
+            p = self.payloads[row] or {}
+            payload = {k: p[k] for k in with_payload if k in p} if isinstance(with_payload, list) else p
+        vector = None
+        if with_vectors:
+            names = with_vectors if isinstance(with_vectors, list) else list(self.mats)
+            if list(self.mats) == [UNNAMED] and not isinstance(with_vectors, list):
+                vector = self.mats[UNNAMED][row].tolist()
+            else:
+                vector = {n: self.mats[n][row].tolist() for n in names if n in self.mats}
+        return payload, vector
+
+    def vectors_config(self):
+        schema = self.meta["vectors"]
+        if list(schema) == [UNNAMED]:
+            return models.VectorParams(size=schema[UNNAMED], distance=models.Distance.COSINE)
+        return {n: models.VectorParams(size=d, distance=models.Distance.COSINE)
+                for n, d in schema.items()}
+
+
+class LocalQdrant:
+    """Подмножество API QdrantClient поверх _Collection (все коллекции — COSINE)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._colls: Dict[str, _Collection] = {}
+        self._lock = threading.Lock()
+
+    # --- коллекции ----------------------------------------------------------
+
+    def _coll(self, name: str) -> _Collection:
+        with self._lock:
+            if name not in self._colls:
+                root = os.path.join(self.path, name)
+                if not os.path.exists(os.path.join(root, "meta.json")):
+                    raise ValueError(f"Collection {name} not found")
+                self._colls[name] = _Collection(root)
+            coll = self._colls[name]
+        coll.refresh()
+        return coll
+
+    def collection_exists(self, collection_name: str) -> bool:
+        return os.path.exists(os.path.join(self.path, collection_name, "meta.json"))
+
+    def create_collection(self, collection_name: str, vectors_config, **_ignored):
+        if isinstance(vectors_config, dict):
+            schema = {n: p.size for n, p in vectors_config.items()}
+        else:
+            schema = {UNNAMED: vectors_config.size}
+        with self._lock:
+            self._colls[collection_name] = _Collection(
+                os.path.join(self.path, collection_name), vectors=schema)
+        return True
+
+    def delete_collection(self, collection_name: str, **_ignored):
+        with self._lock:
+            self._colls.pop(collection_name, None)
+            shutil.rmtree(os.path.join(self.path, collection_name), ignore_errors=True)
+        return True
+
+    def update_collection(self, collection_name: str, **_ignored):
+        # HNSW/оптимизаторов нет — параметры графа не на что применять
+        self._coll(collection_name)
+        return True
+
+    def get_collection(self, collection_name: str):
+        c = self._coll(collection_name)
+        return SimpleNamespace(
+            status=models.CollectionStatus.GREEN,
+            points_count=int(c.alive.sum()),
+            # графа нет: m=None — bulk-режиму индексатора нечего запоминать и восстанавливать
+            config=SimpleNamespace(params=SimpleNamespace(vectors=c.vectors_config()),
+                                   hnsw_config=SimpleNamespace(m=None),
+                                   optimizer_config=SimpleNamespace(indexing_threshold=None)),
+        )
+
+    def get_collections(self):
+        names = sorted(n for n in os.listdir(self.path) if self.collection_exists(n))
+        return SimpleNamespace(collections=[SimpleNamespace(name=n) for n in names])
+
+    def get_aliases(self):
+        return SimpleNamespace(aliases=[])
+
+    def update_collection_aliases(self, change_aliases_operations, **_ignored):
+        raise NotImplementedError("LocalQdrant: alias-ов нет — migrate.py swap работает только с Qdrant")
+
+    def create_payload_index(self, collection_name: str, field_name: str,
+                             field_schema=None, **_ignored):
+        c = self._coll(collection_name)
+        kind = "keyword" if field_schema in (models.PayloadSchemaType.KEYWORD, "keyword") else "text"
+        with c.lock:
+            if c.meta["indexed"].get(field_name) != kind:
+                c._add_index(field_name, kind)
+                c._save_meta()
+        return True
+
+    # --- точки --------------------------------------------------------------
+
+    def upsert(self, collection_name: str, points, wait: bool = True, **_ignored):
+        self._coll(collection_name).upsert(points)
+        return True
+
+    def upload_collection(self, collection_name: str, vectors, payload=None, ids=None,
+                          batch_size: int = 256, **_ignored):
+        """Как в QdrantClient: vectors — матрица или dict имя → матрица; потоково."""
+        payload = iter(payload) if payload is not None else None
+        ids = iter(ids) if ids is not None else iter(lambda: str(uuid.uuid4()), None)
+        n = len(next(iter(vectors.values()))) if isinstance(vectors, dict) else len(vectors)
+        for a in range(0, n, batch_size):
+            pts = []
+            for i in range(a, min(a + batch_size, n)):
+                vec = ({k: m[i] for k, m in vectors.items()} if isinstance(vectors, dict)
+                       else vectors[i])
+                pts.append(SimpleNamespace(id=next(ids), vector=vec,
+                                           payload=next(payload) if payload else {}))
+            self.upsert(collection_name, pts)
+
+    def search(self, collection_name: str, query_vector, limit: int = 10,
+               query_filter: Optional[models.Filter] = None, with_payload=True,
+               with_vectors=False, **_ignored):
+        return self.search_batch(collection_name, [query_vector], limit=limit,
+                                 query_filter=query_filter, with_payload=with_payload,
+                                 with_vectors=with_vectors)[0]
+
+    def search_batch(self, collection_name: str, query_vectors: List, limit: int = 10,
+                     query_filter: Optional[models.Filter] = None, with_payload=True,
+                     with_vectors=False):
+        """Несколько запросов к одному вектору одной матричной операцией."""
+        c = self._coll(collection_name)
+        name = _split_query(query_vectors[0])[0]
+        q = np.asarray([_split_query(v)[1] for v in query_vectors], dtype=np.float32)
+        with c.lock:
+            results = c.topk(name, q, limit, c.mask(query_filter))
+            out = []
+            for res in results:
+                hits = []
+                for row, score in res:
+                    payload, vector = c.record_parts(row, with_payload, with_vectors)
+                    hits.append(models.ScoredPoint(id=c.ids[row], version=0, score=score,
+                                                   payload=payload, vector=vector))
+                out.append(hits)
+        return out
+
+    def scroll(self, collection_name: str, scroll_filter: Optional[models.Filter] = None,
+               limit: int = 10, offset=None, with_payload=True, with_vectors=False, **_ignored):
+        """offset — номер строки, с которой продолжать (возвращается вторым элементом)."""
+        c = self._coll(collection_name)
+        with c.lock:
+            rows = np.flatnonzero(c.mask(scroll_filter))
+            start = int(offset or 0)
+            rows = rows[rows >= start]
+            page = rows[:limit]
+            records = []
+            for row in page:
+                payload, vector = c.record_parts(int(row), with_payload, with_vectors)
+                records.append(models.Record(id=c.ids[row], payload=payload, vector=vector))
+            next_off = int(rows[limit]) if len(rows) > limit else None
+        return records, next_off
+
+    def count(self, collection_name: str, count_filter: Optional[models.Filter] = None,
+              exact: bool = True, **_ignored):
+        c = self._coll(collection_name)
+        with c.lock:
+            return models.CountResult(count=int(c.mask(count_filter).sum()))
+
+    def facet(self, collection_name: str, key: str, limit: int = 10, **_ignored):
+        c = self._coll(collection_name)
+        counts: Dict = {}
+        with c.lock:
+            for p in c.payloads:
+                if p is not None:
+                    for v in _as_list(p.get(key)):
+                        counts[v] = counts.get(v, 0) + 1
+        top = sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return SimpleNamespace(hits=[SimpleNamespace(value=v, count=n) for v, n in top])
+
+    def delete(self, collection_name: str, points_selector, wait: bool = True, **_ignored):
+        """points_selector — PointIdsList, FilterSelector, Filter или список id."""
+        c = self._coll(collection_name)
+        with c.lock:
+            if isinstance(points_selector, models.PointIdsList):
+                ids = points_selector.points
+            elif isinstance(points_selector, models.FilterSelector):
+                points_selector = points_selector.filter
+            elif isinstance(points_selector, list):
+                ids = points_selector
+            elif not isinstance(points_selector, models.Filter):
+                raise NotImplementedError(
+                    f"LocalQdrant.delete: селектор {type(points_selector).__name__} не поддерживается")
+            if isinstance(points_selector, models.Filter):
+                rows = np.flatnonzero(c.mask(points_selector)).tolist()
+            else:
+                rows = [c.row_of[i] for i in ids if i in c.row_of]
+            c.delete_rows(rows)
+        return True
+
+    def batch_update_points(self, collection_name: str, update_operations, wait: bool = True,
+                            **_ignored):
+        """Операции по порядку: upsert, delete, set_payload (как migrate_case_ids)."""
+        for op in update_operations:
+            if isinstance(op, models.SetPayloadOperation):
+                sp = op.set_payload
+                if sp.key:
+                    raise NotImplementedError("LocalQdrant: set_payload с key не поддерживается")
+                self.set_payload(collection_name, sp.payload,
+                                 points=sp.filter if sp.filter is not None else sp.points)
+            elif isinstance(op, models.DeleteOperation):
+                self.delete(collection_name, op.delete)
+            elif isinstance(op, models.UpsertOperation):
+                if not isinstance(op.upsert, models.PointsList):
+                    raise NotImplementedError("LocalQdrant: upsert батчем — только PointsList")
+                self.upsert(collection_name, op.upsert.points)
+            else:
+                raise NotImplementedError(
+                    f"LocalQdrant.batch_update_points: операция {type(op).__name__} не поддерживается")
+        return [models.UpdateResult(operation_id=0, status=models.UpdateStatus.COMPLETED)
+                for _ in update_operations]
+
+    def set_payload(self, collection_name: str, payload: dict, points=None,
+                    wait: bool = True, **_ignored):
+        """Дописывает ключи payload выбранным точкам (список id или Filter)."""
+        c = self._coll(collection_name)
+        with c.lock:
+            if isinstance(points, models.Filter):
+                rows = np.flatnonzero(c.mask(points)).tolist()
+            else:
+                rows = [c.row_of[i] for i in (points or []) if i in c.row_of]
+            entries = [{"row": r, "id": c.ids[r], "payload": {**(c.payloads[r] or {}), **payload}}
+                       for r in rows]
+            c._append_log(entries)
+            for e in entries:
+                c._apply(e)
+        return True
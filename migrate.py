@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Blue/green-миграция коллекции без простоя чат-сервера.
+
+Живой индекс — alias kad_cases, за ним реальная коллекция kad_cases_vN.
+Сервер и индексатор обращаются только к alias-у, поэтому пересборка идёт
+рядом, а переключение — одной атомарной операцией над alias-ами.
+
+    python migrate.py status
+    python migrate.py build --from-dump D:\\kad_dump     # из vectors_io.py export, без эмбеддинга
+    python migrate.py build --reindex                   # заново через индексатор (платно)
+    python migrate.py verify kad_cases_v3
+    python migrate.py swap kad_cases_v3 [--drop-physical]
+    python migrate.py cleanup --keep 2
+
+Первая миграция: пока kad_cases — обычная коллекция, alias с тем же
+именем создать нельзя. swap --drop-physical удаляет её и сразу создаёт
+alias (окно недоступности — доли секунды). Дальше переключения атомарны.
+
+На время build остановите STEP_THREE: точки, записанные в старую версию
+после начала сборки, в новую не попадут.
+"""
+
+import re
+import sys
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+from qdrant_client import QdrantClient, models
+
+from case_versions import CaseVersions
+from recreate import QDRANT_HOST, QDRANT_PORT, QDRANT_KEY, USE_HTTPS, COLL
+
+VERSION_RE = re.compile(rf"^{re.escape(COLL)}_v(\d+)$")
+
+# === Проверка новой версии перед переключением ===
+MIN_COUNT_RATIO = 0.99   # точек в новой не меньше 99% от живой
+SAMPLE_QUERIES  = 20     # сколько точек живой коллекции использовать как запросы
+VERIFY_TOP_K    = 10
+MIN_OVERLAP     = 0.8    # средняя доля совпавших результатов top-K
+
+
+def _client() -> QdrantClient:
+    return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_KEY,
+                        https=USE_HTTPS, timeout=300.0)
+
+
+def aliases(qc: QdrantClient) -> Dict[str, str]:
+    return {a.alias_name: a.collection_name for a in qc.get_aliases().aliases}
+
+
+def versions(qc: QdrantClient) -> List[str]:
+    names = [c.name for c in qc.get_collections().collections]
+    return sorted((n for n in names if VERSION_RE.match(n)),
+                  key=lambda n: int(VERSION_RE.match(n).group(1)))
+
+
+def next_version(qc: QdrantClient) -> str:
+    vs = versions(qc)
+    n = int(VERSION_RE.match(vs[-1]).group(1)) + 1 if vs else 1
+    return f"{COLL}_v{n}"
+
+
+def live_target(qc: QdrantClient) -> Optional[str]:
+    """Реальная коллекция, которую сейчас видит сервер."""
+    al = aliases(qc)
+    if COLL in al:
+        return al[COLL]
+    return COLL if qc.collection_exists(COLL) else None
+
+
+# ––– status / build –––––––––––––––––––––––––––––––––––––
+
+def status(qc: QdrantClient):
+    target = live_target(qc)
+    kind = "alias" if COLL in aliases(qc) else "коллекция"
+    print(f"ℹ {COLL} ({kind}) → {target or 'нет'}")
+    for v in versions(qc):
+        mark = "  ← живая" if v == target else ""
+        print(f"   {v}: {qc.count(v, exact=True).count} точек{mark}")
+
+
+def build(from_dump: Optional[str], reindex: bool) -> str:
+    qc = _client()
+    new = next_version(qc)
+    print(f"⏳ Собираю {new}…")
+    if from_dump:
+        from vectors_io import import_collection
+        import_collection(from_dump, new)
+    elif reindex:
+        # импорт здесь: модуль индексатора поднимает клиентов OpenAI/Qdrant
+        import stepthree_index as idx
+        idx.ensure_collection(bulk=True, collection=new)
+        idx.index_all(bulk=True, target=new, reindex=True)
+        idx.end_bulk_load(new)
+        if not idx.wait_optimized(new):
+            print(f"⚠ {new} не стала GREEN — проверьте перед swap")
+    else:
+        raise ValueError("нужен --from-dump или --reindex")
+    print(f"✔ {new} собрана. Дальше: python migrate.py verify {new}")
+    return new
+
+
+# ––– verify –––––––––––––––––––––––––––––––––––––––––––––
+
+def _query_vector(vec):
+    """Полный вектор точки: безымянный или "full"."""
+    return vec["full"] if isinstance(vec, dict) else vec
+
+
+def _search_keys(qc: QdrantClient, collection: str, vec, named: bool) -> List[str]:
+    """Top-K как хэши текстов: id точек при переиндексации меняются."""
+    hits = qc.search(
+        collection_name=collection,
+        query_vector=models.NamedVector(name="full", vector=vec) if named else vec,
+        limit=VERIFY_TOP_K,
+        with_payload=["text"],
+        search_params=models.SearchParams(exact=True),
+    )
+    return [hashlib.sha1((h.payload.get("text") or "").encode("utf-8")).hexdigest() for h in hits]
+
+
+def verify(qc: QdrantClient, new: str) -> bool:
+    old = live_target(qc)
+    if not old:
+        print(f"ℹ Живой коллекции нет — сравнивать не с чем, {new} принимается")
+        return True
+
+    n_old = qc.count(old, exact=True).count
+    n_new = qc.count(new, exact=True).count
+    count_ok = n_new >= n_old * MIN_COUNT_RATIO
+    print(f"{'✔' if count_ok else '✘'} Точек: {old}={n_old}, {new}={n_new}")
+
+    old_named = isinstance(qc.get_collection(old).config.params.vectors, dict)
+    new_named = isinstance(qc.get_collection(new).config.params.vectors, dict)
+    sample, _ = qc.scroll(old, limit=SAMPLE_QUERIES, with_payload=False,
+                          with_vectors=["full"] if old_named else True)
+    overlaps = []
+    for p in sample:
+        vec = _query_vector(p.vector)
+        a = set(_search_keys(qc, old, vec, old_named))
+        b = set(_search_keys(qc, new, vec, new_named))
+        overlaps.append(len(a & b) / len(a) if a else 1.0)
+    overlap = sum(overlaps) / len(overlaps) if overlaps else 1.0
+    search_ok = overlap >= MIN_OVERLAP
+    print(f"{'✔' if search_ok else '✘'} Совпадение top-{VERIFY_TOP_K} на {len(overlaps)} запросах: "
+          f"{overlap:.2f} (порог {MIN_OVERLAP})")
+    return count_ok and search_ok
+
+
+# ––– swap / cleanup –––––––––––––––––––––––––––––––––––––
+
+def _invalidate_answers():
+    """Кэш ответов чат-сервера ссылается на старую версию — сбрасываем целиком."""
+    try:
+        CaseVersions().bump_all()
+    except Exception as exc:
+        print(f"⚠ Не удалось сбросить кэш ответов сервера: {exc}")
+
+
+def swap(qc: QdrantClient, new: str, drop_physical: bool = False):
+    al = aliases(qc)
+    create = models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=new, alias_name=COLL)
+    )
+    if COLL in al:
+        # удаление и создание alias-а в одном запросе — переключение атомарно
+        qc.update_collection_aliases(change_aliases_operations=[
+            models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=COLL)),
+            create,
+        ])
+        print(f"✔ {COLL}: {al[COLL]} → {new}")
+        _invalidate_answers()
+        return
+
+    if qc.collection_exists(COLL):
+        if not drop_physical:
+            print(f"💥 {COLL} — обычная коллекция. Первая миграция: swap {new} --drop-physical "
+                  f"(сделайте vectors_io.py export, если нужна копия)")
+            sys.exit(1)
+        print(f"⏳ Удаляю коллекцию {COLL} и ставлю alias на {new}…")
+        qc.delete_collection(COLL)
+
+    qc.update_collection_aliases(change_aliases_operations=[create])
+    print(f"✔ {COLL} → {new}")
+    _invalidate_answers()
+
+
+def cleanup(qc: QdrantClient, keep: int):
+    """Удаляет старые версии, кроме живой и `keep` последних."""
+    target = live_target(qc)
+    vs = versions(qc)
+    for v in vs[:-keep] if keep else vs:
+        if v == target:
+            continue
+        qc.delete_collection(v)
+        print(f"🗑 Удалена {v}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=f"Blue/green-миграция {COLL} через alias")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="куда смотрит alias и какие версии есть")
+
+    b = sub.add_parser("build", help=f"собрать {COLL}_vN рядом с живой")
+    src = b.add_mutually_exclusive_group(required=True)
+    src.add_argument("--from-dump", help="папка vectors_io.py export")
+    src.add_argument("--reindex", action="store_true", help="переиндексировать TXT из SRC_DIR")
+
+    v = sub.add_parser("verify", help="сравнить версию с живой")
+    v.add_argument("name")
+
+    s = sub.add_parser("swap", help="переключить alias на версию")
+    s.add_argument("name")
+    s.add_argument("--drop-physical", action="store_true",
+                   help=f"первая миграция: удалить обычную коллекцию {COLL}")
+    s.add_argument("--force", action="store_true", help="без проверки verify")
+
+    c = sub.add_parser("cleanup", help="удалить старые версии")
+    c.add_argument("--keep", type=int, default=2)
+
+    args = ap.parse_args()
+    qc = _client()
+    try:
+        if args.cmd == "status":
+            status(qc)
+        elif args.cmd == "build":
+            build(args.from_dump, args.reindex)
+        elif args.cmd == "verify":
+            sys.exit(0 if verify(qc, args.name) else 2)
+        elif args.cmd == "swap":
+            if not args.force and not verify(qc, args.name):
+                print("💥 Проверка не пройдена — alias не тронут (--force, чтобы переключить всё равно)")
+                sys.exit(2)
+            swap(qc, args.name, drop_physical=args.drop_physical)
+        elif args.cmd == "cleanup":
+            cleanup(qc, args.keep)
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"💥 {args.cmd} не удался: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
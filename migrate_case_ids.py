@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Разовая миграция: приводит payload case_id во всех коллекциях к канону
+case_number.canonical_case («A40-1_2024», «А40-1-2024» → «А40-1/2024»).
+
+До общего нормализатора индексатор писал номер как получилось (латиница
+или кириллица, «-»/«/»), а сервер искал латиницей — фильтр case_id
+промахивался и запрос уходил в медленный поиск без фильтра.
+
+  - kad_cases и его шарды: по каждому неканоническому значению — одна
+    операция set_payload с фильтром case_id == старое, операции уходят
+    пачками через batch_update_points; векторы не трогаем;
+  - kad_case_cards: id карточки — uuid5 от номера, поэтому карточку
+    перезаписываем под новым id и удаляем старую.
+
+Тег <CASE:…> внутри "text" не меняется: по этому тексту посчитан эмбеддинг.
+
+По умолчанию — только отчёт (dry-run). Запись: python migrate_case_ids.py --apply
+"""
+
+import sys
+import time
+import uuid
+import argparse
+from typing import Dict, List
+
+from qdrant_client import QdrantClient, models
+
+from case_number import canonical_case
+from case_versions import CaseVersions
+from recreate import QDRANT_HOST, QDRANT_PORT, QDRANT_KEY, USE_HTTPS, COLL, CASES_COLL, SHARD_SEP
+
+OPS_BATCH    = 256    # операций set_payload в одном batch_update_points
+SCROLL_LIMIT = 512
+
+
+def _client() -> QdrantClient:
+    return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_KEY,
+                        https=USE_HTTPS, timeout=300.0)
+
+
+def _case_filter(case_id: str) -> models.Filter:
+    return models.Filter(must=[models.FieldCondition(key="case_id",
+                                                     match=models.MatchValue(value=case_id))])
+
+
+def target_collections(qc: QdrantClient) -> List[str]:
+    names = [c.name for c in qc.get_collections().collections]
+    aliases = {a.alias_name for a in qc.get_aliases().aliases}
+    shards = sorted(n for n in names if n.startswith(COLL + SHARD_SEP))
+    return ([COLL] if COLL in names or COLL in aliases else []) + shards
+
+
+def plan(qc: QdrantClient, collection: str) -> Dict[str, tuple]:
+    """{старое значение: (канон, точек)} для значений, которые надо переписать."""
+    resp = qc.facet(collection_name=collection, key="case_id", limit=1_000_000, exact=True)
+    out = {}
+    for h in resp.hits:
+        canon = canonical_case(h.value) if isinstance(h.value, str) else None
+        if canon and canon != h.value:
+            out[h.value] = (canon, h.count)
+    return out
+
+
+def rewrite_points(qc: QdrantClient, collection: str, renames: Dict[str, tuple]):
+    ops = [
+        models.SetPayloadOperation(set_payload=models.SetPayload(
+            payload={"case_id": canon}, filter=_case_filter(old),
+        ))
+        for old, (canon, _) in renames.items()
+    ]
+    for i in range(0, len(ops), OPS_BATCH):
+        qc.batch_update_points(collection_name=collection,
+                               update_operations=ops[i:i + OPS_BATCH], wait=True)
+        print(f"   … {min(i + OPS_BATCH, len(ops))}/{len(ops)} номеров", end="\r")
+    print()
+
+
+def rewrite_cards(qc: QdrantClient, renames: Dict[str, tuple]):
+    """Карточка дела: новый id = uuid5 от канона (как upsert_case_card в индексаторе)."""
+    filt = models.Filter(must=[models.FieldCondition(
+        key="case_id", match=models.MatchAny(any=list(renames)))])
+    next_off = None
+    while True:
+        pts, next_off = qc.scroll(collection_name=CASES_COLL, scroll_filter=filt,
+                                  limit=SCROLL_LIMIT, with_payload=True, with_vectors=True,
+                                  offset=next_off)
+        if not pts:
+            break
+        new_pts = []
+        for p in pts:
+            canon = renames[p.payload["case_id"]][0]
+            new_pts.append(models.PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"case:{canon}")),
+                vector=p.vector,
+                payload={**p.payload, "case_id": canon},
+            ))
+        qc.upsert(CASES_COLL, points=new_pts, wait=True)
+        old_ids = [p.id for p in pts if p.id not in {n.id for n in new_pts}]
+        if old_ids:
+            qc.delete(CASES_COLL, points_selector=models.PointIdsList(points=old_ids), wait=True)
+        if next_off is None:
+            break
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Канонизация case_id в payload без переиндексации")
+    ap.add_argument("--apply", action="store_true", help="реально переписать (по умолчанию — отчёт)")
+    args = ap.parse_args()
+
+    qc = _client()
+    total_vals = total_pts = 0
+    try:
+        for coll in target_collections(qc):
+            renames = plan(qc, coll)
+            n_pts = sum(c for _, c in renames.values())
+            total_vals += len(renames)
+            total_pts += n_pts
+            print(f"📦 {coll}: номеров к переписи {len(renames)}, точек {n_pts}")
+            for old, (canon, _) in list(renames.items())[:5]:
+                print(f"   {old!r} → {canon!r}")
+            if args.apply and renames:
+                t0 = time.perf_counter()
+                rewrite_points(qc, coll, renames)
+                print(f"   ✔ за {time.perf_counter() - t0:.1f} сек")
+
+        if qc.collection_exists(CASES_COLL):
+            renames = plan(qc, CASES_COLL)
+            print(f"📇 {CASES_COLL}: карточек к переписи {len(renames)}")
+            if args.apply and renames:
+                rewrite_cards(qc, renames)
+                print("   ✔ карточки перезаписаны")
+        if args.apply and total_vals:
+            # ответы чат-сервера закэшированы под старыми case_id
+            CaseVersions().bump_all()
+    except Exception as e:
+        print(f"💥 Миграция не удалась: {e}")
+        sys.exit(1)
+
+    mode = "переписано" if args.apply else "к переписи (dry-run)"
+    print(f"🎉 Итого {mode}: {total_vals} номеров, {total_pts} точек")
+
+
+if __name__ == "__main__":
+    main()
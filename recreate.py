@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import json
+import time
+import argparse
 from qdrant_client import QdrantClient, models
 
 # === Параметры подключения (как в твоём коде) ===
@@ -16,8 +20,30 @@ USE_HTTPS   = False
 COLL = "kad_cases"
 DIM  = 768
 DIST = models.Distance.COSINE
+# Усечённый вектор для двухступенчатого поиска (как SMALL_DIM в stepthree_index):
+# 0 — одна безымянная колонка; иначе именованные "full" (DIM, без HNSW) и "small"
+SMALL_DIM = 0
 PAYLOAD_INDEX_FIELDS = ("case_id", "court", "plaintiffs", "defendants")
 
+# Карточки дел (как CASES_COLL в stepthree_index) — один вектор на дело
+CASES_COLL = "kad_case_cards"
+
+# === Шарды (как SHARD_MODE/SHARD_SEP в stepthree_index) ===
+# При шардировании коллекции kad_cases__<год>[_<суд>] создаёт сам индексатор,
+# здесь их только удаляем при пересоздании.
+SHARD_MODE = "none"
+SHARD_SEP  = "__"
+
+# === Bulk-load: параметры графа во время/после заливки ===
+# --bulk запоминает m и indexing_threshold удаляемой коллекции (и шардов) в
+# BULK_RESTORE, --finish-bulk / stepthree_index --bulk возвращают их. Если
+# запомненных нет — HNSW_M / INDEXING_THRESHOLD.
+HNSW_M             = 16       # рабочее m (дефолт Qdrant)
+INDEXING_THRESHOLD = 20_000   # рабочий порог индексации, КБ (дефолт Qdrant)
+BULK_RESTORE       = r"C:\Users\User\Desktop\text_txt\_index_state\bulk_restore.json"  # как в stepthree_index
+OPTIMIZE_POLL_SEC  = 5
+OPTIMIZE_TIMEOUT   = 6 * 3600
+
 def ensure_payload_indexes(qc: QdrantClient, collection: str):
     for field in PAYLOAD_INDEX_FIELDS:
         try:
@@ -30,6 +56,21 @@ def ensure_payload_indexes(qc: QdrantClient, collection: str):
         except Exception as e:
             # Индекс уже существует — игнорируем
             print(f"… Индекс {field} возможно уже есть: {e}")
+    # полнотекстовый индекс по сторонам (строка "parties") — для гибридного поиска
+    try:
+        qc.create_payload_index(
+            collection_name=collection,
+            field_name="parties",
+            field_schema=models.TextIndexParams(
+                type=models.TextIndexType.TEXT,
+                tokenizer=models.TokenizerType.WORD,
+                min_token_len=2,
+                lowercase=True,
+            ),
+        )
+        print("✔ Создан полнотекстовый индекс по полю: parties")
+    except Exception as e:
+        print(f"… Индекс parties возможно уже есть: {e}")
 
 def drop_if_exists(qc: QdrantClient, collection: str):
     try:
@@ -43,16 +84,96 @@ def drop_if_exists(qc: QdrantClient, collection: str):
         print(f"⚠ Ошибка при удалении {collection}: {e}")
         raise
 
-def create_collection(qc: QdrantClient, collection: str, dim: int, distance: models.Distance):
-    print(f"⏳ Создаю коллекцию: {collection} (dim={dim}, distance={distance.value})")
+def list_shards(qc: QdrantClient, collection: str):
+    prefix = collection + SHARD_SEP
+    return sorted(c.name for c in qc.get_collections().collections if c.name.startswith(prefix))
+
+def create_collection(qc: QdrantClient, collection: str, dim: int, distance: models.Distance,
+                      bulk: bool = False):
+    mode = ", bulk: HNSW выключен" if bulk else ""
+    print(f"⏳ Создаю коллекцию: {collection} (dim={dim}, distance={distance.value}{mode})")
+    if SMALL_DIM:
+        print(f"   + вектор small (dim={SMALL_DIM}) для предварительного отбора")
+        vectors = {
+            "full": models.VectorParams(size=dim, distance=distance,
+                                        hnsw_config=models.HnswConfigDiff(m=0)),
+            "small": models.VectorParams(size=SMALL_DIM, distance=distance),
+        }
+    else:
+        vectors = models.VectorParams(size=dim, distance=distance)
     qc.create_collection(
         collection_name=collection,
-        vectors_config=models.VectorParams(size=dim, distance=distance),
-        # при необходимости можно явно задать HNSW/optimizers/quantization — у тебя они дефолтные
+        vectors_config=vectors,
+        # в bulk-режиме граф не строится, пока не вызовем finish_bulk();
+        # иначе HNSW/optimizers дефолтные
+        hnsw_config=models.HnswConfigDiff(m=0) if bulk else None,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0) if bulk else None,
     )
     print(f"✔ Коллекция создана: {collection}")
 
+def load_bulk_restore() -> dict:
+    try:
+        with open(BULK_RESTORE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_bulk_restore(saved: dict):
+    os.makedirs(os.path.dirname(BULK_RESTORE), exist_ok=True)
+    tmp = BULK_RESTORE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(saved, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, BULK_RESTORE)
+
+def remember_graph_params(qc: QdrantClient, names):
+    """m и indexing_threshold коллекций перед пересозданием без графа."""
+    saved = load_bulk_restore()
+    for name in names:
+        if not qc.collection_exists(name):
+            continue
+        cfg = qc.get_collection(name).config
+        if cfg.hnsw_config.m:   # m=0 — прерванная заливка, рабочие значения уже запомнены
+            saved[name] = {"m": cfg.hnsw_config.m,
+                           "indexing_threshold": cfg.optimizer_config.indexing_threshold}
+    save_bulk_restore(saved)
+
+def finish_bulk(qc: QdrantClient, collection: str):
+    """Включает HNSW обратно (с параметрами до заливки) и ждёт, пока Qdrant достроит граф."""
+    saved = load_bulk_restore()
+    params = saved.get(collection) or {}
+    m = params.get("m") or HNSW_M
+    threshold = params.get("indexing_threshold")
+    t0 = time.perf_counter()
+    qc.update_collection(
+        collection_name=collection,
+        hnsw_config=models.HnswConfigDiff(m=m),
+        optimizers_config=models.OptimizersConfigDiff(
+            indexing_threshold=INDEXING_THRESHOLD if threshold is None else threshold),
+    )
+    if saved.pop(collection, None) is not None:
+        save_bulk_restore(saved)
+    t_restore = time.perf_counter() - t0
+    print(f"✔ Параметры графа восстановлены (m={m}) за {t_restore:.1f} сек")
+
+    t0 = time.perf_counter()
+    deadline = time.time() + OPTIMIZE_TIMEOUT
+    status = None
+    while time.time() < deadline:
+        status = qc.get_collection(collection).status
+        if status == models.CollectionStatus.GREEN:
+            break
+        time.sleep(OPTIMIZE_POLL_SEC)
+    t_opt = time.perf_counter() - t0
+    print(f"✔ Оптимизация: {t_opt:.1f} сек, статус: {status}")
+
 def main():
+    ap = argparse.ArgumentParser(description=f"Пересоздание коллекции {COLL}")
+    ap.add_argument("--bulk", action="store_true",
+                    help="создать коллекцию с выключенным HNSW под первичную заливку")
+    ap.add_argument("--finish-bulk", action="store_true",
+                    help="не пересоздавать, а включить HNSW после заливки и дождаться оптимизации")
+    args = ap.parse_args()
+
     qc = QdrantClient(
         host=QDRANT_HOST,
         port=QDRANT_PORT,
@@ -61,13 +182,48 @@ def main():
         timeout=30.0,
     )
 
+    if args.finish_bulk:
+        try:
+            targets = [COLL] if SHARD_MODE == "none" else list_shards(qc, COLL)
+            for name in targets:
+                finish_bulk(qc, name)
+        except Exception as e:
+            print(f"💥 Не удалось завершить bulk-load для {COLL}: {e}")
+            sys.exit(1)
+        return
+
+    aliases = {a.alias_name: a.collection_name for a in qc.get_aliases().aliases}
+    if COLL in aliases:
+        # живой индекс переключается через migrate.py — удалять его отсюда нельзя
+        print(f"💥 {COLL} — alias на {aliases[COLL]}. Пересборка без простоя: "
+              f"python migrate.py build … && python migrate.py swap …")
+        sys.exit(1)
+
     try:
+        shards = list_shards(qc, COLL)
+        if args.bulk:
+            remember_graph_params(qc, [COLL] + shards)
         drop_if_exists(qc, COLL)
-        create_collection(qc, COLL, DIM, DIST)
-        ensure_payload_indexes(qc, COLL)
-        # Быстрая проверка
-        info = qc.get_collection(COLL)
-        print(f"🎉 Готово. Статус коллекции: {info.status}")
+        for shard in shards:
+            drop_if_exists(qc, shard)
+        drop_if_exists(qc, CASES_COLL)
+        qc.create_collection(
+            collection_name=CASES_COLL,
+            vectors_config=models.VectorParams(size=DIM, distance=DIST),
+        )
+        ensure_payload_indexes(qc, CASES_COLL)
+        print(f"✔ Коллекция карточек дел создана: {CASES_COLL}")
+        if SHARD_MODE == "none":
+            create_collection(qc, COLL, DIM, DIST, bulk=args.bulk)
+            ensure_payload_indexes(qc, COLL)
+            # Быстрая проверка
+            info = qc.get_collection(COLL)
+            print(f"🎉 Готово. Статус коллекции: {info.status}")
+        else:
+            print(f"🎉 Готово. Шарды {COLL}{SHARD_SEP}* создаст индексатор при заливке")
+        if args.bulk:
+            print("ℹ Дальше: python stepthree_index.py --bulk "
+                  "(или заливка + python recreate.py --finish-bulk)")
     except Exception as e:
         print(f"💥 Не удалось пересоздать коллекцию {COLL}: {e}")
         sys.exit(1)
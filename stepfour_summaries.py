@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+STEP_FOUR: готовые карточки дел после индексации.
+
+Самый частый вопрос в чате — «кратко по делу X». Раньше каждый такой
+вопрос шёл через поиск и многотысячный промпт; теперь карточку (тот же
+шаблон, что в промпте сервера: Номер дела / Истец / Ответчик / Суд /
+Стадия / Частности / синопсис / Особенность) собираем заранее и кладём
+в case_summaries.sqlite, а сервер отдаёт её за миллисекунды.
+
+Какие дела пересобирать — по case_versions: индексатор увеличивает версию
+дела при каждой записи его точек, STEP_FOUR берёт дела, у которых версия
+карточки отстала. Текст дела — исходные TXT из SRC_DIR (имена файлов — из
+payload "file" точек дела); в LLM идут начало и конец дела (шапка, иск,
+последние акты — по ним стадия), середина длинных дел опускается.
+
+    python stepfour_summaries.py                        # демон (как STEP_THREE)
+    python stepfour_summaries.py --once                 # один проход
+    python stepfour_summaries.py --case А40-12345/2024  # одно дело, принудительно
+"""
+
+import os
+import sys
+import time
+import pathlib
+import argparse
+from typing import Dict, List, Optional
+
+from openai import OpenAIError
+from qdrant_client import models
+
+import stepthree_index as idx
+from case_number import canonical_case
+from case_summaries import CaseSummaries
+from case_versions import CaseVersions
+
+SUMMARY_MODEL      = "gpt-4.1"     # как GPT5_MODEL чат-сервера
+SUMMARY_MAX_TOKENS = 1_500
+CARD_HEAD_TOKENS   = 40_000        # начало дела в промпте
+CARD_TAIL_TOKENS   = 20_000        # конец дела в промпте
+SUMMARY_POLL_SEC   = 300
+SUMMARY_BATCH      = 50            # дел за проход демона
+# рядом с VERSIONS_DB индексатора; CASE_SUMMARIES_DB сервера должен указывать сюда же
+SUMMARIES_DB       = os.path.join(idx.STATE_DIR, "case_summaries.sqlite")
+
+_FAILED: Dict[str, int] = {}   # дело → версия, на которой сборка не удалась (не крутим по кругу)
+
+CARD_PROMPT = """\
+Ты — юридический ассистент по РФ. По материалам арбитражного дела ниже
+составь карточку дела строго по шаблону, без преамбул и пояснений:
+
+**Номер дела:**
+**Истец:**
+**Ответчик:**
+**Суд:**
+**Стадия:**
+**Частности дела:**
+**Краткий синопсис:**
+**Особенность:**
+
+Используй ТОЛЬКО материалы дела. Стадию определяй по последним по дате
+актам. Если середина дела опущена — допиши в «Особенность»: «карточка
+составлена по началу и концу материалов дела».
+
+Из шапки дела известно:
+Номер дела: {case_id}
+Суд: {court}
+Истец: {plaintiffs}
+Ответчик: {defendants}
+
+<CASE>
+{text}
+</CASE>
+"""
+
+
+def case_files(case_id: str) -> List[str]:
+    """Имена исходных TXT дела — из payload "file" его точек."""
+    filt = models.Filter(must=[models.FieldCondition(
+        key="case_id", match=models.MatchValue(value=case_id))])
+    files = set()
+    next_off = None
+    while True:
+        pts, next_off = idx.qdrant.scroll(collection_name=idx.shard_for(case_id),
+                                          scroll_filter=filt, limit=256, with_payload=["file"],
+                                          with_vectors=False, offset=next_off)
+        files.update(p.payload.get("file") for p in pts if p.payload.get("file"))
+        if not pts or next_off is None:
+            break
+    return sorted(files)
+
+
+def read_case_text(files: List[str]) -> str:
+    """Тексты файлов дела: «X.indexed.txt» после индексации, иначе «X.txt»."""
+    parts = []
+    for name in files:
+        path = pathlib.Path(idx.SRC_DIR) / name
+        for candidate in (idx.mark_processed(path), path):
+            if candidate.exists():
+                parts.append(candidate.read_text(encoding="utf-8"))
+                break
+    return "\n\n".join(parts)
+
+
+def clip_middle(text: str) -> str:
+    """Начало и конец длинного дела в пределах CARD_HEAD_TOKENS + CARD_TAIL_TOKENS."""
+    tokens = idx.enc.encode(text)
+    if len(tokens) <= CARD_HEAD_TOKENS + CARD_TAIL_TOKENS:
+        return text
+    return (idx.enc.decode(tokens[:CARD_HEAD_TOKENS])
+            + "\n\n[… середина материалов дела опущена …]\n\n"
+            + idx.enc.decode(tokens[-CARD_TAIL_TOKENS:]))
+
+
+def build_card(case_id: str) -> Optional[str]:
+    """Карточка дела; None — исходных TXT нет или модель ничего не вернула."""
+    text = read_case_text(case_files(case_id))
+    if not text.strip():
+        print(f"⚠ {case_id}: исходные TXT не найдены в {idx.SRC_DIR}")
+        return None
+    info = idx.parse_header_fields(text)
+    prompt = CARD_PROMPT.format(
+        case_id=case_id,
+        court=info["court"] or "—",
+        plaintiffs="; ".join(info["plaintiffs"]) or "—",
+        defendants="; ".join(info["defendants"]) or "—",
+        text=clip_middle(text),
+    )
+    rsp = idx.openai.responses.create(model=SUMMARY_MODEL, input=prompt,
+                                      max_output_tokens=SUMMARY_MAX_TOKENS)
+    card = (getattr(rsp, "output_text", None) or "").strip()
+    return card or None
+
+
+def summarize_pending(limit: Optional[int] = SUMMARY_BATCH) -> int:
+    """Пересобирает карточки дел, чья версия ушла вперёд. Возвращает число новых карточек."""
+    versions = CaseVersions(idx.VERSIONS_DB).cases()
+    store = CaseSummaries(SUMMARIES_DB)
+    done = store.versions()
+    pending = [c for c, v in versions.items()
+               if done.get(c) != v and _FAILED.get(c) != v][:limit]
+    written = 0
+    for case_id in pending:
+        # версию берём до сборки: если дело допишут во время сборки, на следующем проходе пересоберём
+        version = versions[case_id]
+        try:
+            card = build_card(case_id)
+        except OpenAIError as exc:
+            if idx.is_insufficient_funds(exc):
+                raise idx.InsufficientFundsError from exc
+            print(f"⚠ Карточка {case_id} не собрана: {exc}")
+            _FAILED[case_id] = version
+            continue
+        except Exception as exc:
+            print(f"⚠ Карточка {case_id} не собрана: {exc}")
+            _FAILED[case_id] = version
+            continue
+        if not card:
+            _FAILED[case_id] = version
+        else:
+            store.put(case_id, version, card, SUMMARY_MODEL)
+            written += 1
+            print(f"🗂 Карточка: {case_id} (версия {version})")
+    return written
+
+
+def STEP_FOUR(poll_sec: int = SUMMARY_POLL_SEC):
+    """Демон: после индексации пересобирает карточки изменившихся дел."""
+    os.makedirs(idx.STATE_DIR, exist_ok=True)
+    while True:
+        try:
+            n = summarize_pending()
+            # полная пачка — наверняка есть ещё, не спим
+            if n < SUMMARY_BATCH:
+                time.sleep(poll_sec)
+        except idx.InsufficientFundsError:
+            print("⏹ STEP_FOUR остановлен: нулевой баланс/квота OpenAI.")
+            break
+        except KeyboardInterrupt:
+            print("⏹ STEP_FOUR: останов по Ctrl+C.")
+            break
+        except Exception as exc:
+            print(f"💥 STEP_FOUR: {exc!r}. Повтор через {poll_sec} сек…")
+            time.sleep(poll_sec)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="STEP_FOUR: карточки дел для чат-сервера")
+    ap.add_argument("--once", action="store_true", help="один проход по отставшим делам и выйти")
+    ap.add_argument("--case", help="собрать карточку одного дела (независимо от версии)")
+    args = ap.parse_args()
+
+    os.makedirs(idx.STATE_DIR, exist_ok=True)
+    if args.case:
+        case_id = canonical_case(args.case)
+        if not case_id:
+            print(f"💥 Не номер дела: {args.case!r}")
+            sys.exit(1)
+        version = CaseVersions(idx.VERSIONS_DB).case(case_id)
+        card = build_card(case_id)
+        if not card:
+            sys.exit(1)
+        CaseSummaries(SUMMARIES_DB).put(case_id, version, card, SUMMARY_MODEL)
+        print(card)
+    elif args.once:
+        print(f"🎉 Новых карточек: {summarize_pending(limit=None)}")
+    else:
+        STEP_FOUR()
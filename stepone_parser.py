@@ -8,7 +8,9 @@ from datetime import date, timedelta
 import json
 import shutil
 from contextlib import suppress
+from functools import lru_cache
 from typing import Optional, Set
+from case_number import canonical_case
 from selenium import webdriver
 from selenium.webdriver import ActionChains
 from selenium.webdriver.chrome.options import Options
@@ -30,10 +32,7 @@ os.makedirs(DOWNLOADS_FINAL, exist_ok=True)
 os.makedirs(MANIFEST_DIR, exist_ok=True)
 
 
-CASE_NO_RE = re.compile(r"(?:[АA]\d{1,3}-\d{1,7}/\d{4}"  # А40-12345/2020
-                        r"|СИП-\d{1,7}(?:[-/]\d{4})?"  # СИП-715/2022 или СИП-715-2022
-                        r"|SIP-\d{1,7}(?:[-/]\d{4})?"  # SIP-6-2020
-                        r")", re.IGNORECASE)
+COURT_NAME_RE = re.compile(r"(Арбитражн(?:ый|ого)\s+суд[^\n\r]+|Суд по интеллектуальным правам[^\n\r]*)", re.I)
 INVALID_FS = '<>:"/\\|?*'
 
 START_DATE = date(2024, 1, 1)  # 01.01.TARGET_YEAR
@@ -162,14 +161,21 @@ ROLE_WORDS = ("истец", "истцы", "заявитель", "заявите
 SEP_RE = re.compile(r"\s*(?:;|,|•|·|—|-|\||/|\r?\n|\s{2,})\s*")
 
 
-def _grab_party_block(txt: str, headers: tuple) -> str:
-    stop = r"(?:Истец|Истцы|Заявитель|Заявители|Ответчик|Ответчики|Третьи лица|Иные лица|Суды и судьи|Судебные акты|Календарь|Электронное дело|$)"
+PARTY_STOP = r"(?:Истец|Истцы|Заявитель|Заявители|Ответчик|Ответчики|Третьи лица|Иные лица|Суды и судьи|Судебные акты|Календарь|Электронное дело|$)"
+
+
+@lru_cache(maxsize=None)
+def _party_block_re(headers: tuple) -> "re.Pattern":
     start = "|".join(headers)
     # допускаем в качестве границ не только перевод строки
-    m = re.search(
-        rf"(?:^|\r?\n|\s{{2,}})(?:{start})\s*:?\s*(.+?)(?=(?:\r?\n|\s{{2,}}|[|•·—-]\s*){stop})",
-        txt, re.I | re.S
+    return re.compile(
+        rf"(?:^|\r?\n|\s{{2,}})(?:{start})\s*:?\s*(.+?)(?=(?:\r?\n|\s{{2,}}|[|•·—-]\s*){PARTY_STOP})",
+        re.I | re.S
     )
+
+
+def _grab_party_block(txt: str, headers: tuple) -> str:
+    m = _party_block_re(headers).search(txt)
     block = m.group(1) if m else ""
     parts = [p.strip() for p in SEP_RE.split(block)
              if p.strip() and p.strip().lower() not in ROLE_WORDS]
@@ -250,22 +256,30 @@ def wait_case_card_ready(driver, timeout=30):
     return False
 
 
+ROLE_NOTE_RE = re.compile(r"\s*\((?:заявитель|ответчик|третье лицо)[^)]+\)\s*", re.I)
+
+
+@lru_cache(maxsize=None)
+def _party_label_re(label_re: str) -> "re.Pattern":
+    return re.compile(
+        rf"{label_re}\s*:\s*"  # 'Истец:' или 'Ответчик:'
+        rf"(.+?)"  # само значение (ленивый захват, включая переводы строк)
+        rf"(?=\r?\n\s*(?:Истец|Заявитель|Ответчик|Третье лицо|Судья|Состав суда|Секретарь|Стороны|$))",
+        re.I | re.S
+    )
+
+
 def _grab_party(label_re: str, text: str) -> str:
     """
     Берём значение после метки (с переносами строк), но останавливаемся
     перед следующей меткой типа Ответчик/Третье лицо/Судья/Состав суда и т.п.
     """
-    pattern = (
-        rf"{label_re}\s*:\s*"  # 'Истец:' или 'Ответчик:'
-        rf"(.+?)"  # само значение (ленивый захват, включая переводы строк)
-        rf"(?=\r?\n\s*(?:Истец|Заявитель|Ответчик|Третье лицо|Судья|Состав суда|Секретарь|Стороны|$))"
-    )
-    m = re.search(pattern, text, re.I | re.S)
+    m = _party_label_re(label_re).search(text)
     if not m:
         return ""
     val = _norm_ws(m.group(1))
     # иногда внутри может быть разделитель '—' или метки вроде '(заявитель)'
-    val = re.sub(r"\s*\((?:заявитель|ответчик|третье лицо)[^)]+\)\s*", " ", val, flags=re.I)
+    val = ROLE_NOTE_RE.sub(" ", val)
     return val.strip()
 
 
@@ -281,8 +295,8 @@ def extract_case_meta(driver, forced_court: Optional[str] = None) -> dict:
     txt = _visible_text(driver)
 
     # № дела
-    m_no = CASE_NO_RE.search(txt)
-    case_no = m_no.group(0) if m_no else ""
+    # сразу в общем каноне — по нему дело ищут STEP_TWO/STEP_THREE и сервер
+    case_no = canonical_case(txt) or ""
 
     # Суд (скрейпим как раньше, но ниже можем переопределить)
     court = ""
@@ -291,7 +305,7 @@ def extract_case_meta(driver, forced_court: Optional[str] = None) -> dict:
     if links:
         court = max((_norm_ws(e.text) for e in links), key=len, default="")
     if not court:
-        m = re.search(r"(Арбитражн(?:ый|ого)\s+суд[^\n\r]+|Суд по интеллектуальным правам[^\n\r]*)", txt, re.I)
+        m = COURT_NAME_RE.search(txt)
         court = _norm_ws(m.group(0)) if m else ""
 
     # Стороны — сначала из DOM
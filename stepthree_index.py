@@ -1,14 +1,28 @@
+import argparse
+import bisect
+import functools
+import hashlib
+import heapq
+import json
 import pathlib
+import threading
 import uuid
 import re
 import time
 import tqdm
 import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
+import numpy as np
 import tiktoken
 from openai import OpenAI, OpenAIError          # ← тип ошибки пригодится
 from qdrant_client import QdrantClient, models
-from typing import Optional, List
+from typing import Optional, List, Dict, Sequence, Tuple
+
+from case_number import canonical_case
+from case_versions import CaseVersions
+from token_sidecar import TokenSidecar, chunk_bounds, sidecar_path
 
 # ––– Parameters ––––––––––––––––––––––––––––––––––––––––
 OPENAI_KEY  = (
@@ -17,6 +31,11 @@ OPENAI_KEY  = (
 QDRANT_KEY  = OPENAI_KEY          # можно задать другой ключ
 QDRANT_HOST = "IP"
 QDRANT_PORT = "PORT"
+# "qdrant" — сервер Qdrant; "local" — local_engine.LocalQdrant: полный перебор
+# по memmap-матрице в LOCAL_DB_DIR, без сервера (CI, небольшие инсталляции).
+# У сервера чата должны быть те же VECTOR_BACKEND и LOCAL_DB_DIR.
+VECTOR_BACKEND = "qdrant"
+LOCAL_DB_DIR   = r"C:\Users\User\Desktop\kad_local"
 
 # === Периодический индексатор (STEP_THREE) =========================
 INDEX_POLL_SEC   = 120   # базовый интервал опроса, сек
@@ -24,22 +43,109 @@ INDEX_MAX_BACKOFF = 900  # максимум бэкоффа, сек (15 мину
 FILE_STABLE_SEC   = 2    # файл считаем «готовым», если не менялся >= N сек
 
 SRC_DIR   = r"C:\Users\User\Desktop\text_txt"
+# Имя, по которому пишем точки. После migrate.py это alias на kad_cases_vN:
+# upsert/search идут через alias, служебные операции — в реальную коллекцию.
 COLL      = "kad_cases"
 EMB_MODEL = "MODEL"
 DIM       = 768
 
+# Второй (усечённый) вектор для двухступенчатого поиска: первые SMALL_DIM
+# компонент того же эмбеддинга (Matryoshka — модель отдаёт префиксы,
+# пригодные как самостоятельные эмбеддинги). 0 — выключено, одна
+# безымянная векторная колонка как раньше. Включение требует пересоздать
+# коллекцию (recreate.py с тем же SMALL_DIM).
+SMALL_DIM = 0        # например 128 или 256
+VEC_FULL  = "full"   # имя полного вектора (DIM), HNSW по нему не строим
+VEC_SMALL = "small"  # имя усечённого вектора (SMALL_DIM), по нему HNSW
+
+# Карточки дел: один вектор на дело в отдельной коллекции — для первой
+# ступени иерархического поиска («подборка дел по …»). Вектор = смесь
+# первого чанка (в нём шапка дела) и центроида всех чанков файла,
+# без дополнительных запросов к API.
+CASE_CARDS       = True
+CASES_COLL       = "kad_case_cards"
+CASE_HEAD_WEIGHT = 0.5   # вес первого чанка (шапки) против центроида
+
 CHUNK     = 800      # размер блока в токенах
 OVERLAP   = 160      # перекрытие
-BATCH     = 128      # сколько точек отправлять за раз
+# Готовые токены и границы чанков от STEP_TWO («X.tok», token_sidecar.py):
+# файл не токенизируется заново. Sidecar от другого текста/модели/CHUNK
+# игнорируется. Проверка против живого chunker-а: --check-sidecars
+USE_TOKEN_SIDECARS = True
+BATCH     = 128      # стартовый размер пачки upsert, дальше подстраивается
+
+# === Адаптивные пачки upsert ==========================================
+# Размер пачки подбирается так, чтобы запрос весил ~UPSERT_TARGET_MB и
+# выполнялся ~UPSERT_TARGET_SEC: длинные чанки не упираются в лимит размера
+# запроса Qdrant, короткие не гоняются крошечными пачками. На 413/таймауте
+# пачка делится пополам и отправляется заново.
+UPSERT_TARGET_MB  = 4.0
+UPSERT_TARGET_SEC = 0.5
+UPSERT_MIN_BATCH  = 4
+UPSERT_MAX_BATCH  = 1024
+VECTOR_JSON_BYTES = 20     # ≈ байт на float в JSON-теле REST-запроса
+
+# === Bulk-load (первичная заливка после recreate.py) ==================
+# На время заливки отключаем построение HNSW-графа (m=0, indexing_threshold=0),
+# после — возвращаем параметры, что были у коллекции до заливки (они лежат в
+# BULK_RESTORE, см. ниже), и ждём, пока Qdrant достроит индекс. Коллекция,
+# созданная сразу без графа, получает HNSW_M / INDEXING_THRESHOLD.
+HNSW_M              = 16      # рабочее значение m (дефолт Qdrant)
+INDEXING_THRESHOLD  = 20_000  # рабочий порог индексации, КБ (дефолт Qdrant)
+OPTIMIZE_POLL_SEC   = 5       # как часто опрашивать статус коллекции
+OPTIMIZE_TIMEOUT    = 6 * 3600  # сколько максимум ждать «зелёного» статуса
+
+# === Метрики индексатора ==============================================
+# Служебная папка рядом с исходниками (glob("*.txt") в неё не заходит):
+#   indexer.prom     — текстовый формат Prometheus (node_exporter textfile collector)
+#   run-*.json       — сводка по каждому прогону index_all
+STATE_DIR    = os.path.join(SRC_DIR, "_index_state")
+METRICS_PROM = os.path.join(STATE_DIR, "indexer.prom")
+# Версии дел для сброса кэша ответов чат-сервера (case_versions.py);
+# CASE_VERSIONS_DB сервера должен указывать сюда же.
+VERSIONS_DB  = os.path.join(STATE_DIR, "case_versions.sqlite")
+# Параметры графа коллекций до bulk-заливки; BULK_RESTORE в recreate.py — тот же файл.
+BULK_RESTORE = os.path.join(STATE_DIR, "bulk_restore.json")
+
+# === Планировщик очереди файлов =======================================
+#   "glob"  — как раньше, в порядке обхода папки
+#   "mtime" — сначала самые свежие
+#   "size"  — сначала самые маленькие (быстрее всего становятся искомыми)
+SCHEDULE_POLICY    = "mtime"
+# Операторский список «горячих» дел: по номеру в строке, # — комментарий.
+# Эти дела идут первыми в порядке списка, независимо от политики.
+PRIORITY_FILE      = os.path.join(STATE_DIR, "priority.txt")
+# Как часто во время прогона пересканировать папку: новые файлы и новые
+# позиции в PRIORITY_FILE обгоняют бэклог, не дожидаясь следующего index_all.
+PREEMPT_RESCAN_SEC = 30
+# Файлы, появившиеся уже во время прогона, считать «горячими» (идут перед бэклогом)
+PREEMPT_NEW_FILES  = True
+
+# === Dry-run: прогноз переиндексации без API и Qdrant (--dry-run) ========
+# Цена и лимиты аккаунта для EMB_MODEL; задержка запроса берётся из
+# последней сводки run-*.json, если её нет — EMBED_LATENCY_GUESS.
+EMBED_PRICE_PER_1M  = 0.02        # $ за 1M входных токенов
+EMBED_RPM           = 3_000       # запросов в минуту
+EMBED_TPM           = 1_000_000   # токенов в минуту
+EMBED_LATENCY_GUESS = 0.3         # сек на запрос эмбеддинга
+DRY_RUN_WORKERS     = os.cpu_count() or 1   # процессов токенизации
+
+# === Шардирование коллекции ===========================================
+#   "none"       — всё в одну коллекцию COLL (как раньше)
+#   "year"       — kad_cases__2024, kad_cases__2023, …
+#   "year_court" — kad_cases__2024_a40, kad_cases__2024_a56, … (год + код суда из номера)
+# Дела без распознанного номера уходят в kad_cases__misc.
+# Разделитель «__», чтобы шарды не путались с версиями kad_cases_vN.
+SHARD_MODE = "none"
+SHARD_SEP  = "__"
 
 # Суффикс, который будет вставлен ПЕРЕД расширением, например
 #   «decision.txt» → «decision.indexed.txt»
 PROCESSED_TAG = ".indexed"
 
-CASE_RE = re.compile(
-    r"(?:[АA]\d{1,3}-\d{1,7}/\d{4}|СИП-\d{1,7}(?:[-/]\d{4})?)",
-    re.IGNORECASE
-)
+# Код суда и год из номера дела: «А40-12345/2024» → ("А40", "2024")
+CASE_PARTS_RE = re.compile(r"([АA]\d{1,3}|СИП)-\d{1,7}[-/_](\d{4})", re.IGNORECASE)
+
 NUM_MAP = {
     "0": "НОЛЬ", "1": "ОДИН", "2": "ДВА", "3": "ТРИ", "4": "ЧЕТЫРЕ",
     "5": "ПЯТЬ", "6": "ШЕСТЬ", "7": "СЕМЬ", "8": "ВОСЕМЬ", "9": "ДЕВЯТЬ",
@@ -63,18 +169,228 @@ def is_insufficient_funds(exc: Exception) -> bool:     # NEW
 # ––– Clients –––––––––––––––––––––––––––––––––––––––––––
 enc     = tiktoken.encoding_for_model(EMB_MODEL)
 openai  = OpenAI(api_key=OPENAI_KEY)
-qdrant  = QdrantClient(
-    host=QDRANT_HOST,
-    port=QDRANT_PORT,
-    api_key=QDRANT_KEY,
-    https=False,
-    timeout=30.0,
+if VECTOR_BACKEND == "local":
+    from local_engine import LocalQdrant
+    qdrant = LocalQdrant(LOCAL_DB_DIR)
+else:
+    qdrant = QdrantClient(
+        host=QDRANT_HOST,
+        port=QDRANT_PORT,
+        api_key=QDRANT_KEY,
+        https=False,
+        timeout=30.0,
+    )
+
+# ––– Метрики: счётчики и гистограммы задержек ––––––––––––
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_POINTS_BUCKETS = (4, 8, 16, 32, 64, 128, 256, 512, 1024)
+BATCH_BYTES_BUCKETS  = tuple(2**k * 1024 for k in range(6, 16))   # 64 КБ … 32 МБ
+TRACE_MAX = 2000     # сколько последних пачек хранить в JSON-сводке прогона
+
+METRIC_COUNTERS = (
+    "files",            # обработанные файлы
+    "chunks",           # нарезанные чанки
+    "tokens",           # токены в чанках (без index_tag)
+    "embed_calls",      # запросы к embeddings API
+    "embed_failures",   # неудачные запросы эмбеддинга
+    "upsert_batches",   # отправленные пачки в Qdrant
+    "upsert_failures",  # упавшие пачки
+    "upsert_splits",    # пачки, разделённые пополам после 413/таймаута
+    "points",           # успешно записанные точки
+    "cache_hits",       # файлы, нарезанные по готовому sidecar-у STEP_TWO (кэш токенов)
+    "cache_misses",     # sidecar-а нет или он устарел — токенизация заново
 )
 
+
+class Histogram:
+    """Кумулятивная гистограмма в стиле Prometheus (le-бакеты + sum/count)."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Грубая оценка квантиля по верхней границе бакета;
+        если попали в +Inf — отдаём максимум.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        acc = 0
+        for bound, c in zip(self.buckets, self.counts):
+            acc += c
+            if acc >= rank:
+                return bound
+        return round(self.max, 3)
+
+
+class IndexMetrics:
+    """Потокобезопасный набор счётчиков и гистограмм задержек индексатора."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters: Dict[str, int] = dict.fromkeys(METRIC_COUNTERS, 0)
+        self.histograms: Dict[str, Histogram] = {
+            "embed_latency_seconds": Histogram(),
+            "upsert_latency_seconds": Histogram(),
+            "upsert_batch_points": Histogram(BATCH_POINTS_BUCKETS),
+            "upsert_batch_bytes": Histogram(BATCH_BYTES_BUCKETS),
+        }
+        # траектории (например, размер пачки → задержка) — только в JSON-сводку
+        self.traces: Dict[str, List[dict]] = {}
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def trace(self, name: str, **sample):
+        with self._lock:
+            t = self.traces.setdefault(name, [])
+            t.append({"t": round(time.time() - self.started, 3), **sample})
+            if len(t) > TRACE_MAX:
+                del t[:len(t) - TRACE_MAX]
+
+    def merge(self, other: "IndexMetrics"):
+        with self._lock:
+            for k, v in other.counters.items():
+                self.counters[k] = self.counters.get(k, 0) + v
+            for k, h in other.histograms.items():
+                self.histograms.setdefault(k, Histogram(h.buckets)).merge(h)
+
+    def to_prometheus(self, prefix: str = "kad_indexer") -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, val in self.counters.items():
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {val}")
+            for name, h in self.histograms.items():
+                metric = f"{prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                acc = 0
+                for bound, c in zip(h.buckets, h.counts):
+                    acc += c
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {acc}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+                lines.append(f"{metric}_sum {h.sum:.6f}")
+                lines.append(f"{metric}_count {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        with self._lock:
+            wall = time.time() - self.started
+            out = {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "wall_sec": round(wall, 3),
+                "counters": dict(self.counters),
+                "chunks_per_sec": round(self.counters.get("chunks", 0) / wall, 3) if wall > 0 else None,
+                "latency": {},
+            }
+            for name, h in self.histograms.items():
+                out["latency"][name] = {
+                    "count": h.count,
+                    "sum": round(h.sum, 3),
+                    "avg": round(h.sum / h.count, 4) if h.count else None,
+                    "p50": h.quantile(0.50),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                    "max": round(h.max, 3),
+                }
+            out["traces"] = {k: list(v) for k, v in self.traces.items()}
+        return out
+
+
+def _write_atomic(path: str, text: str):
+    """Пишем через временный файл, чтобы сборщик не прочитал половину."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_metrics(run: IndexMetrics):
+    """Сливает прогон в общие метрики процесса, обновляет .prom и пишет JSON-сводку."""
+    METRICS.merge(run)
+    try:
+        _write_atomic(METRICS_PROM, METRICS.to_prometheus())
+        stamp = datetime.fromtimestamp(run.started).strftime("%Y%m%d-%H%M%S")
+        _write_atomic(
+            os.path.join(STATE_DIR, f"run-{stamp}.json"),
+            json.dumps(run.summary(), ensure_ascii=False, indent=2),
+        )
+    except OSError as exc:
+        print(f"⚠ Не удалось записать метрики: {exc}")
+
+
+METRICS = IndexMetrics()   # накопительные метрики за время жизни процесса
+
+
+def bump_case_version(case_num: str):
+    """Точки дела записаны — закэшированные сервером ответы по нему устарели."""
+    try:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        CaseVersions(VERSIONS_DB).bump([case_num])
+    except Exception as exc:
+        print(f"⚠ Не удалось обновить версию дела {case_num}: {exc}")
+
+
 # --- Шапка дела: Суд / Истец / Ответчик / Номер дела -------------------------
 
 HEADER_SLICE = 6000  # как было
 
+# Быстрый путь: ровно тот блок, который пишет steptwo_handler.build_header —
+#   ===== ШАПКА ДЕЛА =====
+#   Номер дела: …
+#   Суд: …
+#   Истец: …
+#   Ответчик: …
+#   =====
+# Один скомпилированный шаблон, один проход с начала файла.
+HEADER_FAST_RE = re.compile(
+    r"\ufeff?=+ ШАПКА ДЕЛА =+\r?\n"
+    r"Номер дела: ([^\r\n]*)\r?\n"
+    r"Суд: ([^\r\n]*)\r?\n"
+    r"Истец: ([^\r\n]*)\r?\n"
+    r"Ответчик: ([^\r\n]*)\r?\n"
+    r"={3,}"
+)
+
+# Ярлыки для старых/нестандартных файлов (медленный путь через _grab)
+LABEL_COURT = r"Суд"
+LABEL_PLAINTIFF = r"Истец|Заявитель|Административн\w*\s+истец"
+LABEL_DEFENDANT = r"Ответчик|Административн\w*\s+ответчик|Заинтересован\w*"
+
+@functools.lru_cache(maxsize=None)
+def _grab_re(label: str) -> "re.Pattern":
+    """Шаблон для ярлыка компилируется один раз на процесс."""
+    # ВАЖНО: группируем альтернацию ярлыка (?:{label})
+    return re.compile(
+        rf"(?im)^\s*(?:{label})\s*:\s*(.+?)\s*(?=\n\s*(?:Номер\s*дела|Суд|Истец|Ответчик)\s*:|\n\s*={{3,}}|$)"
+    )
+
 def _grab(label: str, head: str) -> Optional[str]:
     """
     Извлекает значение после одного из ярлыков (label)
@@ -83,32 +399,62 @@ def _grab(label: str, head: str) -> Optional[str]:
     if not head:
         return None
     # Нормализуем переносы строк: CRLF/CR -> LF
-    head = head.replace("\r\n", "\n").replace("\r", "\n")
+    if "\r" in head:
+        head = head.replace("\r\n", "\n").replace("\r", "\n")
 
-    # ВАЖНО: группируем альтернацию ярлыка (?:{label})
-    pat = rf"(?im)^\s*(?:{label})\s*:\s*(.+?)\s*(?=\n\s*(?:Номер\s*дела|Суд|Истец|Ответчик)\s*:|\n\s*={3,}|$)"
-    m = re.search(pat, head)
+    m = _grab_re(label).search(head)
     if not m:
         return None
     val = m.group(1)
     return val.strip() if isinstance(val, str) else None
 
+_QUOTES_RE = re.compile(r"[«»\"'“”]")
+_SPACES_RE = re.compile(r"\s+")
+_PARTY_SPLIT_RE = re.compile(r"\s*(?:;|,|\s+\bи\b\s*)\s*", re.IGNORECASE)
+
 def _clean_name(s: str) -> str:
     s = s.replace("\u00A0", " ")            # неразрывные пробелы
-    s = re.sub(r"[«»\"'“”]", "", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _QUOTES_RE.sub("", s)
+    s = _SPACES_RE.sub(" ", s).strip()
     return s
 
 def _split_many(s: Optional[str]) -> List[str]:
     """Безопасно разбивает список сторон на элементы."""
     if not s:
         return []
-    parts = re.split(r"\s*(?:;|,|\s+\bи\b\s*)\s*", s, flags=re.IGNORECASE)
+    parts = _PARTY_SPLIT_RE.split(s)
     return [_clean_name(p) for p in parts if p and p.strip()]
 
-CASE_IN_TEXT_RE = re.compile(
-    r"(?im)^\s*Номер\s*дела\s*:\s*([АA]\d{1,3}-\d{1,7}/\d{4}|СИП-\d{1,7}(?:[-/]\d{4})?)"
-)
+CASE_IN_TEXT_RE = re.compile(r"(?im)^\s*Номер\s*дела\s*:\s*([^\n]*)")
+
+def _header_fields(case_raw: Optional[str], court_raw: Optional[str],
+                   istec_raw: Optional[str], otv_raw: Optional[str]) -> dict:
+    return {
+        "case_id": canonical_case(case_raw),
+        "court": _clean_name(court_raw) if court_raw else None,
+        "plaintiffs": _split_many(istec_raw),
+        "defendants": _split_many(otv_raw),
+    }
+
+def parse_header_fast(text: str) -> Optional[dict]:
+    """Шапка ровно в формате STEP_TWO; None — формат другой, нужен parse_header_legacy."""
+    m = HEADER_FAST_RE.match(text)
+    if not m:
+        return None
+    return _header_fields(*(v.strip() or None for v in m.groups()))
+
+def parse_header_legacy(text: str) -> dict:
+    """Поиск ярлыков по всему началу файла — для старых и нестандартных шапок."""
+    # Нормализуем переносы один раз
+    head = text[:HEADER_SLICE].replace("\r\n", "\n").replace("\r", "\n")
+
+    m_case = CASE_IN_TEXT_RE.search(head)
+    return _header_fields(
+        m_case.group(1) if m_case else None,
+        _grab(LABEL_COURT, head),
+        _grab(LABEL_PLAINTIFF, head),
+        _grab(LABEL_DEFENDANT, head),
+    )
 
 def parse_header_fields(text: str) -> dict:
     """
@@ -116,42 +462,156 @@ def parse_header_fields(text: str) -> dict:
     """
     if not text:
         return {"case_id": None, "court": None, "plaintiffs": [], "defendants": []}
+    return parse_header_fast(text) or parse_header_legacy(text)
 
-    # Нормализуем переносы один раз
-    head = text[:HEADER_SLICE].replace("\r\n", "\n").replace("\r", "\n")
 
-    m_case = CASE_IN_TEXT_RE.search(head)
-    case_in_text = m_case.group(1).upper() if m_case else None
+# ––– Helper functions ––––––––––––––––––––––––––––––––––
 
-    court_raw = _grab(r"Суд", head)
-    istec_raw = _grab(r"Истец|Заявитель|Административн\w*\s+истец", head)
-    otv_raw   = _grab(r"Ответчик|Административн\w*\s+ответчик|Заинтересован\w*", head)
+def chunker(text: str):
+    """Yield overlapping chunks of text, each ≈CHUNK tokens."""
+    for toks in chunk_tokens(enc.encode(text)):
+        yield enc.decode(toks)
 
-    court = _clean_name(court_raw) if court_raw else None
-    plaintiffs = _split_many(istec_raw)
-    defendants = _split_many(otv_raw)
 
-    return {
-        "case_id": case_in_text,
-        "court": court,
-        "plaintiffs": plaintiffs,
-        "defendants": defendants,
-    }
+def chunk_tokens(tokens: List[int]):
+    """Yield overlapping token slices, each ≤CHUNK tokens."""
+    step = CHUNK - OVERLAP
+    for i in range(0, len(tokens), step):
+        yield tokens[i : i + CHUNK]
 
 
-# ––– Helper functions ––––––––––––––––––––––––––––––––––
+def file_token_spans(path: pathlib.Path, raw_text: str,
+                     metrics: Optional[IndexMetrics] = None) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """
+    Токены файла и границы чанков [start, end): из sidecar-а STEP_TWO,
+    если он годен, иначе как chunk_tokens.
+    """
+    if USE_TOKEN_SIDECARS:
+        sc = TokenSidecar.read(sidecar_path(path.with_name(unmark_processed(path.name))))
+        if sc and sc.matches(raw_text, EMB_MODEL, CHUNK, OVERLAP):
+            if metrics:
+                metrics.inc("cache_hits")
+            return sc.tokens.tolist(), sc.bounds
+        if metrics:
+            metrics.inc("cache_misses")
+    tokens = enc.encode(raw_text)
+    return tokens, chunk_bounds([0], len(tokens), CHUNK, OVERLAP)
 
-def chunker(text: str):
-    """Yield overlapping chunks of text, each ≈CHUNK tokens."""
-    tokens = enc.encode(text)
-    step   = CHUNK - OVERLAP
-    for i in range(0, len(tokens), step):
-        yield enc.decode(tokens[i : i + CHUNK])
+
+def file_token_chunks(path: pathlib.Path, raw_text: str,
+                      metrics: Optional[IndexMetrics] = None):
+    """Чанки файла в токенах (см. file_token_spans)."""
+    tokens, bounds = file_token_spans(path, raw_text, metrics)
+    return (tokens[a:b] for a, b in bounds)
+
+
+def token_char_offsets(tokens: Sequence[int], text: str) -> np.ndarray:
+    """
+    Позиция в символах text начала каждого токена, последним — len(text).
+    Токен, начатый посреди многобайтного символа, считается с конца символа.
+    """
+    tok_bytes = np.fromiter((len(enc.decode_single_token_bytes(t)) for t in tokens),
+                            dtype=np.int64, count=len(tokens))
+    byte_pos = np.concatenate(([0], np.cumsum(tok_bytes)))
+    raw = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+    # сколько символов начато до каждого байта: начало символа — не 0b10xxxxxx
+    chars_before = np.concatenate(([0], np.cumsum((raw & 0xC0) != 0x80)))
+    return chars_before[np.minimum(byte_pos, len(raw))]
+
+
+def check_sidecars(src: str = SRC_DIR) -> bool:
+    """
+    Сверка sidecar-ов с живым chunker-ом по всем TXT в src:
+      - токены sidecar-а декодируются ровно в текст файла;
+      - чанки не выходят за границы документов и покрывают все токены;
+      - у дел из одного PDF чанки совпадают с chunk_tokens(enc.encode(text)).
+    """
+    stats = dict.fromkeys(("ok", "same_as_live", "missing", "stale", "broken"), 0)
+    for path in sorted(pathlib.Path(src).glob("*.txt")):
+        text = path.read_text(encoding="utf-8")
+        sc = TokenSidecar.read(sidecar_path(path.with_name(unmark_processed(path.name))))
+        if sc is None:
+            stats["missing"] += 1
+            continue
+        if not sc.matches(text, EMB_MODEL, CHUNK, OVERLAP):
+            stats["stale"] += 1
+            continue
+        problems = []
+        if enc.decode(sc.tokens.tolist()) != text:
+            problems.append("токены не декодируются в текст файла")
+        ends = sc.doc_starts[1:] + [len(sc.tokens)]
+        covered = set()
+        for a, b in sc.bounds:
+            if not any(s <= a < b <= e for s, e in zip(sc.doc_starts, ends)):
+                problems.append(f"чанк [{a}, {b}) пересекает границу документа")
+                break
+            covered.update(range(a, b))
+        if len(covered) != len(sc.tokens):
+            problems.append("чанки покрывают не все токены")
+        if len(sc.doc_starts) == 1 and not problems:
+            if list(sc.chunks()) != [list(t) for t in chunk_tokens(enc.encode(text))]:
+                problems.append("чанки расходятся с живым chunker-ом")
+            else:
+                stats["same_as_live"] += 1
+        if problems:
+            stats["broken"] += 1
+            print(f"✘ {path.name}: {'; '.join(problems)}")
+        else:
+            stats["ok"] += 1
+    print("ℹ Sidecar-ы: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+    return stats["broken"] == 0
+
+
+def make_index_tag(case_num: str, court: Optional[str],
+                   plaintiffs: List[str], defendants: List[str]) -> str:
+    """Префикс каждого чанка: номер, суд и стороны — попадает и в эмбеддинг."""
+    index_tag = f"<CASE:{case_num}>"
+    if court:
+        index_tag += f" <COURT:{court}>"
+    if plaintiffs:
+        index_tag += f" <ISTEC:{';'.join(plaintiffs[:2])}>"
+    if defendants:
+        index_tag += f" <OTV:{';'.join(defendants[:2])}>"
+    return index_tag + "\n"
 
 
 def extract_case(filename: str) -> str:
-    m = CASE_RE.search(filename)
-    return m.group(0).upper() if m else "UNKNOWN"
+    # STEP_TWO пишет «А40-12345-2024.txt» — canonical_case понимает и такой вид
+    return canonical_case(filename) or "UNKNOWN"
+
+
+def shard_for(case_num: Optional[str]) -> str:
+    """Имя коллекции (шарда), в которую идут точки дела."""
+    if SHARD_MODE == "none":
+        return COLL
+    m = CASE_PARTS_RE.search(case_num or "")
+    if not m:
+        return f"{COLL}{SHARD_SEP}misc"
+    year = m.group(2)
+    if SHARD_MODE == "year":
+        return f"{COLL}{SHARD_SEP}{year}"
+    code = m.group(1).upper().replace("А", "A").replace("СИП", "SIP").lower()
+    return f"{COLL}{SHARD_SEP}{year}_{code}"
+
+
+def list_shards() -> List[str]:
+    """Все существующие коллекции индекса: COLL или его шарды."""
+    if SHARD_MODE == "none":
+        return [COLL]
+    prefix = COLL + SHARD_SEP
+    return sorted(c.name for c in qdrant.get_collections().collections
+                  if c.name.startswith(prefix))
+
+
+def physical_name(name: str) -> str:
+    """Реальная коллекция за alias-ом (или само имя, если это не alias)."""
+    try:
+        for a in qdrant.get_aliases().aliases:
+            if a.alias_name == name:
+                return a.collection_name
+    except Exception:
+        pass
+    return name
 
 
 def mark_processed(path: pathlib.Path) -> pathlib.Path:
@@ -171,97 +631,494 @@ def _file_is_stable(path: pathlib.Path, stable_sec: int = FILE_STABLE_SEC) -> bo
         return False
 
 
-def flush_batches(buf, *, wait=False):
+def unmark_processed(name: str) -> str:
+    """«file.indexed.txt» → «file.txt» (имя, под которым файл лежит в payload)."""
+    stem, ext = os.path.splitext(name)
+    if stem.endswith(PROCESSED_TAG):
+        return stem[: -len(PROCESSED_TAG)] + ext
+    return name[: -len(PROCESSED_TAG)] if name.endswith(PROCESSED_TAG) else name
+
+
+def _is_pending(path: pathlib.Path, include_indexed: bool = False) -> bool:
+    """Файл ещё не проиндексирован (или переиндексируем всё) и уже дописан."""
+    if not include_indexed and path.name.endswith(PROCESSED_TAG + path.suffix):
+        return False
+    return _file_is_stable(path, FILE_STABLE_SEC)
+
+
+def _priority_key(case_no: str) -> str:
+    """
+    Ключ сравнения номера дела с именем файла: STEP_TWO пишет «А40-1-2024.txt»
+    (слеш заменён), оператор — «А40-1/2024». Оба приводим к канону; строки
+    без номера — по-старому, без разделителей и с кириллической А.
+    """
+    return canonical_case(case_no) or re.sub(r"[\W_]+", "", case_no.upper()).replace("A", "А")
+
+
+def load_priority_list(path: str = PRIORITY_FILE) -> List[str]:
+    """Читает операторский список приоритетных дел (может отсутствовать)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = [ln.split("#", 1)[0].strip() for ln in f]
+    except FileNotFoundError:
+        return []
+    except OSError as exc:
+        print(f"⚠ Не удалось прочитать {path}: {exc}")
+        return []
+    return [_priority_key(ln) for ln in lines if ln]
+
+
+class IndexQueue:
+    """
+    Очередь файлов на индексацию с приоритетами:
+      0 — дела из PRIORITY_FILE (в порядке списка),
+      1 — файлы, пришедшие во время прогона (если PREEMPT_NEW_FILES),
+      2 — бэклог.
+    Внутри уровня порядок задаёт политика (glob / mtime / size).
+    Во время итерации папка пересканируется раз в rescan_sec, так что
+    горячие файлы вытесняют бэклог между файлами.
+    """
+
+    def __init__(self, src: pathlib.Path, policy: str = SCHEDULE_POLICY,
+                 rescan_sec: float = PREEMPT_RESCAN_SEC, include_indexed: bool = False):
+        if policy not in ("glob", "mtime", "size"):
+            raise ValueError(f"Неизвестная политика планировщика: {policy}")
+        self.src = src
+        self.policy = policy
+        self.include_indexed = include_indexed
+        self.rescan_sec = rescan_sec
+        self.started = time.time()
+        self._heap: list = []
+        self._seen = set()
+        self._seq = 0          # порядок обнаружения — для "glob" и стабильности
+        self._priority: Dict[str, int] = {}
+        self._last_scan = 0.0
+        self.scan()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _policy_key(self, st: os.stat_result):
+        if self.policy == "mtime":
+            return -st.st_mtime
+        if self.policy == "size":
+            return st.st_size
+        return 0
+
+    def _tier(self, path: pathlib.Path, st: os.stat_result):
+        rank = self._priority.get(_priority_key(pathlib.Path(unmark_processed(path.name)).stem))
+        if rank is not None:
+            return 0, rank
+        if PREEMPT_NEW_FILES and st.st_mtime > self.started:
+            return 1, 0
+        return 2, 0
+
+    def scan(self) -> int:
+        """Добавляет в очередь новые готовые файлы. Возвращает сколько добавлено."""
+        self._last_scan = time.time()
+        prio = {c: i for i, c in enumerate(load_priority_list())}
+        if prio != self._priority:
+            # список поменялся — пересчитываем уровни у уже стоящих в очереди
+            self._priority = prio
+            queued = [item[-1] for item in self._heap]
+            self._heap = []
+            self._seen.difference_update(queued)
+        added = 0
+        for path in self.src.glob("*.txt"):
+            if path in self._seen or not _is_pending(path, self.include_indexed):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            tier, rank = self._tier(path, st)
+            self._seq += 1
+            heapq.heappush(self._heap, (tier, rank, self._policy_key(st), self._seq, path))
+            self._seen.add(path)
+            added += 1
+        return added
+
+    def __iter__(self):
+        while True:
+            if self.rescan_sec and time.time() - self._last_scan >= self.rescan_sec:
+                self.scan()
+            if not self._heap:
+                return
+            path = heapq.heappop(self._heap)[-1]
+            if path.exists():
+                yield path
+
+
+def point_bytes(p: models.PointStruct) -> int:
+    """Оценка веса точки в теле запроса: payload в JSON + векторы."""
+    vec = p.vector
+    dims = sum(len(v) for v in vec.values()) if isinstance(vec, dict) else len(vec)
+    return len(json.dumps(p.payload, ensure_ascii=False).encode("utf-8")) + dims * VECTOR_JSON_BYTES
+
+
+def _is_split_error(exc: Exception) -> bool:
+    """413 Payload Too Large или таймаут — пачку стоит разделить, а не терять."""
+    if getattr(exc, "status_code", None) == 413 or isinstance(exc, TimeoutError):
+        return True
+    # не по «413» в тексте: это может быть id, счётчик или порт
+    text = str(exc).lower()
+    return any(tok in text for tok in ("payload too large", "timed out", "timeout"))
+
+
+class AdaptiveBatcher:
+    """
+    Размер пачки upsert по байтам и задержке. После каждой полной пачки цель
+    пересчитывается по байтам и секундам на точку так, чтобы пачка укладывалась
+    в UPSERT_TARGET_MB и UPSERT_TARGET_SEC (не больше чем вдвое за шаг от
+    текущей цели); 413/таймаут — вдвое меньше. Хвосты файлов цель не меняют.
+    """
+
+    def __init__(self, size: int = BATCH, target_bytes: float = UPSERT_TARGET_MB * 2**20,
+                 target_sec: float = UPSERT_TARGET_SEC):
+        self.size = size
+        self.target_bytes = target_bytes
+        self.target_sec = target_sec
+
+    def full(self, n: int, nbytes: int) -> bool:
+        return n >= self.size or nbytes >= self.target_bytes
+
+    def _clamp(self, size: float) -> int:
+        return int(min(UPSERT_MAX_BATCH, max(UPSERT_MIN_BATCH, size)))
+
+    def record(self, n: int, nbytes: int, sec: float):
+        # неполная пачка (хвост файла) о пределах сервера ничего не говорит
+        if not self.full(n, nbytes):
+            return
+        ideal = n * min(self.target_bytes / max(nbytes, 1), self.target_sec / max(sec, 1e-3))
+        self.size = self._clamp(min(2 * self.size, max(self.size / 2, ideal)))
+
+    def shrink(self, n: int):
+        self.size = self._clamp(min(self.size, n // 2))
+
+
+BATCHER = AdaptiveBatcher()   # общий на процесс: лимиты — свойство сервера Qdrant
+
+
+def flush_batches(buf, *, wait=False, metrics: Optional[IndexMetrics] = None,
+                  collection: str = COLL):
     if buf:
         try:
-            qdrant.upsert(COLL, points=buf, wait=wait)
-        except Exception as exc:
-            print(f"⚠ Qdrant upsert failed (batch size {len(buf)}): {exc}")
+            _upsert_split(list(buf), wait=wait, metrics=metrics, collection=collection)
         finally:
             buf.clear()
 
 
-def ensure_payload_indexes():
+def _upsert_split(points: List[models.PointStruct], *, wait: bool,
+                  metrics: Optional[IndexMetrics], collection: str):
+    nbytes = sum(point_bytes(p) for p in points)
+    t0 = time.perf_counter()
+    try:
+        qdrant.upsert(collection, points=points, wait=wait)
+    except Exception as exc:
+        if len(points) > 1 and _is_split_error(exc):
+            BATCHER.shrink(len(points))
+            print(f"⚠ Qdrant upsert: {exc} — делю пачку {len(points)} → {BATCHER.size}")
+            if metrics:
+                metrics.inc("upsert_splits")
+            half = len(points) // 2
+            _upsert_split(points[:half], wait=wait, metrics=metrics, collection=collection)
+            _upsert_split(points[half:], wait=wait, metrics=metrics, collection=collection)
+            return
+        print(f"⚠ Qdrant upsert failed (batch size {len(points)}): {exc}")
+        if metrics:
+            metrics.inc("upsert_failures")
+            metrics.inc("upsert_batches")
+        return
+
+    sec = time.perf_counter() - t0
+    BATCHER.record(len(points), nbytes, sec)
+    if metrics:
+        metrics.inc("upsert_batches")
+        metrics.inc("points", len(points))
+        metrics.observe("upsert_latency_seconds", sec)
+        metrics.observe("upsert_batch_points", len(points))
+        metrics.observe("upsert_batch_bytes", nbytes)
+        metrics.trace("upsert", points=len(points), bytes=nbytes,
+                      sec=round(sec, 4), next_size=BATCHER.size)
+
+
+def ensure_payload_indexes(collection: str = COLL):
+    collection = physical_name(collection)
     for field in ("case_id", "court", "plaintiffs", "defendants"):
         try:
             qdrant.create_payload_index(
-                collection_name=COLL,
+                collection_name=collection,
                 field_name=field,
                 field_schema=models.PayloadSchemaType.KEYWORD,
             )
         except Exception:
             pass  # уже есть или создастся позже
+    # полнотекстовый индекс по сторонам — лексический поиск «дела против ООО …»
+    try:
+        qdrant.create_payload_index(
+            collection_name=collection,
+            field_name="parties",
+            field_schema=models.TextIndexParams(
+                type=models.TextIndexType.TEXT,
+                tokenizer=models.TokenizerType.WORD,
+                min_token_len=2,
+                lowercase=True,
+            ),
+        )
+    except Exception:
+        pass
+
+def vectors_config():
+    """Схема векторов коллекции: один вектор или пара full/small."""
+    if not SMALL_DIM:
+        return models.VectorParams(size=DIM, distance=models.Distance.COSINE)
+    return {
+        # полный вектор нужен только для пересчёта score кандидатов —
+        # граф по нему не строим, это основная экономия памяти HNSW
+        VEC_FULL: models.VectorParams(
+            size=DIM, distance=models.Distance.COSINE,
+            hnsw_config=models.HnswConfigDiff(m=0),
+        ),
+        VEC_SMALL: models.VectorParams(size=SMALL_DIM, distance=models.Distance.COSINE),
+    }
+
+
+def point_vector(vec: List[float]):
+    """Вектор точки под текущую схему; COSINE сам нормирует усечённый префикс."""
+    if not SMALL_DIM:
+        return vec
+    return {VEC_FULL: vec, VEC_SMALL: vec[:SMALL_DIM]}
+
 
-def ensure_collection():
+_ENSURED = set()   # коллекции, проверенные в этом проходе (index_all сбрасывает)
+
+
+def ensure_collection(bulk: bool = False, collection: str = COLL):
+    if collection in _ENSURED:
+        return
     try:
-        qdrant.get_collection(COLL)
+        # alias (kad_cases → kad_cases_vN) не пересоздаём — проверяем то, на что он смотрит
+        qdrant.get_collection(physical_name(collection))
     except Exception:
-        print("⏳ Создаю коллекцию…")
+        print(f"⏳ Создаю коллекцию {collection}…")
         qdrant.create_collection(
-            collection_name=COLL,
-            vectors_config=models.VectorParams(size=DIM, distance=models.Distance.COSINE),
+            collection_name=collection,
+            vectors_config=vectors_config(),
+            # в bulk-режиме граф сразу выключен — не строим его ради пустой коллекции
+            hnsw_config=models.HnswConfigDiff(m=0) if bulk else None,
+            optimizers_config=(
+                models.OptimizersConfigDiff(indexing_threshold=0) if bulk else None
+            ),
         )
     # ← гарантируем индексы
-    ensure_payload_indexes()
+    ensure_payload_indexes(collection)
+    _ENSURED.add(collection)
+
+
+def ensure_cases_collection():
+    if CASES_COLL in _ENSURED:
+        return
+    try:
+        qdrant.get_collection(CASES_COLL)
+    except Exception:
+        print(f"⏳ Создаю коллекцию {CASES_COLL}…")
+        qdrant.create_collection(
+            collection_name=CASES_COLL,
+            vectors_config=models.VectorParams(size=DIM, distance=models.Distance.COSINE),
+        )
+    ensure_payload_indexes(CASES_COLL)
+    _ENSURED.add(CASES_COLL)
+
+
+def case_card_vector(vecs: List[List[float]]) -> List[float]:
+    """Смесь вектора первого чанка (шапка) и центроида всех чанков, нормированная."""
+    m = np.asarray(vecs, dtype=np.float32)
+    m /= np.linalg.norm(m, axis=1, keepdims=True) + 1e-12
+    v = CASE_HEAD_WEIGHT * m[0] + (1.0 - CASE_HEAD_WEIGHT) * m.mean(axis=0)
+    v /= np.linalg.norm(v) or 1.0
+    return v.tolist()
+
+
+def upsert_case_card(case_num: str, filename: str, info: dict, vecs: List[List[float]]):
+    """Одна точка на дело; id детерминированный — повторная индексация перезаписывает."""
+    if not CASE_CARDS or not vecs or case_num == "UNKNOWN":
+        return
+    try:
+        ensure_cases_collection()
+        qdrant.upsert(CASES_COLL, points=[
+            models.PointStruct(
+                id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"case:{case_num}")),
+                vector=case_card_vector(vecs),
+                payload={
+                    "case_id": case_num,
+                    "file": filename,
+                    "court": info["court"],
+                    "plaintiffs": info["plaintiffs"],
+                    "defendants": info["defendants"],
+                    "parties": "; ".join(info["plaintiffs"] + info["defendants"]),
+                    "chunks": len(vecs),
+                },
+            )
+        ])
+    except Exception as exc:
+        print(f"⚠ Не удалось записать карточку дела {case_num}: {exc}")
+
+
+# ––– Bulk-load: отключение/восстановление HNSW ––––––––––––
+
+def _load_bulk_restore() -> Dict[str, dict]:
+    try:
+        with open(BULK_RESTORE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_bulk_restore(saved: Dict[str, dict]):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    tmp = BULK_RESTORE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(saved, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, BULK_RESTORE)
+
+
+def begin_bulk_load(collection: str = COLL):
+    """Выключает построение HNSW на время массовой заливки, запомнив текущие параметры."""
+    collection = physical_name(collection)
+    cfg = qdrant.get_collection(collection).config
+    # m=0 — граф уже выключен (прерванная заливка): рабочие значения запомнены раньше
+    if cfg.hnsw_config.m:
+        saved = _load_bulk_restore()
+        saved[collection] = {"m": cfg.hnsw_config.m,
+                             "indexing_threshold": cfg.optimizer_config.indexing_threshold}
+        _save_bulk_restore(saved)
+    qdrant.update_collection(
+        collection_name=collection,
+        hnsw_config=models.HnswConfigDiff(m=0),
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+    )
+
+
+def end_bulk_load(collection: str = COLL):
+    """Возвращает параметры графа, что были до заливки — Qdrant начнёт строить индекс."""
+    collection = physical_name(collection)
+    saved = _load_bulk_restore()
+    params = saved.get(collection) or {}
+    m = params.get("m") or HNSW_M
+    threshold = params.get("indexing_threshold")
+    qdrant.update_collection(
+        collection_name=collection,
+        hnsw_config=models.HnswConfigDiff(m=m),
+        optimizers_config=models.OptimizersConfigDiff(
+            indexing_threshold=INDEXING_THRESHOLD if threshold is None else threshold),
+    )
+    if saved.pop(collection, None) is not None:
+        _save_bulk_restore(saved)
+
+
+def wait_optimized(collection: str = COLL,
+                   poll_sec: int = OPTIMIZE_POLL_SEC,
+                   timeout: int = OPTIMIZE_TIMEOUT) -> bool:
+    """Ждёт статуса GREEN (оптимизаторы закончили). True — дождались."""
+    deadline = time.time() + timeout
+    collection = physical_name(collection)
+    while time.time() < deadline:
+        info = qdrant.get_collection(collection)
+        if info.status == models.CollectionStatus.GREEN:
+            return True
+        time.sleep(poll_sec)
+    return False
 
 
 # ––– Main indexing routine ––––––––––––––––––––––––––––
 
-def index_all() -> int:
-    """Индексирует все НЕ обработанные TXT из SRC_DIR. Возвращает кол-во новых файлов."""
-    ensure_collection()
+def index_all(bulk: bool = False, policy: str = SCHEDULE_POLICY,
+              target: Optional[str] = None, reindex: bool = False,
+              dry_run: bool = False) -> int:
+    """
+    Индексирует все НЕ обработанные TXT из SRC_DIR. Возвращает кол-во новых файлов.
+    target  — писать в эту коллекцию вместо COLL/шардов (сборка kad_cases_vN в migrate.py);
+    reindex — взять и уже помеченные .indexed файлы, ничего не переименовывая;
+    dry_run — только прогноз (dry_run_report): ни API, ни Qdrant, файлы не трогаем.
+    """
+    if dry_run:
+        return dry_run_report(policy=policy, reindex=reindex)["files"]
+    # демон живёт долго: коллекцию/шард могли удалить (recreate.py) — проверяем заново
+    _ENSURED.clear()
+    if target:
+        ensure_collection(bulk=bulk, collection=target)
+    elif SHARD_MODE == "none":
+        ensure_collection(bulk=bulk)
     points_buf = []
+    buf_bytes = 0
     processed_files = 0
+    run = IndexMetrics()
 
-    for path in tqdm.tqdm(pathlib.Path(SRC_DIR).glob("*.txt"), desc="Файлы"):
-        # Уже помечен как .indexed — пропускаем
-        if path.name.endswith(PROCESSED_TAG + path.suffix):
-            continue
-        # Пропускаем «недописанные» файлы
-        if not _file_is_stable(path, FILE_STABLE_SEC):
-            continue
+    # Очередь с приоритетами; «недописанные» и .indexed в неё не попадают
+    queue = IndexQueue(pathlib.Path(SRC_DIR), policy=policy, include_indexed=reindex)
+    bar = tqdm.tqdm(total=len(queue), desc="Файлы")
 
-        filename = path.name
-        case_num = extract_case(filename)
-        raw_text = path.read_text(encoding="utf-8")
-
-        info = parse_header_fields(raw_text)
-        if case_num == "UNKNOWN" and info.get("case_id"):
-            case_num = info["case_id"]
-
-        court = info["court"]
-        plaintiffs = info["plaintiffs"]
-        defendants = info["defendants"]
-
-        index_tag = f"<CASE:{case_num}>"
-        if court:
-            index_tag += f" <COURT:{court}>"
-        if plaintiffs:
-            index_tag += f" <ISTEC:{';'.join(plaintiffs[:2])}>"
-        if defendants:
-            index_tag += f" <OTV:{';'.join(defendants[:2])}>"
-        index_tag += "\n"
-
-        for chunk in chunker(raw_text):
-            text_block = index_tag + chunk
-            try:
-                vec = openai.embeddings.create(
-                    model=EMB_MODEL, input=text_block, dimensions=DIM
-                ).data[0].embedding
-            except OpenAIError as exc:
-                if is_insufficient_funds(exc):
-                    print("💸 Недостаточно средств/квоты OpenAI — останавливаю индексацию.")
-                    raise InsufficientFundsError from exc
-                print(f"⚠ Embedding failed ({filename}): {exc}. Чанк пропущен.")
-                continue
-            except Exception as exc:
-                print(f"⚠ Embedding failed ({filename}): {exc}. Чанк пропущен.")
-                continue
+    # метрики пишем при любом исходе прохода: пустой, упавший, нулевой баланс
+    try:
+        for path in queue:
+            bar.total = bar.n + len(queue) + 1
+            bar.update(1)
+
+            filename = unmark_processed(path.name) if reindex else path.name
+            case_num = extract_case(filename)
+            raw_text = path.read_text(encoding="utf-8")
+
+            info = parse_header_fields(raw_text)
+            if case_num == "UNKNOWN" and info.get("case_id"):
+                case_num = info["case_id"]
+
+            court = info["court"]
+            plaintiffs = info["plaintiffs"]
+            defendants = info["defendants"]
+
+            # строка для полнотекстового индекса (лексический поиск по сторонам)
+            parties = "; ".join(plaintiffs + defendants)
+
+            # одно дело = один файл = один шард
+            coll = target or shard_for(case_num)
+            ensure_collection(bulk=bulk, collection=coll)
+
+            index_tag = make_index_tag(case_num, court, plaintiffs, defendants)
+
+            file_vecs = []   # векторы чанков файла — для карточки дела
+            tokens, bounds = file_token_spans(path, raw_text, run)
+            # порядок и позиции чанков: сервер собирает по ним дело целиком без перекрытий
+            offsets = token_char_offsets(tokens, raw_text)
+            for chunk_no, (a, b) in enumerate(bounds):
+                toks = tokens[a:b]
+                # текст — срез исходника по тем же offsets, а не enc.decode(toks): граница
+                # чанка посреди многобайтного символа дала бы «�» и сдвинула char_start/char_end
+                text_block = index_tag + raw_text[offsets[a]:offsets[b]]
+                run.inc("chunks")
+                run.inc("tokens", len(toks))
+                run.inc("embed_calls")
+                t0 = time.perf_counter()
+                try:
+                    vec = openai.embeddings.create(
+                        model=EMB_MODEL, input=text_block, dimensions=DIM
+                    ).data[0].embedding
+                    run.observe("embed_latency_seconds", time.perf_counter() - t0)
+                except OpenAIError as exc:
+                    run.inc("embed_failures")
+                    if is_insufficient_funds(exc):
+                        print("💸 Недостаточно средств/квоты OpenAI — останавливаю индексацию.")
+                        raise InsufficientFundsError from exc
+                    print(f"⚠ Embedding failed ({filename}): {exc}. Чанк пропущен.")
+                    continue
+                except Exception as exc:
+                    run.inc("embed_failures")
+                    print(f"⚠ Embedding failed ({filename}): {exc}. Чанк пропущен.")
+                    continue
 
-            points_buf.append(
-                models.PointStruct(
+                file_vecs.append(vec)
+                point = models.PointStruct(
                     id=str(uuid.uuid4()),
-                    vector=vec,
+                    vector=point_vector(vec),
                     payload={
                         "file": filename,
                         "text": text_block,
@@ -269,24 +1126,44 @@ def index_all() -> int:
                         "court": court,
                         "plaintiffs": plaintiffs,
                         "defendants": defendants,
+                        "parties": parties,
+                        "chunk_no": chunk_no,
+                        "char_start": int(offsets[a]),
+                        "char_end": int(offsets[b]),
                     },
                 )
-            )
+                points_buf.append(point)
+                buf_bytes += point_bytes(point)
 
-            if len(points_buf) == BATCH:
-                flush_batches(points_buf)
+                if BATCHER.full(len(points_buf), buf_bytes):
+                    flush_batches(points_buf, metrics=run, collection=coll)
+                    buf_bytes = 0
 
-        # «хвост» по файлу и пометка как обработанный
-        flush_batches(points_buf, wait=True)
-        points_buf.clear()
+            # «хвост» по файлу и пометка как обработанный;
+            # в bulk-режиме не ждём применения каждого файла — точки идут потоком
+            flush_batches(points_buf, wait=not bulk, metrics=run, collection=coll)
+            buf_bytes = 0
+            upsert_case_card(case_num, filename, info, file_vecs)
+            # сборка target ещё не живая: её кэш сбросит migrate.py swap
+            if file_vecs and not target:
+                bump_case_version(case_num)
 
-        new_path = mark_processed(path)
-        try:
-            path.rename(new_path)
-            processed_files += 1
-            print(f"✔ Обработан: {new_path.name}")
-        except Exception as exc:
-            print(f"⚠ Не удалось переименовать {filename}: {exc}")
+            if reindex:
+                processed_files += 1
+                run.inc("files")
+                continue
+
+            new_path = mark_processed(path)
+            try:
+                path.rename(new_path)
+                processed_files += 1
+                run.inc("files")
+                print(f"✔ Обработан: {new_path.name}")
+            except Exception as exc:
+                print(f"⚠ Не удалось переименовать {filename}: {exc}")
+    finally:
+        bar.close()
+        write_metrics(run)
 
     if processed_files:
         print(f"🎉 Индексация завершена: новых файлов — {processed_files}")
@@ -295,9 +1172,159 @@ def index_all() -> int:
     return processed_files
 
 
+# ––– Dry-run: прогноз токенов, стоимости и времени ––––––––
+
+def _dry_run_file(path_str: str, reindex: bool) -> dict:
+    """Воркер: то же, что index_all делает с файлом до эмбеддинга."""
+    path = pathlib.Path(path_str)
+    filename = unmark_processed(path.name) if reindex else path.name
+    raw_text = path.read_text(encoding="utf-8")
+    info = parse_header_fields(raw_text)
+    case_num = extract_case(filename)
+    if case_num == "UNKNOWN" and info.get("case_id"):
+        case_num = info["case_id"]
+    tag_tokens = len(enc.encode(make_index_tag(case_num, info["court"],
+                                               info["plaintiffs"], info["defendants"])))
+    chunks = tokens = 0
+    hashes = []
+    m = IndexMetrics()
+    for toks in file_token_chunks(path, raw_text, m):
+        chunks += 1
+        tokens += tag_tokens + len(toks)
+        # правило дубликатов gc_points: одинаковый текст в пределах дела
+        hashes.append(hashlib.sha1(f"{case_num}\0{toks}".encode()).hexdigest()[:16])
+    return {"case": case_num, "chunks": chunks, "tokens": tokens, "hashes": hashes,
+            "sidecar": m.counters["cache_hits"] > 0}
+
+
+def _last_embed_latency() -> Optional[float]:
+    """Средняя задержка эмбеддинга из последней сводки прогона."""
+    try:
+        runs = sorted(pathlib.Path(STATE_DIR).glob("run-*.json"))
+        for p in reversed(runs):
+            lat = json.loads(p.read_text(encoding="utf-8"))["latency"]["embed_latency_seconds"]
+            if lat.get("avg"):
+                return float(lat["avg"])
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def dry_run_report(policy: str = SCHEDULE_POLICY, reindex: bool = False,
+                   workers: int = DRY_RUN_WORKERS) -> dict:
+    """
+    Прогноз прогона index_all: файлы, чанки, токены, стоимость и время.
+    Токенизация — в процессах; эмбеддингов и Qdrant нет, файлы не переименовываются.
+    Время — максимум из последовательных запросов (задержка прошлого прогона)
+    и потолка EMBED_RPM / EMBED_TPM.
+    """
+    queue = IndexQueue(pathlib.Path(SRC_DIR), policy=policy, rescan_sec=0,
+                       include_indexed=reindex)
+    paths = [str(p) for p in queue]
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(tqdm.tqdm(pool.map(_dry_run_file, paths, [reindex] * len(paths),
+                                          chunksize=8),
+                                 total=len(paths), desc="Токенизация"))
+    tokenize_sec = time.perf_counter() - t0
+
+    chunks = sum(r["chunks"] for r in results)
+    tokens = sum(r["tokens"] for r in results)
+    seen, dups = set(), 0
+    for r in results:
+        for h in r["hashes"]:
+            dups += h in seen
+            seen.add(h)
+
+    latency = _last_embed_latency()
+    per_call = latency or EMBED_LATENCY_GUESS
+    limit_sec = 60.0 * max(chunks / EMBED_RPM, tokens / EMBED_TPM)
+    wall_sec = max(chunks * per_call, limit_sec)
+
+    report = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "reindex": reindex,
+        "files": len(results),
+        "files_with_sidecar": sum(r["sidecar"] for r in results),
+        "unknown_case": sum(r["case"] == "UNKNOWN" for r in results),
+        "chunks": chunks,
+        "tokens": tokens,
+        "duplicate_chunks": dups,
+        "cost_usd": round(tokens / 1e6 * EMBED_PRICE_PER_1M, 4),
+        "embed_latency_sec": round(per_call, 4),
+        "embed_latency_source": "run-*.json" if latency else "EMBED_LATENCY_GUESS",
+        "rate_limit_floor_sec": round(limit_sec, 1),
+        "projected_wall_sec": round(wall_sec, 1),
+        "tokenize_sec": round(tokenize_sec, 2),
+    }
+    try:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        _write_atomic(os.path.join(STATE_DIR, f"dryrun-{stamp}.json"),
+                      json.dumps(report, ensure_ascii=False, indent=2))
+    except OSError as exc:
+        print(f"⚠ Не удалось записать отчёт dry-run: {exc}")
+
+    print(f"🧮 Dry-run ({'все файлы' if reindex else 'новые файлы'}): {report['files']} файлов "
+          f"(sidecar: {report['files_with_sidecar']}, без номера: {report['unknown_case']})")
+    print(f"   чанков {chunks}, токенов {tokens:,} (дубликатов чанков: {dups})")
+    print(f"   стоимость ≈ ${report['cost_usd']:,.2f} по ${EMBED_PRICE_PER_1M}/1M")
+    print(f"   время ≈ {wall_sec / 3600:.1f} ч "
+          f"({per_call:.2f} с/запрос из {report['embed_latency_source']}, "
+          f"потолок лимитов {limit_sec / 3600:.1f} ч)")
+    print(f"   токенизация заняла {tokenize_sec:.1f} сек на {workers} процессах")
+    return report
+
+
+# ––– Bulk-load: разовая массовая индексация –––––––––––––
+
+def bulk_index(policy: str = SCHEDULE_POLICY) -> int:
+    """
+    Первичная заливка после recreate.py:
+      1) выключаем HNSW (m=0, indexing_threshold=0);
+      2) прогоняем все файлы из SRC_DIR;
+      3) возвращаем параметры графа и ждём окончания оптимизации.
+    Печатает время каждой фазы. Возвращает кол-во проиндексированных файлов.
+    """
+    timings = {}
+
+    t0 = time.perf_counter()
+    if SHARD_MODE == "none":
+        ensure_collection(bulk=True)
+    # новые шарды создаются сразу без графа, существующие переводим в bulk
+    for coll in list_shards():
+        begin_bulk_load(coll)
+    timings["подготовка"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    try:
+        n = index_all(bulk=True, policy=policy)
+    finally:
+        # даже если заливку прервали — граф должен вернуться, иначе поиск будет полным перебором
+        timings["заливка"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        shards = list_shards()
+        for coll in shards:
+            end_bulk_load(coll)
+        timings["восстановление"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    print("⏳ Жду, пока Qdrant построит HNSW…")
+    for coll in shards:
+        if not wait_optimized(coll):
+            print(f"⚠ Коллекция {coll} не стала GREEN за {OPTIMIZE_TIMEOUT} сек")
+    timings["оптимизация"] = time.perf_counter() - t0
+
+    print("⏱ Bulk-load:")
+    for phase, sec in timings.items():
+        print(f"   {phase:<15} {sec:10.1f} сек")
+    print(f"   {'итого':<15} {sum(timings.values()):10.1f} сек")
+    return n
+
+
 # ––– Auto-restart wrapper ––––––––––––––––––––––––––––––
 
-def STEP_THREE(poll_sec: int = INDEX_POLL_SEC, max_backoff: int = INDEX_MAX_BACKOFF):
+def STEP_THREE(poll_sec: int = INDEX_POLL_SEC, max_backoff: int = INDEX_MAX_BACKOFF,
+               policy: str = SCHEDULE_POLICY):
     """
     Демон: периодически смотрит в SRC_DIR, индексирует новые файлы.
     Если новых файлов нет — увеличивает паузу (экспоненциальный бэкофф) до max_backoff.
@@ -307,7 +1334,7 @@ def STEP_THREE(poll_sec: int = INDEX_POLL_SEC, max_backoff: int = INDEX_MAX_BACK
     backoff = poll_sec
     while True:
         try:
-            n = index_all()
+            n = index_all(policy=policy)
             retries = 0
             if n == 0:
                 time.sleep(backoff)
@@ -330,4 +1357,27 @@ def STEP_THREE(poll_sec: int = INDEX_POLL_SEC, max_backoff: int = INDEX_MAX_BACK
             time.sleep(wait)
             retries += 1
 
-STEP_THREE()
\ No newline at end of file
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="STEP_THREE: индексация TXT в Qdrant")
+    ap.add_argument("--bulk", action="store_true",
+                    help="разовая заливка с отложенным построением HNSW (после recreate.py)")
+    ap.add_argument("--policy", choices=("glob", "mtime", "size"), default=SCHEDULE_POLICY,
+                    help="порядок обработки файлов (приоритетные дела из priority.txt — всегда первыми)")
+    ap.add_argument("--check-sidecars", action="store_true",
+                    help="сверить sidecar-ы STEP_TWO (*.tok) с живым chunker-ом и выйти")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="прогноз чанков/токенов/стоимости/времени без API и Qdrant")
+    ap.add_argument("--all", action="store_true",
+                    help="с --dry-run: считать и уже проиндексированные файлы (полная переиндексация)")
+    args = ap.parse_args()
+
+    if args.check_sidecars:
+        raise SystemExit(0 if check_sidecars() else 2)
+    if args.dry_run:
+        index_all(policy=args.policy, reindex=args.all, dry_run=True)
+        raise SystemExit(0)
+    if args.bulk:
+        bulk_index(policy=args.policy)
+    else:
+        STEP_THREE(policy=args.policy)
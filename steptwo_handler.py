@@ -24,6 +24,9 @@ from typing import List, Dict
 
 import fitz  # PyMuPDF
 
+from case_number import CASE_RE, canonical_case
+from token_sidecar import TokenSidecar, sidecar_path
+
 
 # ==================== НАСТРОЙКИ ====================
 
@@ -33,14 +36,20 @@ OUT_DIR = r"C:\Users\User\Desktop\text_txt"          # <- Куда класть
 # Кодировка сохранения итоговых файлов
 OUT_ENCODING = "utf-8"
 
-# Регулярка номера дела:
-#   - поддерживает кириллическую А и латинскую A
+# Sidecar «X.tok» рядом с «X.txt»: токены и границы чанков для STEP_THREE
+# (token_sidecar.py) — индексатор не токенизирует файл заново, а чанки не
+# перескакивают через границу двух PDF. Нужен tiktoken; модель и размеры
+# чанков должны совпадать с EMB_MODEL/CHUNK/OVERLAP в stepthree_index,
+# иначе индексатор sidecar проигнорирует.
+WRITE_TOKEN_SIDECAR = False
+TOKEN_MODEL   = "MODEL"
+TOKEN_CHUNK   = 800
+TOKEN_OVERLAP = 160
+
+# Регулярка номера дела — общая (case_number.CASE_RE):
+#   - кириллическая А и латинская A, СИП/SIP
 #   - разделитель перед годом: -, / или _
 #   - СИП-... с годом или без
-CASE_RE = re.compile(
-    r"(?:(?:[АA]\d{1,3}-\d{1,7}[-/_]\d{4})|(?:СИП-\d{1,7}(?:[-/_]\d{4})?))",
-    re.IGNORECASE,
-)
 
 # Сплитер сегментов имени: " — " (em/en/ascii dash c пробелами)
 SEGMENT_SPLIT_RE = re.compile(r"\s+[—–-]\s+")
@@ -114,16 +123,10 @@ def _cleanup_entity(s: str | None) -> str | None:
 
 def _normalize_case(case_raw: str) -> str:
     """
-    Приводим номер дела к виду:
-      А07-243/2020  (подчёркивание => /)
-    Сохраняем регистр буквы 'А' как в оригинале (кирилл/латин не меняем).
+    Приводим номер дела к общему канону (case_number.canonical_case):
+      A07-243_2020 → А07-243/2020  (кириллическая А, «/» перед годом)
     """
-    s = case_raw.strip()
-    # только в номере дела '_' трактуем как '/'
-    s = s.replace("_", "/")
-    # двойные разделители в единичные
-    s = re.sub(r"[-/_]+", lambda m: m.group(0)[0], s)
-    return s
+    return canonical_case(case_raw) or case_raw.strip()
 
 
 def parse_filename(stem: str) -> tuple[str | None, str | None, str | None, List[str]]:
@@ -202,6 +205,49 @@ def build_header(case_id: str | None, court: str | None,
     return f"{title_line}\n{content}\n{border}\n\n"
 
 
+_ENCODER = None
+
+def _token_encoder():
+    global _ENCODER
+    if _ENCODER is None:
+        import tiktoken   # нужен только для sidecar-ов
+        _ENCODER = tiktoken.encoding_for_model(TOKEN_MODEL)
+    return _ENCODER
+
+
+def _split_docs(content: str, texts: List[str]) -> List[str]:
+    """Режем итоговый текст по началам PDF; шапка идёт в первый кусок."""
+    starts, pos = [0], 0
+    for i, t in enumerate(texts):
+        at = content.find(t, pos) if t else -1
+        if at < 0:
+            continue
+        if i:
+            starts.append(at)
+        pos = at + len(t)
+    ends = starts[1:] + [len(content)]
+    return [content[a:b] for a, b in zip(starts, ends)]
+
+
+def write_case_file(out_path: Path, header: str, texts: List[str]) -> None:
+    """Пишет TXT дела и, если включено, sidecar с токенами."""
+    pieces: List[str] = [header]
+    for t in texts:
+        pieces.append(t)
+        pieces.append("\n\n")  # разделяем пустой строкой
+    content = "\n".join(pieces).strip() + "\n"
+    if WRITE_TOKEN_SIDECAR:
+        # индексатор читает через read_text (универсальные переводы строк) —
+        # смещения должны считаться по тому же тексту
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+        texts = [t.replace("\r\n", "\n").replace("\r", "\n") for t in texts]
+    out_path.write_text(content, encoding=OUT_ENCODING)
+    if WRITE_TOKEN_SIDECAR:
+        sc = TokenSidecar.build(_token_encoder(), _split_docs(content, texts),
+                                TOKEN_MODEL, TOKEN_CHUNK, TOKEN_OVERLAP)
+        sc.write(sidecar_path(out_path))
+
+
 
 def ensure_out_dir() -> Path:
     out = Path(OUT_DIR)
@@ -277,18 +323,12 @@ def STEP_TWO():
         plaintiff = bucket.merge_plaintiff()
         defendants = bucket.merge_defendants()
 
-        pieces: List[str] = []
-        # Общая шапка по делу (один раз)
-        pieces.append(build_header(case_id, court, plaintiff, defendants))
-
-        # Просто склеиваем тексты всех PDF без подписи имени файла
-        for fm in bucket.files:
-            pieces.append(fm.text.strip())
-            pieces.append("\n\n")  # разделяем пустой строкой
-
-        content = "\n".join(pieces).strip() + "\n"
+        # Общая шапка по делу (один раз), дальше просто склеиваем тексты
+        # всех PDF без подписи имени файла
         out_path = out_dir / f"{safe_stem(case_id)}.txt"
-        out_path.write_text(content, encoding=OUT_ENCODING)
+        write_case_file(out_path,
+                        build_header(case_id, court, plaintiff, defendants),
+                        [fm.text.strip() for fm in bucket.files])
         print(f"✔ Собрано дело: {out_path.name}  ({len(bucket.files)} PDF)")
 
     # Файлы без номера дела — сохраняем по одному в unknown/
@@ -3,6 +3,8 @@ import shutil
 import re
 import json
 
+from case_number import CASE_RE, canonical_case, find_cases
+
 # ========= НАСТРОЙКИ =========
 ROOT_DIR = Path(r"N:\kad_arbitr\2024")   # <— укажите вашу директорию
 DRY_RUN = False                              # True — только показать, что будет сделано
@@ -10,11 +12,7 @@ DRY_RUN = False                              # True — только показ
 # Разделители между полями в имени файла: « — » (emdash) или " - "
 SEP_RE = re.compile(r"\s+—\s+|\s+-\s+", flags=re.UNICODE)
 
-# Регексы для номера дела (поддерживаются: А11-1642_2024, А40-12345/2020, СИП-715/2023 и т.п.)
-CASE_RE = re.compile(
-    r"(?:[АA]\d{1,3}-\d{1,7}[/_]\d{4}|СИП-\d{1,7}(?:[-/]\d{4})?)",
-    flags=re.IGNORECASE | re.UNICODE
-)
+# Номер дела ищем общим CASE_RE (case_number): А11-1642_2024, А40-12345/2020, СИП-715/2023 и т.п.
 
 def safe_dirname(name: str) -> str:
     """Санитизация имени папки под Windows/*nix."""
@@ -26,6 +24,10 @@ def normalize_case_no(s: str) -> str:
     """Нормализация номера для сопоставления (без пробелов, /->_, лат/кир 'А' унифицируем)."""
     if not s:
         return ""
+    # номер распознан — берём общий канон, ключ через "_"
+    canon = canonical_case(s)
+    if canon:
+        return canon.replace("/", "_")
     s = s.strip()
     # унифицируем варианты разделителей года
     s = s.replace("\\", "/").replace("_", "/")
@@ -89,15 +91,15 @@ def index_json_by_case(root: Path):
                         if k in obj and isinstance(obj[k], str) and CASE_RE.search(obj[k]):
                             case_candidates.add(normalize_case_no(obj[k]))
                     # если не нашли — выдернем любой номер из сериализованного текста
-                    for m in CASE_RE.findall(text):
+                    for m in find_cases(text):
                         case_candidates.add(normalize_case_no(m))
                 else:
                     # массив/прочее — ищем регексом по тексту
-                    for m in CASE_RE.findall(text):
+                    for m in find_cases(text):
                         case_candidates.add(normalize_case_no(m))
             except json.JSONDecodeError:
                 # не JSON — ищем регексом как по тексту
-                for m in CASE_RE.findall(text):
+                for m in find_cases(text):
                     case_candidates.add(normalize_case_no(m))
 
             keys |= case_candidates
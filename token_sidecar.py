@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sidecar с заранее токенизированным делом: STEP_TWO пишет его рядом с TXT,
+STEP_THREE читает вместо повторного enc.encode всего файла.
+
+    А40-12345-2024.txt   — текст дела (как раньше)
+    А40-12345-2024.tok   — uint32 little-endian:
+        заголовок HEADER_FIELDS (10 слов)
+        doc_starts[n_docs]       — с какого токена начинается каждый PDF дела
+        bounds[n_chunks × 2]     — чанки: [start, end) в токенах
+        tokens[n_tokens]         — id токенов
+
+Чанки режутся внутри документов (как chunk_tokens в индексаторе, но
+заново с начала каждого PDF), поэтому не склеивают конец одного акта
+с началом другого. Для дела из одного PDF чанки совпадают с живым
+chunker-ом токен в токен (см. stepthree_index --check-sidecars).
+
+Годность sidecar-а проверяется по CRC32 текста и модели токенизатора и
+по CHUNK/OVERLAP: при любом расхождении индексатор молча режет текст сам.
+"""
+
+import sys
+import zlib
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+SUFFIX  = ".tok"
+MAGIC   = 0x4B4F5444      # "DTOK"
+VERSION = 1
+U32     = "I" if array("I").itemsize == 4 else "L"   # typecode ровно на 4 байта
+HEADER_FIELDS = ("magic", "version", "chunk", "overlap", "model_crc",
+                 "text_crc", "n_chars", "n_tokens", "n_docs", "n_chunks")
+
+
+def _crc(s: str) -> int:
+    return zlib.crc32(s.encode("utf-8")) & 0xFFFFFFFF
+
+
+def sidecar_path(txt_path) -> Path:
+    """«X.txt» → «X.tok» (для «X.indexed.txt» передавайте исходное имя)."""
+    return Path(txt_path).with_suffix(SUFFIX)
+
+
+def chunk_bounds(doc_starts: Sequence[int], n_tokens: int,
+                 chunk: int, overlap: int) -> List[Tuple[int, int]]:
+    """Как chunk_tokens индексатора, но с перезапуском на каждом doc_start."""
+    step = chunk - overlap
+    ends = list(doc_starts[1:]) + [n_tokens]
+    out = []
+    for start, end in zip(doc_starts, ends):
+        for i in range(start, end, step):
+            out.append((i, min(i + chunk, end)))
+    return out
+
+
+class TokenSidecar:
+    def __init__(self, *, chunk: int, overlap: int, model_crc: int, text_crc: int,
+                 n_chars: int, tokens: array, doc_starts: List[int],
+                 bounds: List[Tuple[int, int]]):
+        self.chunk = chunk
+        self.overlap = overlap
+        self.model_crc = model_crc
+        self.text_crc = text_crc
+        self.n_chars = n_chars
+        self.tokens = tokens
+        self.doc_starts = doc_starts
+        self.bounds = bounds
+
+    @classmethod
+    def build(cls, enc, docs: Sequence[str], model: str, chunk: int, overlap: int) -> "TokenSidecar":
+        """docs — куски итогового текста по документам; "".join(docs) == текст файла."""
+        tokens = array(U32)
+        doc_starts = []
+        for d in docs:
+            doc_starts.append(len(tokens))
+            tokens.extend(enc.encode(d))
+        text = "".join(docs)
+        return cls(chunk=chunk, overlap=overlap, model_crc=_crc(model), text_crc=_crc(text),
+                   n_chars=len(text), tokens=tokens, doc_starts=doc_starts,
+                   bounds=chunk_bounds(doc_starts, len(tokens), chunk, overlap))
+
+    def matches(self, text: str, model: str, chunk: int, overlap: int) -> bool:
+        return (self.chunk == chunk and self.overlap == overlap
+                and self.model_crc == _crc(model)
+                and self.n_chars == len(text) and self.text_crc == _crc(text))
+
+    def chunks(self) -> Iterator[List[int]]:
+        for a, b in self.bounds:
+            yield self.tokens[a:b].tolist()
+
+    def write(self, path) -> None:
+        head = array(U32, [MAGIC, VERSION, self.chunk, self.overlap, self.model_crc,
+                           self.text_crc, self.n_chars, len(self.tokens),
+                           len(self.doc_starts), len(self.bounds)])
+        body = array(U32, self.doc_starts)
+        for a, b in self.bounds:
+            body.extend((a, b))
+        parts = [head, body, self.tokens]
+        if sys.byteorder != "little":
+            parts = [array(U32, p) for p in parts]
+            for p in parts:
+                p.byteswap()
+        tmp = Path(str(path) + ".tmp")
+        with open(tmp, "wb") as f:
+            for p in parts:
+                p.tofile(f)
+        tmp.replace(path)
+
+    @classmethod
+    def read(cls, path) -> Optional["TokenSidecar"]:
+        """None — файла нет или он битый/другой версии."""
+        try:
+            data = array(U32)
+            with open(path, "rb") as f:
+                data.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        if sys.byteorder != "little":
+            data.byteswap()
+        if len(data) < len(HEADER_FIELDS):
+            return None
+        h = dict(zip(HEADER_FIELDS, data[:len(HEADER_FIELDS)]))
+        if h["magic"] != MAGIC or h["version"] != VERSION:
+            return None
+        pos = len(HEADER_FIELDS)
+        doc_starts = data[pos:pos + h["n_docs"]].tolist()
+        pos += h["n_docs"]
+        flat = data[pos:pos + 2 * h["n_chunks"]].tolist()
+        pos += 2 * h["n_chunks"]
+        tokens = data[pos:pos + h["n_tokens"]]
+        if len(tokens) != h["n_tokens"]:
+            return None
+        return cls(chunk=h["chunk"], overlap=h["overlap"], model_crc=h["model_crc"],
+                   text_crc=h["text_crc"], n_chars=h["n_chars"], tokens=tokens,
+                   doc_starts=doc_starts, bounds=list(zip(flat[::2], flat[1::2])))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Экспорт/импорт точек коллекции без повторного эмбеддинга.
+
+Смена квантования, HNSW или шардирования раньше означала recreate.py
+и полную платную переиндексацию. Теперь:
+
+    python vectors_io.py export --out D:\\kad_dump [--collection kad_cases] [--dtype float16]
+    python vectors_io.py import --src D:\\kad_dump --to kad_cases_v2 [--parallel 4]
+
+Формат папки выгрузки:
+    meta.json            — коллекция, число точек, схема векторов, dtype
+    vectors.<имя>.npy    — матрица N×dim (float32/float16), читается через mmap
+    payload.jsonl        — {"id": …, "payload": {…}} построчно, в порядке строк матриц
+
+Импорт создаёт новую коллекцию с выключенным HNSW, заливает точки
+параллельными пачками (upload_collection), затем включает граф
+(recreate.finish_bulk) и печатает пропускную способность.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, Iterator
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from recreate import (
+    QDRANT_HOST, QDRANT_PORT, QDRANT_KEY, USE_HTTPS,
+    COLL, DIST, ensure_payload_indexes, finish_bulk,
+)
+
+UNNAMED = ""           # ключ безымянного вектора в meta.json
+SCROLL_LIMIT = 512
+UPLOAD_BATCH = 256
+
+
+def _client() -> QdrantClient:
+    return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_KEY,
+                        https=USE_HTTPS, timeout=300.0)
+
+
+def _vector_schema(qc: QdrantClient, collection: str) -> Dict[str, int]:
+    """{имя: dim}; безымянный вектор — под ключом ""."""
+    vectors = qc.get_collection(collection).config.params.vectors
+    if isinstance(vectors, dict):
+        return {name: v.size for name, v in vectors.items()}
+    return {UNNAMED: vectors.size}
+
+
+def _vec_path(root: str, name: str) -> str:
+    return os.path.join(root, f"vectors.{name or 'default'}.npy")
+
+
+def _human_rate(n: int, sec: float, nbytes: int) -> str:
+    sec = max(sec, 1e-9)
+    return f"{n / sec:,.0f} точек/сек, {nbytes / sec / 2**20:,.1f} МБ/сек"
+
+
+# ––– Экспорт ––––––––––––––––––––––––––––––––––––––––––––
+
+def export_collection(collection: str, out_dir: str, dtype: str = "float32") -> int:
+    qc = _client()
+    schema = _vector_schema(qc, collection)
+    total = qc.count(collection, exact=True).count
+    os.makedirs(out_dir, exist_ok=True)
+
+    mats = {
+        name: np.lib.format.open_memmap(_vec_path(out_dir, name), mode="w+",
+                                        dtype=dtype, shape=(total, dim))
+        for name, dim in schema.items()
+    }
+
+    t0 = time.perf_counter()
+    row = 0
+    next_off = None
+    with open(os.path.join(out_dir, "payload.jsonl"), "w", encoding="utf-8") as fp:
+        while row < total:
+            pts, next_off = qc.scroll(
+                collection_name=collection,
+                limit=SCROLL_LIMIT,
+                with_payload=True,
+                with_vectors=True,
+                offset=next_off,
+            )
+            for p in pts:
+                if row >= total:      # пока выгружали, кто-то дописал точки
+                    break
+                vec = p.vector if isinstance(p.vector, dict) else {UNNAMED: p.vector}
+                for name, mat in mats.items():
+                    mat[row] = vec[name]
+                fp.write(json.dumps({"id": p.id, "payload": p.payload},
+                                    ensure_ascii=False) + "\n")
+                row += 1
+            print(f"   … {row}/{total}", end="\r")
+            if not pts or next_off is None:
+                break
+
+    for mat in mats.values():
+        mat.flush()
+    sec = time.perf_counter() - t0
+
+    meta = {
+        "collection": collection,
+        "count": row,                 # строк с данными; хвост матрицы (если total > row) пустой
+        "vectors": schema,
+        "dtype": dtype,
+        "distance": DIST.value,
+        "exported": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    nbytes = sum(m.nbytes for m in mats.values())
+    print(f"\n✔ Экспорт {collection}: {row} точек за {sec:.1f} сек ({_human_rate(row, sec, nbytes)})")
+    return row
+
+
+# ––– Импорт –––––––––––––––––––––––––––––––––––––––––––––
+
+def _iter_payload(path: str, count: int) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as fp:
+        for i, line in enumerate(fp):
+            if i >= count:
+                break
+            yield json.loads(line)
+
+
+def create_from_meta(qc: QdrantClient, collection: str, meta: dict):
+    """Коллекция под схему выгрузки; HNSW выключен до конца заливки."""
+    distance = models.Distance(meta.get("distance", DIST.value))
+    schema = meta["vectors"]
+    if list(schema) == [UNNAMED]:
+        vectors = models.VectorParams(size=schema[UNNAMED], distance=distance)
+    else:
+        # как в recreate.py: при паре full/small граф строится только по короткому
+        two_tier = "full" in schema and "small" in schema
+        vectors = {
+            name: models.VectorParams(
+                size=dim, distance=distance,
+                hnsw_config=models.HnswConfigDiff(m=0) if two_tier and name == "full" else None,
+            )
+            for name, dim in schema.items()
+        }
+    qc.create_collection(
+        collection_name=collection,
+        vectors_config=vectors,
+        hnsw_config=models.HnswConfigDiff(m=0),
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+    )
+    ensure_payload_indexes(qc, collection)
+
+
+def import_collection(src_dir: str, collection: str, parallel: int = 4,
+                      batch: int = UPLOAD_BATCH) -> int:
+    with open(os.path.join(src_dir, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    count = int(meta["count"])
+
+    qc = _client()
+    if qc.collection_exists(collection):
+        print(f"💥 Коллекция {collection} уже существует — импорт только в новую")
+        sys.exit(1)
+    create_from_meta(qc, collection, meta)
+
+    mats = {name: np.load(_vec_path(src_dir, name), mmap_mode="r")[:count]
+            for name in meta["vectors"]}
+    # payload читаем потоком (два прохода по файлу), чтобы не держать весь корпус в памяти
+    payload_path = os.path.join(src_dir, "payload.jsonl")
+    ids = (r["id"] for r in _iter_payload(payload_path, count))
+    payloads = (r["payload"] for r in _iter_payload(payload_path, count))
+
+    if list(mats) == [UNNAMED]:
+        vectors = mats[UNNAMED]
+    else:
+        vectors = mats   # dict имя → матрица, upload_collection это понимает
+
+    t0 = time.perf_counter()
+    qc.upload_collection(
+        collection_name=collection,
+        vectors=vectors,
+        payload=payloads,
+        ids=ids,
+        batch_size=batch,
+        parallel=parallel,
+        wait=True,
+    )
+    sec = time.perf_counter() - t0
+    nbytes = sum(m.nbytes for m in mats.values())
+    print(f"✔ Импорт в {collection}: {count} точек за {sec:.1f} сек ({_human_rate(count, sec, nbytes)})")
+
+    finish_bulk(qc, collection)
+    return count
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Экспорт/импорт векторов без повторного эмбеддинга")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    ex = sub.add_parser("export", help="выгрузить точки коллекции в папку")
+    ex.add_argument("--out", required=True, help="папка выгрузки")
+    ex.add_argument("--collection", default=COLL)
+    ex.add_argument("--dtype", choices=("float32", "float16"), default="float32",
+                    help="float16 — вдвое меньше на диске, точности для пересборки хватает")
+
+    im = sub.add_parser("import", help="залить выгрузку в НОВУЮ коллекцию")
+    im.add_argument("--src", required=True, help="папка выгрузки")
+    im.add_argument("--to", required=True, help="имя новой коллекции")
+    im.add_argument("--parallel", type=int, default=4, help="параллельных загрузчиков")
+    im.add_argument("--batch", type=int, default=UPLOAD_BATCH, help="точек в пачке")
+
+    args = ap.parse_args()
+    try:
+        if args.cmd == "export":
+            export_collection(args.collection, args.out, dtype=args.dtype)
+        else:
+            import_collection(args.src, args.to, parallel=args.parallel, batch=args.batch)
+    except Exception as e:
+        print(f"💥 {args.cmd} не удался: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,8 @@ from PySide6.QtCore import (QPropertyAnimation, QEasingCurve, QPointF, QParallel
                             QPauseAnimation)
 
 SERVER_URL = "http://127.0.0.1:5000/chat"
+STREAMING = True                      # SSE (POST /chat/stream): ответ печатается по мере генерации; False — целиком
+STREAM_RENDER_MS = 120                # перерисовка пузыря не чаще — markdown на каждый кусок тормозит UI
 SAVE_PATH = os.path.join(os.path.expanduser("~"), ".tlawman_chats.json")
 
 TOKENS_MIN = 5_000  # минимальный лимит, «короткий» ответ
@@ -43,6 +45,8 @@ TOKENS_MAX = 15_000  # максимальный лимит, «длинный» 
 class WorkerSignals(QObject):
     finished = Signal(str)
     error = Signal(str)
+    delta = Signal(str)        # очередной кусок потокового ответа
+    stream_done = Signal()
 
 
 # ───────────────── CopyableLabel ─────────────────
@@ -99,32 +103,11 @@ class MessageBubble(QWidget):
         lay.setContentsMargins(0, 0, 0, 0)
         lay.setSpacing(0)
 
-        # 1) Заменяем ***Заголовок*** на ## Заголовок
-        md = re.sub(r'\*{3}(.*?)\*{3}', r'## \1', text)
-        # md = re.sub(r'(?m)^\s*-\s+', '', md)
-
-        # 2) Вставляем перевод строки перед каждым **что-либо**
-        #    (?m) — многострочный режим, ^ и $ — начало/конец строки
-        md = re.sub(r'(?m)^(?P<stars>\*\*(?!\s).*?\*\*)', r'\n\n\g<stars>', md)
-
-        # 3) Добавляем в начало «Вы» или «TLawman» как жирный текст
-        md = f"**{sender}:**\n\n{md}"
-
-        LIST_INDENT_PX = 1  # ← задаёт длину отступа слева до текста
-
-        html_body = markdown.markdown(md, extensions=["extra", "sane_lists", "nl2br"])
-
-        # Стиль списков: маркёр снаружи, фиксируем отступ
-        ul_style = f"margin:0.3em 0; padding-left:{LIST_INDENT_PX}px; list-style-position:outside;"
-        ol_style = ul_style
-
-        html_body = (html_body
-                     .replace("<ul>", f"<ul style='{ul_style}'>")
-                     .replace("<ol>", f"<ol style='{ol_style}'>")
-                     .replace("<li>", "<li style='margin:0.15em 0;'>"))
+        self.sender_name = sender
 
-        # 5) Рендерим в QLabel
-        lbl = CopyableLabel(html_body, max_width)
+        # Рендерим в QLabel
+        lbl = CopyableLabel(self._to_html(text), max_width)
+        self.lbl = lbl
         lbl.setTextFormat(Qt.RichText)
         lbl.setFont(QFont("Segoe UI", 11))
         lbl.setContentsMargins(10, 8, 10, 8)
@@ -150,6 +133,36 @@ class MessageBubble(QWidget):
             lay.addWidget(lbl)
             lay.addStretch()
 
+    def set_text(self, text: str):
+        """Перерисовать текст (потоковый ответ дописывается в тот же пузырь)."""
+        self.lbl.setText(self._to_html(text))
+
+    def _to_html(self, text: str) -> str:
+        # 1) Заменяем ***Заголовок*** на ## Заголовок
+        md = re.sub(r'\*{3}(.*?)\*{3}', r'## \1', text)
+        # md = re.sub(r'(?m)^\s*-\s+', '', md)
+
+        # 2) Вставляем перевод строки перед каждым **что-либо**
+        #    (?m) — многострочный режим, ^ и $ — начало/конец строки
+        md = re.sub(r'(?m)^(?P<stars>\*\*(?!\s).*?\*\*)', r'\n\n\g<stars>', md)
+
+        # 3) Добавляем в начало «Вы» или «TLawman» как жирный текст
+        md = f"**{self.sender_name}:**\n\n{md}"
+
+        LIST_INDENT_PX = 1  # ← задаёт длину отступа слева до текста
+
+        html_body = markdown.markdown(md, extensions=["extra", "sane_lists", "nl2br"])
+
+        # Стиль списков: маркёр снаружи, фиксируем отступ
+        ul_style = f"margin:0.3em 0; padding-left:{LIST_INDENT_PX}px; list-style-position:outside;"
+        ol_style = ul_style
+
+        html_body = (html_body
+                     .replace("<ul>", f"<ul style='{ul_style}'>")
+                     .replace("<ol>", f"<ol style='{ol_style}'>")
+                     .replace("<li>", "<li style='margin:0.15em 0;'>"))
+        return html_body
+
 
 class TypingDots(QWidget):
     def __init__(self, color="#aaa"):
@@ -215,6 +228,8 @@ class ChatGPTApp(QWidget):
         self.dialogs: List[Dict[str, Any]] = []
         self.current_index: int = -1
         self.pending_widget: QWidget | None = None
+        self.stream_bubble: MessageBubble | None = None
+        self.stream_text = ""
 
         splitter = QSplitter(Qt.Horizontal)
         splitter.addWidget(self._build_sidebar())
@@ -428,14 +443,18 @@ class ChatGPTApp(QWidget):
             sender, text, user,
             max_width=int(self.COLUMN_WIDTH * (0.6 if user else 0.8)))
         self.chat_layout.insertWidget(self.chat_layout.count() - 1, bub)
+        return bub
 
-    def _append(self, sender, text, user):
+    def _record(self, sender, text, user) -> str:
         ts = datetime.now().isoformat(timespec="seconds")  # ▸ ISO-время
-
         self.dialogs[self.current_index]["messages"].append([sender, text, user, ts])
+        self._save_dialogs()
+        return ts
+
+    def _append(self, sender, text, user):
+        ts = self._record(sender, text, user)
         self._create_bubble(sender, text, user, ts)
         QTimer.singleShot(0, self._scroll_bottom)
-        self._save_dialogs()
 
     def _build_openai_messages(self, new_msg):
         msgs = []
@@ -457,8 +476,8 @@ class ChatGPTApp(QWidget):
 
         self._show_typing()  # ← новая строка
 
-        threading.Thread(target=self._ask_server,
-                         args=(msg,), daemon=True).start()
+        worker = self._ask_server_stream if STREAMING else self._ask_server
+        threading.Thread(target=worker, args=(msg,), daemon=True).start()
 
     def _clear_chat_ui(self):
         if self.current_index < 0:
@@ -475,6 +494,10 @@ class ChatGPTApp(QWidget):
                 "max_tokens": self.token_limit
             }
             rsp = requests.post(self.server_url, json=payload, timeout=600)
+            if rsp.status_code == 429:
+                wait = rsp.headers.get("Retry-After", "несколько")
+                self.signals.error.emit(f"Сервер перегружен, повторите через {wait} сек.")
+                return
             rsp.raise_for_status()
             data = rsp.json()
             ans = data.get("answer", "[Пустой ответ]")
@@ -482,14 +505,96 @@ class ChatGPTApp(QWidget):
         except Exception as e:
             self.signals.error.emit(str(e))
 
+    def _ask_server_stream(self, prompt):
+        """POST /chat/stream: куски ответа (SSE) уходят в GUI-поток сигналом delta."""
+        try:
+            payload = {
+                "messages": self._build_openai_messages(prompt),
+                "max_tokens": self.token_limit
+            }
+            with requests.post(self.server_url + "/stream", json=payload, stream=True, timeout=(10, 600)) as rsp:
+                if rsp.status_code == 404:
+                    # сервер без потокового режима — обычный запрос
+                    self._ask_server(prompt)
+                    return
+                if rsp.status_code == 429:
+                    wait = rsp.headers.get("Retry-After", "несколько")
+                    self.signals.error.emit(f"Сервер перегружен, повторите через {wait} сек.")
+                    return
+                rsp.raise_for_status()
+                rsp.encoding = "utf-8"
+                event = None
+                for line in rsp.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[5:])
+                        if event == "delta":
+                            self.signals.delta.emit(data.get("text", ""))
+                        elif event == "done":
+                            self.signals.stream_done.emit()
+                            return
+                        elif event == "error":
+                            err = data.get("error", "ошибка сервера")
+                            if data.get("retry_after"):
+                                err = f"Сервер перегружен, повторите через {data['retry_after']} сек."
+                            self.signals.error.emit(err)
+                            return
+            self.signals.error.emit("Соединение с сервером прервано")
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+    def _on_delta(self, piece):
+        if self.stream_bubble is None:
+            self._hide_typing()
+            self.stream_text = ""
+            self.stream_bubble = self._create_bubble("TLawman", "", False)
+        self.stream_text += piece
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    def _render_stream(self):
+        if self.stream_bubble is not None:
+            self.stream_bubble.set_text(self.stream_text)
+            QTimer.singleShot(0, self._scroll_bottom)
+
+    def _end_stream(self) -> bool:
+        """Последний рендер и запись ответа в историю; False — потока не было."""
+        self.render_timer.stop()
+        if self.stream_bubble is None:
+            return False
+        text = self.stream_text.strip() or "[Пустой ответ]"
+        self.stream_bubble.set_text(text)
+        self._record("TLawman", text, False)
+        self.stream_bubble = None
+        self.stream_text = ""
+        QTimer.singleShot(0, self._scroll_bottom)
+        return True
+
+    def _on_stream_done(self):
+        self._hide_typing()
+        if not self._end_stream():
+            self._append("TLawman", "[Пустой ответ]", False)
+
+    def _on_error(self, err):
+        self._hide_typing()
+        self._end_stream()   # уже напечатанная часть ответа остаётся в истории
+        self._append("Ошибка", err, False)
+
     def _connect_signals(self):
         self.signals = WorkerSignals()
         self.signals.finished.connect(
             lambda txt: (self._hide_typing(),
                          self._append("TLawman", txt, False)))
-        self.signals.error.connect(
-            lambda err: (self._hide_typing(),
-                         self._append("Ошибка", err, False)))
+        self.signals.error.connect(self._on_error)
+        self.signals.delta.connect(self._on_delta)
+        self.signals.stream_done.connect(self._on_stream_done)
+
+        # перерисовка потокового ответа не чаще раза в STREAM_RENDER_MS
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(STREAM_RENDER_MS)
+        self.render_timer.timeout.connect(self._render_stream)
 
     def _save_dialogs(self):
         try:
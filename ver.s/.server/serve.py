@@ -0,0 +1,32 @@
+"""
+Production-запуск чат-сервера: Flask-приложение из server.py под gevent.
+
+Каждый HTTP-запрос — гринлет, блокирующие вызовы OpenAI/Qdrant (httpx,
+сокеты) после monkey-патча переключают гринлеты, поэтому долгий ответ
+LLM на 16k токенов не держит рабочий поток. Одновременные вызовы LLM
+ограничивает server.LLM_GATE, лишние запросы получают 429 + Retry-After.
+
+    pip install gevent
+    python serve.py            # вместо python server.py (dev-сервер Flask)
+"""
+from gevent import monkey
+
+monkey.patch_all()   # до импорта server: httpx/ssl/threading должны стать кооперативными
+
+import logging
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+import server
+
+HOST = "0.0.0.0"
+PORT = 5005
+MAX_CLIENTS = 1000      # одновременных соединений (гринлетов)
+
+
+if __name__ == "__main__":
+    server._log_collection_target()
+    logging.info("gevent: http://%s:%s, LLM ≤ %s одновременно, очередь ≤ %s",
+                 HOST, PORT, server.LLM_MAX_CONCURRENT, server.LLM_QUEUE_MAX)
+    WSGIServer((HOST, PORT), server.app, spawn=Pool(MAX_CLIENTS)).serve_forever()
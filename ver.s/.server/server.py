@@ -1,29 +1,176 @@
 from __future__ import annotations
 import re
 import os
+import json
+import sys
+import time
+import math
 import httpx
+import sqlite3
+import hashlib
 import textwrap
-from typing import List
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
 import traceback
 import logging
 
-from flask import Flask, jsonify, request
+import numpy as np
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from openai import OpenAI
 from qdrant_client import QdrantClient, models
 import tiktoken
+
+# общие модули из корня репозитория (case_number, case_versions, case_summaries, local_engine)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from case_number import CASE_RE, canonical_case
+from case_summaries import CaseSummaries
+from case_versions import CaseVersions
 # в начале файла
 logging.basicConfig(level=logging.DEBUG)
 # ─────────────────── конфигурация ───────────────────
 API_KEY = ("API KEY")
+# Имя alias-а (migrate.py переключает его на kad_cases_vN атомарно) —
+# поиск через alias не замечает пересборки коллекции.
 COLLECTION = "kad_cases"
+# "qdrant" — сервер Qdrant; "local" — local_engine.LocalQdrant из корня репозитория
+# (полный перебор по memmap-матрице, без сервера). Как VECTOR_BACKEND/LOCAL_DB_DIR
+# в stepthree_index — индексатор должен писать в ту же папку.
+VECTOR_BACKEND = "qdrant"
+LOCAL_DB_DIR = r"C:\Users\User\Desktop\kad_local"
 EMB_MODEL = "EMBED MODEL"
 GPT5_MODEL = "gpt-4.1"
 # Убедитесь, что это совпадает с векторным размером в Qdrant
 DIM = 768
 TOP_K = 5
-# Регэксп для поиска номера дела
-CASE_RE = re.compile(r"[AB]\d{1,3}-\d{3,6}[/-]\d{4}", re.I)
+# Двухступенчатый поиск (как SMALL_DIM в stepthree_index): сначала широкий
+# отбор по усечённому вектору "small", затем пересчёт score по полному "full".
+SMALL_DIM = 0               # 0 — обычный поиск по одному вектору
+RERANK_CANDIDATES = 100     # сколько кандидатов брать на первой ступени
+# Иерархический поиск для подборок: сначала карточки дел, затем чанки внутри них
+CASES_COLLECTION = "kad_case_cards"   # как CASES_COLL в stepthree_index
+CASE_TOP_N = 8              # сколько дел отбирать на первой ступени
+CHUNKS_PER_CASE = 2         # сколько лучших чанков брать из каждого дела
+TOPIC_RE = re.compile(
+    r"\b(?:подбор\w*|подбер\w*|найд\w*\s+дела|найти\s+дела|обзор\w*\s+практик\w*|"
+    r"практик\w*\s+по|дела\s+(?:по|о|об|против))\b",
+    re.I,
+)
+
+# ───── гибридный поиск: лексика по сторонам + векторы ─────
+# Полнотекстовый индекс "parties" строит индексатор; результаты лексического
+# и векторного поиска сливаются через Reciprocal Rank Fusion.
+HYBRID = True
+LEXICAL_LIMIT = 64          # сколько точек брать из лексического поиска
+RRF_K = 60                  # константа RRF: 1 / (RRF_K + ранг)
+_ORG_FORMS = r"(?:ООО|АО|ПАО|ЗАО|ОАО|НАО|ИП|ФГУП|МУП|ГУП|ГБУ|МКУ)"
+PARTY_RE = re.compile(
+    rf"(?:\b{_ORG_FORMS}\s+)?[«\"“]([^»\"”]{{2,80}})[»\"”]"             # ООО «Ромашка», «Ромашка»
+    rf"|\b{_ORG_FORMS}\s+([А-ЯЁA-Z][\w-]*(?:\s+[А-ЯЁA-Z][\w-]*){{0,3}})"  # ООО Ромашка Плюс
+)
+# слова, которые не делают запрос «смысловым»: «дела против ООО …», «все по делу А40-…»
+LOOKUP_WORDS = {
+    "дела", "дело", "делу", "делам", "делах", "все", "всё", "список", "найди", "найти",
+    "покажи", "показать", "против", "участием", "где", "какие", "есть", "номер",
+    "номеру", "базе", "истец", "истцом", "ответчик", "ответчиком", "ооо", "пао",
+    "зао", "оао", "нао", "фгуп", "муп", "гуп", "гбу", "мку",
+}
+
+# ───── шарды (как SHARD_MODE/SHARD_SEP в stepthree_index) ─────
+#   "none" — одна коллекция COLLECTION
+#   "year" / "year_court" — kad_cases__2024 / kad_cases__2024_a40, поиск веером
+SHARD_MODE = "none"
+SHARD_SEP = "__"
+SHARD_LIST_TTL = 60          # как часто перечитывать список шардов, сек
+SHARD_FANOUT_WORKERS = 8     # параллельных запросов к Qdrant при веерном поиске
+# код суда и год из номера дела
+CASE_PARTS_RE = re.compile(r"([АA]\d{1,3}|СИП)-\d{1,7}[-/_](\d{4})", re.I)
+# год в тексте вопроса: «за 2023 год», «в 2024 г.»
+YEAR_RE = re.compile(r"\b(20[0-4]\d)\s*(?:г\b|г\.|год)", re.I)
+# подсказки суда в тексте вопроса → код суда в номере дела
+COURT_HINTS = {
+    "города москвы": "a40",
+    "московской области": "a41",
+    "санкт-петербурга": "a56",
+    "свердловской": "a60",
+    "краснодарского": "a32",
+    "новосибирской": "a45",
+    "татарстан": "a65",
+}
+
+# ───── кэш эмбеддингов запросов ─────
+# Ключ — нормализованный текст запроса + EMB_MODEL + DIM. Память: LRU,
+# ограничен и числом записей, и объёмом векторов. Диск (общий для всех
+# процессов сервера, SQLite) — необязательный второй уровень.
+EMBED_CACHE_ENTRIES = 10_000
+EMBED_CACHE_MB = 64
+EMBED_CACHE_DB = ""              # например r"D:\kad_cache\embed.sqlite"; "" — без диска
+EMBED_CACHE_DB_ENTRIES = 200_000
+
+# ───── кэш ответов ─────
+# Ключ — (нормализованный вопрос, номер дела, max_tokens, GPT5_MODEL,
+# PROMPT_VERSION). Запись годна, пока не истёк TTL и не изменилась версия
+# дела в CASE_VERSIONS_DB (её увеличивает индексатор при записи точек дела).
+ANSWER_CACHE_ENTRIES = 2_000
+ANSWER_CACHE_MB = 32
+ANSWER_CACHE_TTL = 6 * 3600      # сек
+CASE_VERSIONS_DB = r"C:\Users\User\Desktop\text_txt\_index_state\case_versions.sqlite"  # VERSIONS_DB индексатора; "" — без кэша
+PROMPT_VERSION = 4               # увеличить при любой правке PROMPT_TEMPLATE или упаковки контекста
+
+# ───── готовые карточки дел (STEP_FOUR, stepfour_summaries.py) ─────
+# «кратко по делу X» и вопрос из одного номера дела — карточка из
+# CASE_SUMMARIES_DB без поиска и LLM, если она собрана по текущей версии дела.
+# Только когда кроме номера в вопросе нет ничего, кроме LOOKUP_WORDS и CARD_WORDS:
+# «суть спора по делу X и шансы апелляции» идёт обычным путём.
+CASE_SUMMARIES_DB = r"C:\Users\User\Desktop\text_txt\_index_state\case_summaries.sqlite"  # "" — без карточек
+CARD_WORDS = {
+    "кратко", "краткая", "краткое", "краткую", "краткий", "коротко", "вкратце",
+    "карточка", "карточку", "сводка", "сводку", "суть", "чем", "чём", "спор", "спора",
+    "дай", "расскажи", "опиши",
+}
+
+# ───── упаковка контекста в токенах ─────
+# Чанки идут в контекст целиком, по порядку релевантности, пока влезают в
+# бюджет: окно модели минус промпт без контекста (с вопросом) и max_tokens.
+# Первый не влезший чанк дорезается до конца предложения, дальше — стоп.
+CONTEXT_WINDOW = 128_000         # окно GPT5_MODEL, токенов (вход + ответ)
+CONTEXT_MAX_TOKENS = 48_000      # потолок контекста по цене (≈ прежние 150 000 символов)
+PROMPT_SAFETY_TOKENS = 512       # запас на расхождение токенизатора с моделью
+PACK_MIN_TAIL = 200              # меньше — последний чанк не дорезаем
+
+# ───── map-reduce для дел, не влезающих в контекст («все/полностью») ─────
+# map: дело режется на части по MAP_SLICE_TOKENS, по каждой — выжимка
+# отдельным запросом к LLM (не больше MAP_CONCURRENCY на весь сервер);
+# reduce: обычный промпт, в <RAG> — выжимки по порядку. Выжимка не зависит
+# от вопроса и кэшируется по хэшам чанков части: повторный вопрос по тому
+# же делу стоит один reduce.
+MAP_REDUCE = True
+MAP_SLICE_TOKENS = 24_000
+MAP_MAX_TOKENS = 1_500           # длина одной выжимки
+MAP_CONCURRENCY = 4
+MAP_PROMPT_VERSION = 1           # увеличить при правке MAP_PROMPT
+SUMMARY_CACHE_ENTRIES = 5_000    # выжимок в памяти
+SUMMARY_CACHE_DB = ""            # например r"D:\kad_cache\summaries.sqlite" — общий для процессов; "" — только память
+
+# ───── production-режим (serve.py: gevent) и лимиты ─────
+# Пулы соединений: одни и те же keep-alive соединения к OpenAI и Qdrant
+# для всех запросов; при gevent каждый запрос — гринлет, не поток.
+HTTP_MAX_CONNECTIONS = 64
+HTTP_MAX_KEEPALIVE = 32
+QDRANT_GRPC = False          # True — gRPC к Qdrant (порт 6334), одно мультиплексированное соединение
+# Одновременных запросов к LLM; остальные ждут в очереди до LLM_QUEUE_MAX.
+# Очередь полна или ждали дольше LLM_QUEUE_TIMEOUT — 429 с Retry-After.
+LLM_MAX_CONCURRENT = 8
+LLM_QUEUE_MAX = 32
+LLM_QUEUE_TIMEOUT = 120      # сек
+# Одинаковые одновременные вопросы (тот же ключ, что у кэша ответов) считаются
+# один раз: остальные запросы подключаются к идущему расчёту и получают его
+# ответ или поток. Такие запросы не упираются в очередь LLM.
+COALESCE = True
 
 # ───── прокси через VPN (SOCKS5) ─────
 PROXY_URL = "socks5://127.0.0.1:5000"
@@ -33,156 +180,756 @@ os.environ["ALL_PROXY"]   = PROXY_URL
 
 
 # init clients
-http_client = httpx.Client(proxy=PROXY_URL, timeout=120)
-openai_client = OpenAI(api_key=API_KEY, http_client=http_client)
-qdrant = QdrantClient(
-    host="127.0.0.1",
-    port=6333,
-    https=False,
-    api_key="API KEY",
-    prefer_grpc=False,   # явно выключаем gRPC, используем HTTP(S)
-    timeout=600.0
+http_client = httpx.Client(
+    proxy=PROXY_URL,
+    timeout=120,
+    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=HTTP_MAX_KEEPALIVE),
 )
+openai_client = OpenAI(api_key=API_KEY, http_client=http_client)
+if VECTOR_BACKEND == "local":
+    from local_engine import LocalQdrant
+    qdrant = LocalQdrant(LOCAL_DB_DIR)
+else:
+    qdrant = QdrantClient(
+        host="127.0.0.1",
+        port=6333,
+        https=False,
+        api_key="API KEY",
+        prefer_grpc=QDRANT_GRPC,   # по умолчанию HTTP(S)
+        timeout=600.0,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    )
 
 app = Flask(__name__)
 CORS(app)
 
+_shard_pool = ThreadPoolExecutor(max_workers=SHARD_FANOUT_WORKERS, thread_name_prefix="shard")
+_map_pool = ThreadPoolExecutor(max_workers=MAP_CONCURRENCY, thread_name_prefix="map")
+_shard_cache = {"ts": 0.0, "names": []}
+
+
+class Overloaded(Exception):
+    """LLM занят: очередь полна или ожидание вышло. retry_after — сек до повтора."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM перегружен, повторите через {retry_after} сек")
+        self.retry_after = retry_after
+
+
+class LLMGate:
+    """
+    Не более max_concurrent одновременных вызовов LLM, до queue_max ждущих.
+    На threading-примитивах: под gevent (serve.py) они кооперативные.
+    """
+
+    def __init__(self, max_concurrent: int, queue_max: int, timeout: float):
+        self._sem = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.max_concurrent = max_concurrent
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self.waiting = 0
+        self.active = 0
+        self.avg_sec = 10.0      # EMA длительности вызова — для Retry-After
+        self.rejected = 0
+
+    def retry_after(self) -> int:
+        rounds = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.avg_sec))
+
+    def saturated(self) -> bool:
+        return self.waiting >= self.queue_max
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            if self.saturated():
+                self.rejected += 1
+                raise Overloaded(self.retry_after())
+            self.waiting += 1
+        try:
+            ok = self._sem.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not ok:
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(self.retry_after())
+        with self._lock:
+            self.active += 1
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.avg_sec = 0.8 * self.avg_sec + 0.2 * (time.monotonic() - t0)
+            self._sem.release()
+
+
+LLM_GATE = LLMGate(LLM_MAX_CONCURRENT, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT)
+
+
+def _norm_query(text: str) -> str:
+    """Регистр, пробелы и юникод-формы не меняют смысл запроса."""
+    return " ".join(unicodedata.normalize("NFC", text).split()).casefold()
+
+
+class EmbedCache:
+    """LRU в памяти (записи + байты) и необязательный общий SQLite-уровень."""
+
+    def __init__(self, max_entries: int, max_bytes: int, db_path: str = "",
+                 db_entries: int = 0):
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.db_path = db_path
+        self.db_entries = db_entries
+        self.stats = {"hits_mem": 0, "hits_disk": 0, "misses": 0}
+        if db_path:
+            with self._db() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS emb "
+                           "(key TEXT PRIMARY KEY, vec BLOB, ts REAL)")
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(f"{EMB_MODEL}\0{DIM}\0{_norm_query(text)}".encode("utf-8")).hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        # соединение на вызов: SQLite сам разруливает несколько процессов
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _remember(self, key: str, vec: np.ndarray):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return
+            self._mem[key] = vec
+            self.nbytes += vec.nbytes
+            while self._mem and (len(self._mem) > self.max_entries or self.nbytes > self.max_bytes):
+                _, old = self._mem.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                self.stats["hits_mem"] += 1
+                return vec
+        if self.db_path:
+            try:
+                with self._db() as db:
+                    row = db.execute("SELECT vec FROM emb WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as exc:
+                logging.warning("Кэш эмбеддингов (диск) недоступен: %s", exc)
+                row = None
+            if row:
+                vec = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vec)
+                with self._lock:
+                    self.stats["hits_disk"] += 1
+                return vec
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, vec: List[float]):
+        arr = np.asarray(vec, dtype=np.float32)
+        self._remember(key, arr)
+        if not self.db_path:
+            return
+        try:
+            with self._db() as db:
+                db.execute("INSERT OR REPLACE INTO emb VALUES (?, ?, ?)",
+                           (key, arr.tobytes(), time.time()))
+                # изредка подрезаем диск до db_entries самых свежих
+                if self.db_entries and self.stats["misses"] % 500 == 0:
+                    db.execute("DELETE FROM emb WHERE key NOT IN "
+                               "(SELECT key FROM emb ORDER BY ts DESC LIMIT ?)", (self.db_entries,))
+        except sqlite3.Error as exc:
+            logging.warning("Кэш эмбеддингов (диск) недоступен: %s", exc)
+
+    def summary(self) -> dict:
+        with self._lock:
+            total = sum(self.stats.values())
+            hits = self.stats["hits_mem"] + self.stats["hits_disk"]
+            return {**self.stats, "entries": len(self._mem),
+                    "mb": round(self.nbytes / 2**20, 2),
+                    "hit_rate": round(hits / total, 3) if total else None}
+
+
+EMBED_CACHE = EmbedCache(EMBED_CACHE_ENTRIES, EMBED_CACHE_MB * 2**20,
+                         EMBED_CACHE_DB, EMBED_CACHE_DB_ENTRIES)
+
+
+class AnswerCache:
+    """LRU ответов с TTL; запись сверяется с версией дела при каждом чтении."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()   # key → (answer, meta, version, expires, bytes)
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    @staticmethod
+    def key(question: str, case_num: Optional[str], max_tokens: int) -> str:
+        raw = f"{_norm_query(question)}\0{case_num or ''}\0{max_tokens}\0{GPT5_MODEL}\0{PROMPT_VERSION}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _drop(self, key: str):
+        self.nbytes -= self._mem.pop(key)[4]
+
+    def get(self, key: str, version: int) -> Optional[tuple]:
+        """(ответ, meta) или None."""
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            answer, meta, ver, expires, _ = entry
+            if ver != version or expires < time.time():
+                self._drop(key)
+                self.stats["stale"] += 1
+                return None
+            self._mem.move_to_end(key)
+            self.stats["hits"] += 1
+            return answer, meta
+
+    def put(self, key: str, version: int, answer: str, meta: dict):
+        size = len(answer.encode("utf-8"))
+        with self._lock:
+            if key in self._mem:
+                self._drop(key)
+            self._mem[key] = (answer, meta, version, time.time() + self.ttl, size)
+            self.nbytes += size
+            while self._mem and (len(self._mem) > self.max_entries or self.nbytes > self.max_bytes):
+                self._drop(next(iter(self._mem)))
+
+    def summary(self) -> dict:
+        with self._lock:
+            total = sum(self.stats.values())
+            return {**self.stats, "entries": len(self._mem),
+                    "mb": round(self.nbytes / 2**20, 2),
+                    "hit_rate": round(self.stats["hits"] / total, 3) if total else None}
+
+
+ANSWER_CACHE = AnswerCache(ANSWER_CACHE_ENTRIES, ANSWER_CACHE_MB * 2**20, ANSWER_CACHE_TTL)
+
+
+class SummaryCache:
+    """Выжимки частей дела: LRU в памяти и необязательный общий SQLite."""
+
+    def __init__(self, max_entries: int, db_path: str = ""):
+        self._mem: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.stats = {"hits": 0, "misses": 0}
+        if db_path:
+            with self._db() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS summaries "
+                           "(key TEXT PRIMARY KEY, text TEXT, ts REAL)")
+
+    def _db(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _remember(self, key: str, text: str):
+        with self._lock:
+            self._mem[key] = text
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._mem.get(key)
+            if text is not None:
+                self._mem.move_to_end(key)
+        if text is None and self.db_path:
+            try:
+                with self._db() as db:
+                    row = db.execute("SELECT text FROM summaries WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as exc:
+                logging.warning("Кэш выжимок (диск) недоступен: %s", exc)
+                row = None
+            if row:
+                text = row[0]
+                self._remember(key, text)
+        with self._lock:
+            self.stats["hits" if text is not None else "misses"] += 1
+        return text
+
+    def put(self, key: str, text: str):
+        self._remember(key, text)
+        if not self.db_path:
+            return
+        try:
+            with self._db() as db:
+                db.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)",
+                           (key, text, time.time()))
+        except sqlite3.Error as exc:
+            logging.warning("Кэш выжимок (диск) недоступен: %s", exc)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._mem)}
+
+
+SUMMARY_CACHE = SummaryCache(SUMMARY_CACHE_ENTRIES, SUMMARY_CACHE_DB)
+
+
+class _Flight:
+    """Один идущий расчёт ответа: куски по мере готовности, meta, ошибка."""
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.meta: dict = {}
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """
+    Коалесинг одинаковых запросов. Расчёт идёт в отдельном потоке (при gevent —
+    гринлете) и не зависит ни от одного клиента: отвалившийся первый клиент
+    не обрывает ответ остальным.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.stats = {"flights": 0, "coalesced": 0}
+
+    def join(self, key: str, produce: Callable[[dict], Iterator[str]],
+             before_start: Optional[Callable[[], None]] = None):
+        """
+        (расчёт, подключились ли к уже идущему). produce(meta) — генератор
+        кусков ответа; запускается, только если такого расчёта ещё нет.
+        before_start() вызывается под той же блокировкой только перед новым
+        расчётом и может его отменить исключением (Overloaded).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats["coalesced"] += 1
+                return flight, True
+            if before_start is not None:
+                before_start()
+            flight = self._flights[key] = _Flight()
+            self.stats["flights"] += 1
+        threading.Thread(target=self._run, args=(key, flight, produce),
+                         name="flight", daemon=True).start()
+        return flight, False
+
+    def _run(self, key: str, flight: _Flight, produce):
+        try:
+            for piece in produce(flight.meta):
+                with flight.cond:
+                    flight.pieces.append(piece)
+                    flight.cond.notify_all()
+        except BaseException as exc:
+            flight.error = exc
+        finally:
+            # опоздавшие к этому моменту начнут новый расчёт (скорее всего — из кэша)
+            with self._lock:
+                self._flights.pop(key, None)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    @staticmethod
+    def follow(flight: _Flight) -> Iterator[str]:
+        """Все куски расчёта с начала и по мере появления; ошибку расчёта — поднимает."""
+        i = 0
+        while True:
+            with flight.cond:
+                while i >= len(flight.pieces) and not flight.done:
+                    flight.cond.wait()
+                new = flight.pieces[i:]
+                done = flight.done
+            i += len(new)
+            yield from new
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+
+FLIGHTS = SingleFlight()
+CASE_VERSIONS: Optional[CaseVersions] = None
+if CASE_VERSIONS_DB:
+    try:
+        CASE_VERSIONS = CaseVersions(CASE_VERSIONS_DB)
+    except Exception as exc:
+        logging.warning("Версии дел недоступны (%s) — кэш ответов выключен", exc)
+
+
+CASE_SUMMARIES: Optional[CaseSummaries] = None
+if CASE_SUMMARIES_DB:
+    try:
+        CASE_SUMMARIES = CaseSummaries(CASE_SUMMARIES_DB)
+    except Exception as exc:
+        logging.warning("Карточки дел недоступны (%s)", exc)
+
+
+def _case_card(case_num: str) -> Optional[str]:
+    """Карточка дела из STEP_FOUR, если она собрана по текущей версии дела."""
+    if CASE_SUMMARIES is None or CASE_VERSIONS is None:
+        return None
+    try:
+        hit = CASE_SUMMARIES.get(case_num)
+        if hit and hit[1] == CASE_VERSIONS.case(case_num):
+            return hit[0]
+    except Exception as exc:
+        logging.warning("Не удалось прочитать карточку дела %s: %s", case_num, exc)
+    return None
+
+
+def _case_version(case_num: Optional[str]) -> Optional[int]:
+    """None — версию узнать нельзя, ответ не кэшируем."""
+    if CASE_VERSIONS is None:
+        return None
+    try:
+        return CASE_VERSIONS.get(case_num)
+    except Exception as exc:
+        logging.warning("Не удалось прочитать версию дела %s: %s", case_num, exc)
+        return None
+
 
 # ─────────────────── вспомогательные функции ───────────────────
 def _embed(text: str) -> List[float]:
-    """Получить эмбеддинг из OpenAI."""
+    """
+    Получить эмбеддинг из OpenAI (через EMBED_CACHE). Запросы только из
+    номера дела сюда не доходят при любом HYBRID — _build_prompt отвечает на них
+    фильтром по case_id.
+    """
+    key = EMBED_CACHE.key(text)
+    vec = EMBED_CACHE.get(key)
+    if vec is not None:
+        return vec.tolist()
     resp = openai_client.embeddings.create(
         model=EMB_MODEL,
-        input=text,
+        input=" ".join(text.split()),
         dimensions=DIM
     )
-    return resp.data[0].embedding
-
-def _normalize_case_id(s: str) -> str:
-    # приводим тире к обычному, делаем верхний регистр и латиницу A/B
-    s = s.replace("—", "-").replace("–", "-").replace("−", "-").upper()
-    return s.translate(str.maketrans({"А": "A", "В": "B"}))
+    emb = resp.data[0].embedding
+    EMBED_CACHE.put(key, emb)
+    return emb
 
-def _fetch_all_case_chunks(case_num: str) -> List[str]:
-    """Забирает ВСЕ чанки с данным case_id по фильтру через scroll."""
-    filt = models.Filter(
+def _case_filter(case_num: str) -> models.Filter:
+    return models.Filter(
         must=[models.FieldCondition(key="case_id",
                                     match=models.MatchValue(value=case_num))]
     )
-    all_chunks: List[str] = []
-    next_off = None
-    while True:
-        points, next_off = qdrant.scroll(
-            collection_name=COLLECTION,
-            limit=256,                 # можно 512
+
+def _list_shards() -> List[str]:
+    """Существующие шарды индекса (кэшируем на SHARD_LIST_TTL)."""
+    if SHARD_MODE == "none":
+        return [COLLECTION]
+    now = time.time()
+    if now - _shard_cache["ts"] > SHARD_LIST_TTL:
+        prefix = COLLECTION + SHARD_SEP
+        _shard_cache["names"] = sorted(
+            c.name for c in qdrant.get_collections().collections if c.name.startswith(prefix)
+        )
+        _shard_cache["ts"] = now
+    return _shard_cache["names"]
+
+def _shards_for(question: str, case_num: Optional[str] = None) -> List[str]:
+    """
+    Сужаем веер: год и код суда берём из номера дела, иначе — из текста вопроса.
+    Если сузить нечем (или сужение дало пусто) — ищем по всем шардам.
+    """
+    shards = _list_shards()
+    if SHARD_MODE == "none":
+        return shards
+
+    year = code = None
+    m = CASE_PARTS_RE.search(case_num or "")
+    if m:
+        year = m.group(2)
+        code = m.group(1).upper().replace("А", "A").replace("СИП", "SIP").lower()
+    else:
+        ym = YEAR_RE.search(question)
+        year = ym.group(1) if ym else None
+        q = question.lower()
+        code = next((c for hint, c in COURT_HINTS.items() if hint in q), None)
+
+    def suffix(name: str) -> List[str]:
+        return name[len(COLLECTION + SHARD_SEP):].split("_")
+
+    picked = shards
+    if year:
+        picked = [n for n in picked if suffix(n)[0] == year]
+    if code and SHARD_MODE == "year_court":
+        picked = [n for n in picked if suffix(n)[-1] == code]
+    return picked or shards
+
+def _rescore(vec: List[float], hits, limit: int):
+    """Пересчёт косинуса кандидатов по полному вектору (Qdrant хранит их нормированными)."""
+    if not hits:
+        return hits
+    q = np.asarray(vec, dtype=np.float32)
+    q /= np.linalg.norm(q) or 1.0
+    full = np.asarray([h.vector["full"] for h in hits], dtype=np.float32)
+    scores = full @ q
+    for h, sc in zip(hits, scores):
+        h.score = float(sc)
+        h.vector = None          # дальше векторы не нужны — не таскаем их в памяти
+    hits.sort(key=lambda h: h.score, reverse=True)
+    return hits[:limit]
+
+def _search(vec: List[float], limit: int, shards: List[str],
+            query_filter: Optional[models.Filter] = None):
+    """Векторный поиск веером по шардам; результаты сливаются по score."""
+    def one(name: str):
+        if SMALL_DIM:
+            # 1-я ступень: HNSW по короткому вектору, полный вектор забираем для пересчёта
+            cand = qdrant.search(
+                collection_name=name,
+                query_vector=models.NamedVector(name="small", vector=vec[:SMALL_DIM]),
+                limit=max(limit, RERANK_CANDIDATES),
+                with_payload=True,
+                with_vectors=["full"],
+                query_filter=query_filter,
+            )
+            # 2-я ступень: точный score по полному вектору
+            return _rescore(vec, cand, limit)
+        return qdrant.search(
+            collection_name=name,
+            query_vector=vec,
+            limit=limit,
             with_payload=True,
-            with_vectors=False,
-            filter=filt,
-            offset=next_off,
+            query_filter=query_filter,
         )
-        if not points:
-            break
-        all_chunks.extend(p.payload.get("text", "") for p in points)
-        if next_off is None:
-            break
-    return all_chunks
-
-def _ask(question: str, max_tokens: int = 250) -> str:
-    MAX_CHUNKS = 800
-    MAX_CONTEXT_CHARS = 150_000
-    MAX_PROMPT_CHARS = 180_000
 
-    want_all = re.search(r"\b(все|всё|полностью|полное|целиком)\b", question, re.IGNORECASE)
-    m = CASE_RE.search(question)
+    if len(shards) == 1:
+        return one(shards[0])
+    hits = []
+    for part in _shard_pool.map(one, shards):
+        hits.extend(part)
+    hits.sort(key=lambda h: h.score, reverse=True)
+    return hits[:limit]
 
-    chunks = []
-    case_num = None
+def _party_names(question: str):
+    """Названия сторон из вопроса: [(название, (начало, конец))]."""
+    out = []
+    for pm in PARTY_RE.finditer(question):
+        name = (pm.group(1) or pm.group(2) or "").strip()
+        if name:
+            out.append((name, pm.span()))
+    return out
 
-    # --- 1. Поиск номера дела ---
-    if m:
-        case_num = _normalize_case_id(m.group(0))
-        qdrant_filter = {"must": [{"key": "case_id", "match": {"value": case_num}}]}
+def _is_pure_lookup(question: str, spans, allowed=LOOKUP_WORDS) -> bool:
+    """
+    Запрос — чистый поиск по реквизитам (номер дела / сторона), без смысловой части.
+    Тогда эмбеддинг не нужен: достаточно фильтров по payload. allowed — слова,
+    которые смысловой частью не считаются.
+    """
+    rest = question
+    for a, b in sorted(spans, reverse=True):
+        rest = rest[:a] + " " + rest[b:]
+    words = re.findall(r"[а-яёa-z]+", rest.lower())
+    return not [w for w in words if len(w) > 2 and w not in allowed]
 
-        if want_all:
-            # --- 2. Получение всех чанков, но не более MAX_CHUNKS ---
-            all_chunks = []
-            next_off = None
-            real_count = 0
-
-            while True:
-                pts, next_off = qdrant.scroll(
-                    collection_name=COLLECTION,
-                    limit=256,
-                    with_payload=True,
-                    with_vectors=False,
-                    filter=models.Filter(
-                        must=[
-                            models.FieldCondition(
-                                key="case_id",
-                                match=models.MatchValue(value=case_num)
-                            )
-                        ]
-                    ),
-                    offset=next_off,
-                )
-
-                if not pts:
-                    break
-
-                for p in pts:
-                    real_count += 1
-                    if len(all_chunks) < MAX_CHUNKS:
-                        all_chunks.append(p.payload.get("text", ""))
-
-                if next_off is None:
-                    break
-
-            if not all_chunks:
-                return f"По делу {case_num} сведений в базе нет."
-
-            chunks = all_chunks
+_NO_CHUNK_NO = 1 << 30   # точки, проиндексированные до chunk_no, — в конец
 
-        else:
-            # --- 3. Обычный векторный поиск по делу ---
-            query_text = f"<CASE:{case_num}> {question}"
-            vec = _embed(query_text)
-            hits = qdrant.search(
-                collection_name=COLLECTION,
-                query_vector=vec,
-                limit=TOP_K,
+def _chunk_no(payload: dict) -> int:
+    no = payload.get("chunk_no")
+    return _NO_CHUNK_NO if no is None else no
+
+def _name_hits(parties: str, names: List[str]) -> int:
+    """Сколько названий целиком (все слова) есть в "parties" — как MatchText."""
+    parties = (parties or "").lower()
+    return sum(all(w in parties for w in n.lower().split()) for n in names)
+
+def _lexical_search(names: List[str], shards: List[str], limit: int = LEXICAL_LIMIT):
+    """
+    Точки, у которых в "parties" есть все слова хотя бы одного из названий.
+    Scroll отдаёт точки в порядке id, а RRF нужен ранг: сначала берём шапки
+    дел (chunk_no = 0 — там стороны и названы), остаток лимита — прочими
+    чанками, и сортируем по числу совпавших названий, затем по chunk_no.
+    """
+    parties = [models.FieldCondition(key="parties", match=models.MatchText(text=n))
+               for n in names]
+    head = models.FieldCondition(key="chunk_no", match=models.MatchValue(value=0))
+    out = []
+    for filt in (models.Filter(should=parties, must=[head]),
+                 models.Filter(should=parties, must_not=[head])):
+        for name in shards:
+            if len(out) >= limit:
+                break
+            pts, _ = qdrant.scroll(
+                collection_name=name,
+                limit=limit - len(out),
                 with_payload=True,
-                query_filter=qdrant_filter,
+                with_vectors=False,
+                scroll_filter=filt,
             )
-            chunks = [h.payload.get("text", "") for h in hits]
+            out.extend(pts)
+    out.sort(key=lambda p: (-_name_hits(p.payload.get("parties"), names), _chunk_no(p.payload)))
+    return out
 
-    else:
-        # --- 4. Поиск без номера дела ---
-        vec = _embed(question)
-        hits = qdrant.search(
-            collection_name=COLLECTION,
+def _cap_per_case(points, per_case: int):
+    seen = {}
+    out = []
+    for p in points:
+        cid = p.payload.get("case_id")
+        if seen.get(cid, 0) < per_case:
+            seen[cid] = seen.get(cid, 0) + 1
+            out.append(p)
+    return out
+
+def _rrf(*ranked_lists, limit: int):
+    """Reciprocal Rank Fusion по id точек; возвращает точки в порядке слитого score."""
+    score, by_id = {}, {}
+    for ranked in ranked_lists:
+        for rank, p in enumerate(ranked):
+            score[p.id] = score.get(p.id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            by_id.setdefault(p.id, p)
+    order = sorted(score, key=score.get, reverse=True)
+    return [by_id[i] for i in order[:limit]]
+
+def _search_by_cases(vec: List[float], question: str) -> List[str]:
+    """
+    Двухступенчатый поиск для подборок: топ-N дел по карточкам,
+    затем лучшие чанки только внутри этих дел (не больше CHUNKS_PER_CASE на дело).
+    Пустой список — карточек нет, вызывающий откатывается к обычному поиску.
+    """
+    try:
+        cards = qdrant.search(
+            collection_name=CASES_COLLECTION,
             query_vector=vec,
-            limit=TOP_K,
-            with_payload=True,
+            limit=CASE_TOP_N,
+            with_payload=["case_id"],
         )
-        chunks = [h.payload.get("text", "") for h in hits]
+    except Exception:
+        logging.exception("Поиск по карточкам дел не удался")
+        return []
+    case_ids = [c.payload.get("case_id") for c in cards if c.payload.get("case_id")]
+    if not case_ids:
+        return []
 
-    # --- 5. Ограничиваем контекст ---
-    if not chunks:
-        if case_num:
-            return f"По делу {case_num} сведений в базе нет."
-        else:
-            return "По запросу подходящих фрагментов не найдено."
+    filt = models.Filter(
+        must=[models.FieldCondition(key="case_id", match=models.MatchAny(any=case_ids))]
+    )
+    hits = _search(vec, len(case_ids) * CHUNKS_PER_CASE * 3, _shards_for(question),
+                   query_filter=filt)
+
+    per_case = {cid: [] for cid in case_ids}
+    for h in hits:
+        bucket = per_case.get(h.payload.get("case_id"))
+        if bucket is not None and len(bucket) < CHUNKS_PER_CASE:
+            bucket.append(h.payload.get("text", ""))
+    # порядок — по рангу дела на первой ступени
+    return [t for cid in case_ids for t in per_case[cid]]
+
+def _scroll_case_payloads(case_num: str, shards: List[str], max_chunks: Optional[int] = None,
+                          with_payload=True, query_filter: Optional[models.Filter] = None):
+    """
+    Все точки дела по фильтру case_id (или query_filter). Возвращает (payload-ы,
+    сколько всего точек). С max_chunks листание останавливается на max_chunks
+    точках, и «всего» — не больше набранного.
+    Дело лежит в одном шарде, но при неизвестном шарде идём по всем.
+    """
+    filt = query_filter or _case_filter(case_num)
+    payloads: List[dict] = []
+    for name in shards:
+        next_off = None
+        while max_chunks is None or len(payloads) < max_chunks:
+            pts, next_off = qdrant.scroll(
+                collection_name=name,
+                limit=256 if max_chunks is None else min(256, max_chunks - len(payloads)),
+                with_payload=with_payload,
+                with_vectors=False,
+                scroll_filter=filt,
+                offset=next_off,
+            )
+            payloads.extend(p.payload or {} for p in pts)
+            if not pts or next_off is None:
+                break
+    return payloads, len(payloads)
+
+def _scroll_case(case_num: str, shards: List[str], max_chunks: Optional[int] = None):
+    """
+    Как _scroll_case_payloads, но вместо payload-ов — тексты чанков по chunk_no:
+    первыми шапки файлов дела (chunk_no = 0), а не первые попавшиеся по id.
+    С max_chunks всё дело не листаем: берём только chunk_no < max_chunks, а у
+    дел без chunk_no (старая индексация) — первые max_chunks точек.
+    """
+    fields = ["text", "chunk_no"]
+    if max_chunks is None:
+        payloads, real_count = _scroll_case_payloads(case_num, shards, with_payload=fields)
+    else:
+        head = models.Filter(must=[
+            *_case_filter(case_num).must,
+            models.FieldCondition(key="chunk_no", range=models.Range(lt=max_chunks)),
+        ])
+        payloads, real_count = _scroll_case_payloads(case_num, shards, with_payload=fields,
+                                                     query_filter=head)
+        if not payloads:
+            payloads, real_count = _scroll_case_payloads(case_num, shards, max_chunks,
+                                                         with_payload=fields)
+    payloads.sort(key=_chunk_no)
+    return [p.get("text", "") for p in payloads[:max_chunks]], real_count
+
+def _stitch_case(payloads: List[dict]) -> Optional[List[str]]:
+    """
+    Текст дела по порядку — для «все/полностью». Чанки каждого файла идут по
+    chunk_no, тег индекса (<CASE:…> <COURT:…> …) остаётся один раз в начале,
+    перекрытие с предыдущим чанком (char_start < его char_end) срезается.
+    Куски склеиваются без разделителя. None — у точек нет chunk_no
+    (проиндексированы раньше), собрать по порядку нельзя.
+    """
+    if not payloads or any("chunk_no" not in p for p in payloads):
+        return None
+    by_file: dict = {}
+    for p in payloads:
+        by_file.setdefault(p.get("file") or "", []).append(p)
 
-    # Ограничение количества чанков
-    chunks = chunks[:MAX_CHUNKS]
+    tag = _INDEX_TAG_RE.match(payloads[0].get("text", ""))
+    pieces = [tag.group(0)] if tag else []
+    for i, fname in enumerate(sorted(by_file)):
+        if i:
+            pieces.append(CONTEXT_SEP)
+        prev_no = prev_end = None
+        for p in sorted(by_file[fname], key=lambda p: p["chunk_no"]):
+            if p["chunk_no"] == prev_no:
+                continue   # повторная заливка того же файла
+            body = _INDEX_TAG_RE.sub("", p.get("text", ""), count=1)
+            start, end = p.get("char_start"), p.get("char_end")
+            if start is not None and end is not None and len(body) != end - start:
+                # точки до среза по offsets: чанк декодирован из токенов, и начатый
+                # в прошлом чанке символ стоит в начале как «�» — по offsets его нет
+                body = body.lstrip("\ufffd")
+            if prev_end is not None and start is not None and start < prev_end:
+                body = body[prev_end - start:]
+            pieces.append(body)
+            prev_no, prev_end = p["chunk_no"], p.get("char_end")
+    return pieces
 
-    # Ограничение текста
-    context = "\n\n---\n\n".join(chunks)
-    if len(context) > MAX_CONTEXT_CHARS:
-        context = context[:MAX_CONTEXT_CHARS]
+def _fetch_all_case_chunks(case_num: str) -> List[str]:
+    """Забирает ВСЕ чанки с данным case_id по фильтру через scroll."""
+    texts, _ = _scroll_case(case_num, _shards_for("", case_num))
+    return texts
+
+EMPTY_ANSWER = "[Пустой ответ]"   # не кэшируем
+
+CONTEXT_SEP = "\n\n---\n\n"
+# make_index_tag индексатора: «<CASE:…> <COURT:…> <ISTEC:…> <OTV:…>\n» перед текстом чанка
+_INDEX_TAG_RE = re.compile(r"^<CASE:[^\n]*\n")
 
-    # --- 6. Собираем промпт ---
-    prompt = textwrap.dedent(f"""
+PROMPT_TEMPLATE = textwrap.dedent("""
     Ты — юридический ассистент по РФ. Работай строго по правилам ниже.
     Никаких преамбул, рассуждений и ссылок на инструкции — выводи только результат.
 
@@ -228,39 +975,394 @@ def _ask(question: str, max_tokens: int = 250) -> str:
     </QUESTION>
     """)
 
-    # Ограничиваем итоговый промпт
-    if len(prompt) > MAX_PROMPT_CHARS:
-        prompt = prompt[:MAX_PROMPT_CHARS]
+_SENTENCE_END_RE = re.compile(r"[.!?…][»\"')\]]*(?=\s)|\n")
+_ENCODER = None
 
-    # --- 7. GPT запрос ---
-    rsp = openai_client.responses.create(
-        model=GPT5_MODEL,
-        input=prompt,
-        max_output_tokens=max_tokens
-    )
+
+def _encoder():
+    global _ENCODER
+    if _ENCODER is None:
+        try:
+            _ENCODER = tiktoken.encoding_for_model(GPT5_MODEL)
+        except KeyError:
+            _ENCODER = tiktoken.get_encoding("o200k_base")
+    return _ENCODER
+
+
+def _n_tokens(text: str) -> int:
+    return len(_encoder().encode(text, disallowed_special=()))
+
+
+def _trim_to_sentence(text: str, max_tokens: int) -> str:
+    """Начало text не длиннее max_tokens, обрезанное по концу предложения."""
+    enc = _encoder()
+    head = enc.decode(enc.encode(text, disallowed_special=())[:max_tokens])
+    ends = [m.end() for m in _SENTENCE_END_RE.finditer(head)]
+    return head[:ends[-1]].rstrip() if ends else ""
+
+
+def _pack_context(chunks: List[str], budget: int, sep_text: str = CONTEXT_SEP):
+    """
+    Чанки по порядку (= по релевантности) целиком, пока влезают в budget
+    токенов. Возвращает (контекст, токенов, чанков взято, усечено ли).
+    """
+    sep = _n_tokens(sep_text) if sep_text else 0
+    parts: List[str] = []
+    used = 0
+    for text in chunks:
+        cost = _n_tokens(text) + (sep if parts else 0)
+        if used + cost <= budget:
+            parts.append(text)
+            used += cost
+            continue
+        room = budget - used - (sep if parts else 0)
+        tail = _trim_to_sentence(text, room) if room >= PACK_MIN_TAIL else ""
+        if tail:
+            used += _n_tokens(tail) + (sep if parts else 0)
+            parts.append(tail)
+        return sep_text.join(parts), used, len(parts), True
+    return sep_text.join(parts), used, len(parts), False
+
+
+MAP_PROMPT = textwrap.dedent("""
+    Ниже — часть материалов арбитражного дела. Сделай сжатую фактическую
+    выжимку только по этой части: стороны, требования и суммы, ключевые даты,
+    процессуальные действия и решения суда, доводы сторон. Без оценок и
+    домыслов; чего в части нет — не упоминай. Только выжимка, без преамбул.
+
+    <PART>
+    {text}
+    </PART>
+    """)
+
+
+def _case_slices(pieces: List[str], limit: int) -> List[List[str]]:
+    """Подряд идущие куски дела группами не больше limit токенов."""
+    slices: List[List[str]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for piece in pieces:
+        n = _n_tokens(piece)
+        if cur and cur_tokens + n > limit:
+            slices.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(piece)
+        cur_tokens += n
+    if cur:
+        slices.append(cur)
+    return slices
+
+
+def _summarize_slice(pieces: List[str], sep_text: str):
+    """(выжимка, из кэша ли). Ключ — хэши чанков части + модель и версия MAP_PROMPT."""
+    digest = hashlib.sha1(f"{GPT5_MODEL}\0{MAP_PROMPT_VERSION}".encode("utf-8"))
+    for piece in pieces:
+        digest.update(hashlib.sha1(piece.encode("utf-8")).digest())
+    key = digest.hexdigest()
+    cached = SUMMARY_CACHE.get(key)
+    if cached is not None:
+        return cached, True
+    with LLM_GATE.slot():
+        rsp = openai_client.responses.create(
+            model=GPT5_MODEL,
+            input=MAP_PROMPT.format(text=sep_text.join(pieces)),
+            max_output_tokens=MAP_MAX_TOKENS,
+        )
+    text = (getattr(rsp, "output_text", None) or "").strip()
+    if text:
+        SUMMARY_CACHE.put(key, text)
+    return text, False
+
+
+def _map_case(pieces: List[str], sep_text: str):
+    """map: выжимки частей дела по порядку. Возвращает (выжимки, сколько из кэша)."""
+    slices = _case_slices(pieces, MAP_SLICE_TOKENS)
+    results = list(_map_pool.map(lambda sl: _summarize_slice(sl, sep_text), slices))
+    return [text for text, _ in results], sum(hit for _, hit in results)
+
+
+def _cached_answer(question: str, max_tokens: int):
+    """(ключ, версия, (ответ, meta) из кэша или None); ключ None — кэш не используем."""
+    case_num = canonical_case(question)
+    # версию читаем до поиска: точки, дописанные во время ответа, её поднимут
+    version = _case_version(case_num)
+    if version is None:
+        return None, None, None
+    key = ANSWER_CACHE.key(question, case_num, max_tokens)
+    return key, version, ANSWER_CACHE.get(key, version)
+
+def _remember_answer(key: Optional[str], version: Optional[int], answer: str, meta: dict):
+    if key is not None and answer != EMPTY_ANSWER:
+        ANSWER_CACHE.put(key, version, answer, meta)
+
+def _ask(question: str, max_tokens: int = 250):
+    """
+    (ответ, meta) — из ANSWER_CACHE, если данные дела с тех пор не менялись,
+    иначе через _answer.
+    """
+    key, version, cached = _cached_answer(question, max_tokens)
+    if cached is not None:
+        answer, meta = cached
+        return answer, {**meta, "cached": True}
+    answer, meta = _answer(question, max_tokens)
+    _remember_answer(key, version, answer, meta)
+    return answer, meta
+
+def _build_prompt(question: str, max_tokens: int):
+    """
+    Поиск и сборка промпта. Возвращает (промпт, None, meta) или
+    (None, готовый ответ, {}) — когда в базе ничего не нашлось и LLM не нужна.
+    """
+    MAX_CHUNKS = 800
+
+    want_all = re.search(r"\b(все|всё|полностью|полное|целиком)\b", question, re.IGNORECASE)
+    m = CASE_RE.search(question)
+
+    chunks = []
+    sep = CONTEXT_SEP
+    case_num = None
+    case_chunks = None
+
+    # --- 1. Поиск номера дела ---
+    if m:
+        # тот же канон, что пишет индексатор в case_id
+        case_num = canonical_case(m.group(0))
+        qdrant_filter = _case_filter(case_num)
+        shards = _shards_for(question, case_num)
+
+        if not want_all and _is_pure_lookup(question, [m.span()], LOOKUP_WORDS | CARD_WORDS):
+            # --- 1a. Готовая карточка дела (STEP_FOUR) — без поиска и LLM ---
+            card = _case_card(case_num)
+            if card:
+                return None, card, {"source": "case_card"}
+
+        if want_all:
+            # --- 2. Всё дело по порядку: без повторных тегов и перекрытий чанков ---
+            payloads, case_chunks = _scroll_case_payloads(
+                case_num, shards,
+                with_payload=["text", "file", "chunk_no", "char_start", "char_end"])
+
+            if not payloads:
+                return None, f"По делу {case_num} сведений в базе нет.", {}
+
+            pieces = _stitch_case(payloads)
+            if pieces is not None:
+                chunks, sep = pieces, ""
+            else:
+                chunks = [p.get("text", "") for p in payloads]
+
+        elif _is_pure_lookup(question, [m.span()]):
+            # --- 3a. Только номер дела — фильтр по case_id, без эмбеддинга ---
+            chunks, _ = _scroll_case(case_num, shards, max_chunks=TOP_K)
+
+        else:
+            # --- 3. Обычный векторный поиск по делу ---
+            query_text = f"<CASE:{case_num}> {question}"
+            vec = _embed(query_text)
+            hits = _search(vec, TOP_K, shards, query_filter=qdrant_filter)
+            chunks = [h.payload.get("text", "") for h in hits]
+
+    else:
+        # --- 4. Поиск без номера дела ---
+        shards = _shards_for(question)
+        parties = _party_names(question) if HYBRID else []
+        lex = []
+        if parties:
+            lex = _cap_per_case(_lexical_search([n for n, _ in parties], shards),
+                                CHUNKS_PER_CASE)
+            if lex and _is_pure_lookup(question, [sp for _, sp in parties]):
+                # --- 4a. Чисто лексический запрос («дела против ООО …») — без эмбеддинга ---
+                chunks = [p.payload.get("text", "") for p in lex[:CASE_TOP_N * CHUNKS_PER_CASE]]
+
+        if not chunks:
+            vec = _embed(question)
+            if TOPIC_RE.search(question) and not lex:
+                # подборка дел: широкий охват по делам, мало чанков на каждое
+                chunks = _search_by_cases(vec, question)
+            if not chunks:
+                hits = _search(vec, TOP_K, shards)
+                if lex:
+                    # --- 4b. Гибрид: лексика по сторонам + векторы, слияние RRF ---
+                    hits = _rrf(lex, hits, limit=TOP_K * 2)
+                chunks = [h.payload.get("text", "") for h in hits]
+
+    # --- 5. Ограничиваем контекст ---
+    if not chunks:
+        if case_num:
+            return None, f"По делу {case_num} сведений в базе нет.", {}
+        else:
+            return None, "По запросу подходящих фрагментов не найдено.", {}
+
+    # Ограничение количества чанков; дело целиком под map-reduce не режем —
+    # не влезет в бюджет, так map (6a) получит его полностью
+    map_reduce = bool(want_all and case_num and MAP_REDUCE)
+    if not map_reduce:
+        chunks = chunks[:MAX_CHUNKS]
+
+    # --- 6. Укладываем контекст в бюджет токенов и собираем промпт ---
+    overhead = _n_tokens(PROMPT_TEMPLATE.format(context="", question=question))
+    budget = min(CONTEXT_MAX_TOKENS,
+                 CONTEXT_WINDOW - overhead - max_tokens - PROMPT_SAFETY_TOKENS)
+    context, ctx_tokens, used, truncated = _pack_context(chunks, max(budget, 0), sep)
+    map_info = None
+    if truncated and map_reduce:
+        # --- 6a. Дело целиком не влезло: выжимки частей (map) → ответ по ним (reduce) ---
+        summaries, from_cache = _map_case(chunks, sep)
+        parts = [f"[Выжимка части {i} из {len(summaries)}]\n{text}"
+                 for i, text in enumerate(summaries, 1)]
+        context, ctx_tokens, used, truncated = _pack_context(parts, max(budget, 0))
+        map_info = {"slices": len(summaries), "cached": from_cache}
+    if truncated:
+        # для правила «анализ на основе сокращённого набора фрагментов»
+        context += CONTEXT_SEP + "[часть фрагментов не вошла в лимит контекста]"
+    prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+    meta = {
+        "context_tokens": ctx_tokens,
+        "prompt_tokens": overhead + ctx_tokens,
+        "chunks": used,
+        "chunks_found": len(chunks),
+        "truncated": truncated,
+    }
+    if case_chunks is not None:
+        meta.update(case_chunks=case_chunks, stitched=not sep)
+    if map_info:
+        meta["map_reduce"] = map_info
+    return prompt, None, meta
+
+
+def _answer(question: str, max_tokens: int = 250):
+    prompt, ready, meta = _build_prompt(question, max_tokens)
+    if ready is not None:
+        return ready, meta
+
+    # --- 7. GPT запрос (не больше LLM_MAX_CONCURRENT одновременно) ---
+    with LLM_GATE.slot():
+        rsp = openai_client.responses.create(
+            model=GPT5_MODEL,
+            input=prompt,
+            max_output_tokens=max_tokens
+        )
 
     text = getattr(rsp, "output_text", None)
-    return text.strip() if text else "[Пустой ответ]"
+    return (text.strip() if text else EMPTY_ANSWER), meta
+
+
+def _ask_stream(question: str, max_tokens: int = 250,
+                meta: Optional[dict] = None) -> Iterator[str]:
+    """
+    Как _ask, но отдаёт ответ кусками по мере генерации (stream=True);
+    meta (если передан) заполняется до первого куска. Готовые ответы (кэш,
+    «сведений нет») — одним куском. В кэш попадает только ответ,
+    дочитанный до конца.
+    """
+    meta = {} if meta is None else meta
+    key, version, cached = _cached_answer(question, max_tokens)
+    if cached is not None:
+        meta.update(cached[1], cached=True)
+        yield cached[0]
+        return
+    prompt, ready, info = _build_prompt(question, max_tokens)
+    meta.update(info)
+    if ready is not None:
+        _remember_answer(key, version, ready, info)
+        yield ready
+        return
+
+    parts: List[str] = []
+    with LLM_GATE.slot():
+        stream = openai_client.responses.create(
+            model=GPT5_MODEL,
+            input=prompt,
+            max_output_tokens=max_tokens,
+            stream=True,
+        )
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                parts.append(event.delta)
+                yield event.delta
+            elif event.type in ("error", "response.failed"):
+                raise RuntimeError(getattr(event, "message", None) or "генерация прервана")
+
+    answer = "".join(parts).strip()
+    if not answer:
+        yield EMPTY_ANSWER
+        return
+    _remember_answer(key, version, answer, info)
 
 
 # ─────────────────── Flask-эндпоинт ───────────────────
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.get_json(force=True)
+def _flight(question: str, limit: int, stream: bool):
+    """
+    (расчёт, подключились ли к идущему). Ключ — как у кэша ответов, поэтому
+    /chat и /chat/stream с одним вопросом тоже сливаются. Очередь LLM
+    проверяем только для нового расчёта.
+    """
+    key = ANSWER_CACHE.key(question, canonical_case(question), limit)
+    if not COALESCE:
+        key += ":" + os.urandom(8).hex()   # у каждого запроса свой расчёт
+
+    def produce(meta: dict) -> Iterator[str]:
+        if stream:
+            yield from _ask_stream(question, max_tokens=limit, meta=meta)
+        else:
+            answer, info = _ask(question, max_tokens=limit)
+            meta.update(info)
+            yield answer
+
+    def check_gate():
+        # очередь к LLM уже полна — не тратим поиск и эмбеддинг впустую
+        if LLM_GATE.saturated():
+            raise Overloaded(LLM_GATE.retry_after())
+
+    return FLIGHTS.join(key, produce, before_start=check_gate)
+
+
+def _chat_request():
+    """(вопрос, лимит токенов, None) или (None, None, ответ-ошибка 400)."""
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return None, None, (jsonify({"error": "JSON object body required"}), 400)
     msgs = data.get("messages")
-    if not msgs:
-        return jsonify({"error": "'messages' array required"}), 400
+    if not msgs or not isinstance(msgs, list):
+        return None, None, (jsonify({"error": "'messages' array required"}), 400)
 
-    user_msg = next((m for m in reversed(msgs) if m.get("role") == "user"), None)
-    if not user_msg:
-        return jsonify({"error": "no user message"}), 400
+    user_msg = next((m for m in reversed(msgs)
+                     if isinstance(m, dict) and m.get("role") == "user"), None)
+    if not user_msg or not isinstance(user_msg.get("content"), str):
+        return None, None, (jsonify({"error": "no user message"}), 400)
 
     try:
         limit = int(data.get("max_tokens", 5_00))
-        # жёстко ограничим диапазон, чтобы избежать злоупотреблений
-        limit = max(250, min(limit, 16_000))
-        answer = _ask(user_msg["content"], max_tokens=limit)
-        return jsonify({"answer": answer})
+    except (TypeError, ValueError):
+        return None, None, (jsonify({"error": "'max_tokens' must be an integer"}), 400)
+    # жёстко ограничим диапазон, чтобы избежать злоупотреблений
+    limit = max(250, min(limit, 16_000))
+    return user_msg["content"], limit, None
+
+
+def _overloaded(exc: Overloaded):
+    rsp = jsonify({"error": str(exc), "retry_after": exc.retry_after})
+    rsp.status_code = 429
+    rsp.headers["Retry-After"] = str(exc.retry_after)
+    return rsp
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    try:
+        question, limit, err = _chat_request()
+        if err:
+            return err
+        flight, joined = _flight(question, limit, stream=False)
+        answer = "".join(SingleFlight.follow(flight)).strip() or EMPTY_ANSWER
+        meta = {**flight.meta, "coalesced": True} if joined else flight.meta
+        return jsonify({"answer": answer, "meta": meta})
+    except Overloaded as exc:
+        return _overloaded(exc)
     except Exception as exc:
         # залогировать подробности на консоль
         logging.exception("Error in /chat")
@@ -271,5 +1373,74 @@ def chat():
         }), 500
 
 
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    То же, что /chat, но ответ — server-sent events по мере генерации:
+        event: delta  data: {"text": "…"}     — очередной кусок ответа
+        event: done   data: {"meta": {…}}    — как "meta" в ответе /chat
+        event: error  data: {"error": "…", ["retry_after": N]}
+    Ошибки после начала потока приходят событием error, статус уже 200.
+    """
+    try:
+        question, limit, err = _chat_request()
+        if err:
+            return err
+        flight, joined = _flight(question, limit, stream=True)
+    except Overloaded as exc:
+        return _overloaded(exc)
+    except Exception as exc:
+        # до начала потока — как /chat: JSON с ошибкой и стеком
+        logging.exception("Error in /chat/stream")
+        return jsonify({
+            "error": str(exc),
+            "trace": traceback.format_exc().splitlines()
+        }), 500
+
+    def events():
+        try:
+            for piece in SingleFlight.follow(flight):
+                yield _sse("delta", {"text": piece})
+            meta = {**flight.meta, "coalesced": True} if joined else flight.meta
+            yield _sse("done", {"meta": meta})
+        except Overloaded as exc:
+            yield _sse("error", {"error": str(exc), "retry_after": exc.retry_after})
+        except Exception as exc:
+            logging.exception("Error in /chat/stream")
+            yield _sse("error", {"error": str(exc)})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({
+        "llm_active": LLM_GATE.active,
+        "llm_waiting": LLM_GATE.waiting,
+        "llm_rejected": LLM_GATE.rejected,
+        "llm_avg_sec": round(LLM_GATE.avg_sec, 2),
+        "embed_cache": EMBED_CACHE.summary(),
+        "answer_cache": ANSWER_CACHE.summary(),
+        "summary_cache": SUMMARY_CACHE.summary(),
+        "single_flight": dict(FLIGHTS.stats),
+    })
+
+
+def _log_collection_target():
+    """При старте пишем в лог, на какую коллекцию смотрит alias."""
+    try:
+        aliases = {a.alias_name: a.collection_name for a in qdrant.get_aliases().aliases}
+    except Exception as exc:
+        logging.warning("Не удалось получить alias-ы Qdrant: %s", exc)
+        return
+    if COLLECTION in aliases:
+        logging.info("%s → %s (alias)", COLLECTION, aliases[COLLECTION])
+    else:
+        logging.info("%s — обычная коллекция, без alias", COLLECTION)
+
+
 if __name__ == "__main__":
+    # dev-сервер для отладки; в production — python serve.py (gevent)
+    _log_collection_target()
     app.run(debug=True, host="0.0.0.0", port=5005)